@@ -0,0 +1,121 @@
+import logging
+import threading
+from typing import Optional
+
+#
+# AIMD controller for the number of images (per-image import) or chunks of
+# images (bulk import) processed concurrently by add_plate_to_db (the thread
+# pool sized by THREADPOOL_WORKERS before)
+#
+# The right concurrency differs between a local disk, NFS and a database that is
+# busy with the webserver, so it is found at runtime: after every window of
+# images the limit goes up by one while the per-image latency stays close to the
+# best latency seen (baseline), and is halved when latency grows, time spent
+# waiting for a free DB connection (all of the pool's in use) becomes a large
+# part of it, or images fail.
+#
+
+
+class AdaptiveConcurrency:
+    """
+    Concurrency limit between min_limit and max_limit, adjusted from record()ed
+    per-image latencies and DB pool wait times, see the module comment.
+    """
+
+    # the baseline creeps up this much per window, so a lasting slowdown (e.g. a
+    # slower mount) becomes the new normal instead of keeping the limit at minimum
+    BASELINE_DRIFT = 1.02
+
+    def __init__(self, initial: int, min_limit: int = 1, max_limit: int = 8, window: int = 50,
+                 tolerance: float = 1.5, pool_wait_fraction: float = 0.2, decrease_factor: float = 0.5,
+                 enabled: bool = True):
+        self._lock = threading.Lock()
+        self.tolerance = tolerance
+        self.pool_wait_fraction = pool_wait_fraction
+        self.decrease_factor = decrease_factor
+        self.configure(initial, min_limit, max_limit, window, enabled)
+
+    def configure(self, initial: int, min_limit: int, max_limit: int, window: int = 50, enabled: bool = True) -> None:
+        """
+        Sets the bounds and starts over from initial (enabled=False keeps the limit at initial)
+        """
+        with self._lock:
+            self.min_limit = max(1, min_limit)
+            self.max_limit = max(self.min_limit, max_limit)
+            self.limit = min(max(initial, self.min_limit), self.max_limit)
+            self.window = max(1, window)
+            self.enabled = enabled
+            self.baseline: Optional[float] = None
+            # averages per image of the last complete window, for logs and metrics
+            self.latency = 0.0
+            self.pool_wait = 0.0
+            self._count = 0
+            self._latency_sum = 0.0
+            self._pool_wait_sum = 0.0
+            self._errors = 0
+
+    def record(self, latency: float, pool_wait: float = 0.0, ok: bool = True, count: int = 1) -> None:
+        """
+        One processed image: seconds it took and seconds of it spent waiting for a free DB
+        connection. For a chunk of count images, latency and pool_wait are per image.
+        """
+        with self._lock:
+            self._count += count
+            self._latency_sum += latency * count
+            self._pool_wait_sum += pool_wait * count
+            if not ok:
+                self._errors += 1
+            if self._count >= self.window:
+                self._adjust()
+
+    def _adjust(self) -> None:
+        latency = self._latency_sum / self._count
+        pool_wait = self._pool_wait_sum / self._count
+        errors = self._errors
+        self._count = 0
+        self._latency_sum = 0.0
+        self._pool_wait_sum = 0.0
+        self._errors = 0
+        self.latency = latency
+        self.pool_wait = pool_wait
+
+        if self.baseline is None:
+            # the first window opens the pool's connections, it only gives the baseline
+            self.baseline = latency
+            return
+        if latency < self.baseline:
+            self.baseline = latency
+        else:
+            self.baseline *= self.BASELINE_DRIFT
+
+        if not self.enabled:
+            return
+
+        if errors:
+            reason = f"{errors} failed"
+        elif latency > self.baseline * self.tolerance:
+            reason = "latency above baseline"
+        elif pool_wait > latency * self.pool_wait_fraction:
+            reason = "waiting for a free db connection"
+        else:
+            reason = None
+
+        previous = self.limit
+        if reason is None:
+            self.limit = min(self.limit + 1, self.max_limit)
+        else:
+            self.limit = max(int(self.limit * self.decrease_factor), self.min_limit)
+
+        if self.limit != previous:
+            # the progress logs of add_plate_to_db show the limit, only decreases are logged here at info
+            logging.log(logging.DEBUG if reason is None else logging.INFO,
+                        f"concurrency: workers {previous} -> {self.limit}"
+                        f"{' (' + reason + ')' if reason else ''}, {self.describe()}")
+
+    def describe(self) -> str:
+        return (f"latency {self.latency * 1000:.1f}ms (baseline {(self.baseline or 0) * 1000:.1f}ms), "
+                f"db pool wait {self.pool_wait * 1000:.1f}ms")
+
+
+# process wide controller, configured from the THREADPOOL_WORKERS* settings in image_monitor
+add_plate_concurrency = AdaptiveConcurrency(initial=5)
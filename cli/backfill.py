@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import multiprocessing
+import os
+import queue
+import time
+import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional, Tuple
+
+import file_utils
+import filenames.filename_parser
+import image_monitor
+import settings as imgdb_settings
+from database import Database
+from file_utils import WalkCache
+from image import ImageRecord
+from ingest_journal import IngestJournal, open_journal
+from io_scheduler import BULK, IOScheduler, parse_limits
+
+#
+# Backfill: imports the whole history of the root dirs, instead of an exhaustive
+# initial poll of image_monitor
+#
+# - folders are listed and parsed in a process pool, this process writes them
+#   with COPY, one acquisition per transaction. A folder whose worker died (e.g.
+#   OOM) is tried once more in a new pool, then counted as failed
+# - completed folders are checkpointed (SQLite), a restarted run skips the ones
+#   that have not changed since
+# - images/s can be limited per mount, so live acquisitions are not starved (the
+#   thumbnails also wait for the IO_* limits of the shared io scheduler, bulk lane)
+# - folders of a mount are not dispatched while image_monitor reads that mount in
+#   the live lane (io_live_lane table, when IO_SHARED_LIVE_LANE is on)
+# - the written tables are analyzed at the end
+#
+# python3 backfill.py /share/mikro2/squid --workers 8 --no-thumbnails --mount-rate /share/mikro2=500
+#
+
+WRITTEN_TABLES = ['images', 'plate_acquisition', 'upload_to_s3']
+
+# (folder, dir_mtime, checked_at, file_count, metas, error)
+FolderResult = Tuple[str, float, float, int, list, Optional[str]]
+
+# a folder is listed this many times when the worker listing it dies
+MAX_FOLDER_ATTEMPTS = 2
+
+
+def list_and_parse_folder(folder: str) -> FolderResult:
+    """
+    Runs in the parse pool: lists the image files of folder and parses them
+    """
+    try:
+        checked_at = time.time()
+        # stat before listing, like import_plate_images_and_meta
+        dir_mtime = os.stat(folder).st_mtime
+        # sorted, the first image of an acquisition creates its plate_acquisition row, as in image_monitor
+        paths = sorted(file_utils.iter_image_files(folder))
+        try:
+            metas = filenames.filename_parser.parse_files_in_folder(folder, paths)
+        except Exception:
+            # one file the parsers don't match fails the folder, parse one at a time instead
+            metas = [_parse_or_none(path) for path in paths]
+        return folder, dir_mtime, checked_at, len(paths), metas, None
+    except Exception:
+        return folder, 0.0, 0.0, 0, [], traceback.format_exc()
+
+
+def _parse_or_none(path: str) -> Optional[dict]:
+    try:
+        return filenames.filename_parser.parse_path_and_file(path)
+    except Exception:
+        return None
+
+
+class Backfill:
+    """
+    One backfill run over a set of root dirs, see the module comment
+    """
+
+    def __init__(self, workers: int, throttle: IOScheduler, checkpoint: Optional[IngestJournal] = None,
+                 make_thumbnails: bool = True, chunk_size: int = 10000, finished_margin: float = 7200):
+        self.workers = workers
+        self.throttle = throttle
+        self.checkpoint = checkpoint
+        self.make_thumbnails = make_thumbnails
+        self.chunk_size = chunk_size
+        self.finished_margin = finished_margin
+        self.counts = {'folders': 0, 'skipped': 0, 'failed': 0, 'images': 0, 'inserted': 0, 'unparsed': 0}
+        self._start = time.time()
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    def discover(self, roots: List[str]) -> List[str]:
+        """
+        Image dirs below roots, without the ones checkpointed and unchanged since
+        """
+        cache = WalkCache()
+        folders = []
+        for img_dir in file_utils.find_dirs_containing_img_files_recursive_from_list_of_paths(
+                roots, skip_dirs=image_monitor.blacklist, cache=cache):
+            folder = str(img_dir)
+            if self.checkpoint is not None:
+                dir_mtime = cache.mtime_of(folder)
+                if dir_mtime is None:
+                    dir_mtime = os.stat(folder).st_mtime
+                if self.checkpoint.is_unchanged(folder, dir_mtime):
+                    self.counts['skipped'] += 1
+                    continue
+            folders.append(folder)
+        logging.info(f"backfill: {len(folders)} folders to import, {self.counts['skipped']} unchanged since checkpoint")
+        return folders
+
+    def run(self, roots: List[str], analyze: bool = True) -> None:
+        image_monitor.connect_to_db()
+        image_monitor.configure_io_scheduler()
+        image_monitor.share_io_live_lane(self.throttle)
+        Database.get_instance().load_channel_map_mapping()
+        folders = self.discover(roots)
+        self._pool = self._new_pool()
+        try:
+            self._import(folders)
+        finally:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+        if self.make_thumbnails and image_monitor.thumbnail_stage is not None:
+            logging.info("backfill: waiting for thumbnails")
+            image_monitor.thumbnail_stage.close()
+
+        if analyze:
+            t_analyze = time.time()
+            Database.get_instance().analyze_tables(WRITTEN_TABLES)
+            logging.info(f"backfill: analyzed {', '.join(WRITTEN_TABLES)} in {time.time() - t_analyze:.1f}s")
+
+        self._log_progress(len(folders), done=True)
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        # spawn, so that no worker inherits the database connections of this process
+        return ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+    def _replace_pool(self, broken: ProcessPoolExecutor) -> None:
+        # all folders in flight in a broken pool fail with it, only the first one replaces it
+        if self._pool is broken:
+            logging.error("backfill: a parse worker died, starting a new pool")
+            broken.shutdown(wait=False)
+            self._pool = self._new_pool()
+
+    def _import(self, folders: List[str]) -> None:
+        pending: Dict[str, deque] = {}
+        for folder in folders:
+            pending.setdefault(self.throttle.mount(folder), deque()).append(folder)
+        in_flight: Dict[str, int] = {mount: 0 for mount in pending}
+        attempts: Dict[str, int] = {}
+        max_in_flight = self.workers * 2
+        results: queue.Queue = queue.Queue()
+
+        def dispatch(mount: str) -> None:
+            folder = pending[mount].popleft()
+            pool = self._pool
+            try:
+                future = pool.submit(list_and_parse_folder, folder)
+            except BrokenProcessPool:
+                self._replace_pool(pool)
+                pool = self._pool
+                future = pool.submit(list_and_parse_folder, folder)
+            in_flight[mount] += 1
+            future.add_done_callback(lambda fut, f=folder, p=pool: results.put((f, p, fut)))
+
+        total = len(folders)
+        while any(pending.values()) or sum(in_flight.values()):
+            # round robin over the mounts, so that one big mount does not take all workers
+            dispatched = True
+            while dispatched and sum(in_flight.values()) < max_in_flight:
+                dispatched = False
+                for mount, mount_folders in pending.items():
+                    if not mount_folders or sum(in_flight.values()) >= max_in_flight:
+                        continue
+                    # a rate limited mount has one folder in flight, the next one waits until it is paid for;
+                    # any mount waits while image_monitor reads it in the live lane
+                    if self.throttle.wait_time(mount) > 0 or (self.throttle.is_limited(mount) and in_flight[mount]):
+                        continue
+                    dispatch(mount)
+                    dispatched = True
+
+            delays = [self.throttle.wait_time(mount) for mount, mount_folders in pending.items()
+                      if mount_folders and not in_flight[mount]]
+            timeout = min([d for d in delays if d > 0], default=1.0)
+            try:
+                folder, pool, future = results.get(timeout=timeout)
+            except queue.Empty:
+                continue
+
+            mount = self.throttle.mount(folder)
+            in_flight[mount] -= 1
+            try:
+                result = future.result()
+            except BrokenProcessPool:
+                # the worker died (e.g. OOM), or another one in the same pool did
+                self._replace_pool(pool)
+                attempts[folder] = attempts.get(folder, 0) + 1
+                if attempts[folder] < MAX_FOLDER_ATTEMPTS:
+                    pending[mount].appendleft(folder)
+                    continue
+                result = (folder, 0.0, 0.0, 0, [], "parse worker died")
+            except Exception as e:
+                result = (folder, 0.0, 0.0, 0, [], repr(e))
+            self.throttle.charge(mount, files=result[3])
+            try:
+                self._write_folder(result)
+            except Exception:
+                logging.exception("backfill: could not write folder: " + str(result[0]))
+                self.counts['failed'] += 1
+
+            self.counts['folders'] += 1
+            if self.counts['folders'] % 100 == 0:
+                self._log_progress(total)
+
+    def _write_folder(self, result: FolderResult) -> None:
+        folder, dir_mtime, checked_at, file_count, metas, error = result
+        if error is not None:
+            logging.error(f"backfill: could not list/parse {folder}: {error}")
+            self.counts['failed'] += 1
+            return
+
+        by_acq_folder: Dict[str, List[ImageRecord]] = {}
+        unparsed = 0
+        for meta in metas:
+            if meta is None:
+                unparsed += 1
+                continue
+            img = ImageRecord.from_meta(meta)
+            if not img.is_thumbnail():
+                by_acq_folder.setdefault(img.get_folder(), []).append(img)
+
+        inserted_count = 0
+        is_old = dir_mtime < time.time() - self.finished_margin
+        for acq_folder, images in by_acq_folder.items():
+            plate_acq_id = Database.get_instance().select_or_insert_plate_acq(images[0])
+            inserted = Database.get_instance().insert_images_batch(images, plate_acq_id, self.chunk_size, use_copy=True)
+            inserted_count += len(inserted)
+
+            if self.make_thumbnails:
+                for img, _ in inserted:
+                    image_monitor.make_thumb(img, BULK)
+
+            # nothing is added to old folders any more, finish them here instead of waiting for image_monitor,
+            # as of the last change of the folder rather than now
+            if is_old:
+                Database.get_instance().update_acquisition_finished_if_unset(acq_folder, dir_mtime)
+
+        self.counts['images'] += file_count
+        self.counts['inserted'] += inserted_count
+        self.counts['unparsed'] += unparsed
+
+        if unparsed:
+            # not checkpointed, a later run (with fixed parsers) tries the folder again
+            logging.warning(f"backfill: {unparsed}/{file_count} files could not be parsed in {folder}")
+        elif self.checkpoint is not None:
+            self.checkpoint.record(folder, file_count, dir_mtime, checked_at, inserted_count > 0)
+
+    def _log_progress(self, total: int, done: bool = False) -> None:
+        elapsed = time.time() - self._start
+        counts = self.counts
+        logging.info(f"backfill{' done' if done else ''}: {counts['folders']}/{total} folders, "
+                     f"{counts['images']} images ({counts['inserted']} new, {counts['unparsed']} unparsed), "
+                     f"{counts['failed']} folders failed, {counts['skipped']} skipped, in {elapsed:.0f}s "
+                     f"({counts['images'] / max(elapsed, 1e-6):.0f} images/s)")
+
+
+def main():
+    LOG_LEVEL = imgdb_settings.LOG_LEVEL.upper()
+    logging.basicConfig(
+        format='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        level=getattr(logging, LOG_LEVEL, logging.INFO)
+    )
+
+    parser = argparse.ArgumentParser(description='Imports the whole history of the root dirs (backfill)')
+    parser.add_argument('roots', nargs='*', help='Root dirs, default PROJ_ROOT_DIRS')
+    parser.add_argument('--workers', type=int, default=imgdb_settings.BACKFILL_WORKERS,
+                        help='Parse processes, 0 = cpu count')
+    parser.add_argument('--checkpoint', default=imgdb_settings.BACKFILL_CHECKPOINT_FILE,
+                        help="Checkpoint file of completed folders, '' = no checkpoint")
+    parser.add_argument('--no-thumbnails', action='store_true', help='Do not make thumbnails')
+    parser.add_argument('--no-analyze', action='store_true', help='Do not ANALYZE the tables at the end')
+    parser.add_argument('--mount-rate', action='append', default=[], metavar='PATH=IMAGES_PER_SEC',
+                        help='Max images/s read below PATH (repeatable), added to BACKFILL_MOUNT_RATES')
+    parser.add_argument('--rate', type=float, default=imgdb_settings.BACKFILL_RATE,
+                        help='Max images/s per mount for mounts without their own rate, 0 = unlimited')
+    parser.add_argument('--chunk-size', type=int, default=10000, help='Images per COPY transaction')
+    args = parser.parse_args()
+
+    roots = args.roots or imgdb_settings.PROJ_ROOT_DIRS
+    if isinstance(roots, str):
+        roots = [roots]
+
+    rates = parse_limits(imgdb_settings.BACKFILL_MOUNT_RATES)
+    rates.update(parse_limits(','.join(args.mount_rate)))
+    throttle = IOScheduler()
+    throttle.configure(files_per_sec=rates, bytes_per_sec={}, default_files_per_sec=args.rate)
+
+    checkpoint = open_journal(args.checkpoint) if args.checkpoint else None
+    backfill = Backfill(
+        workers=args.workers or os.cpu_count() or 1,
+        throttle=throttle,
+        checkpoint=checkpoint,
+        make_thumbnails=not args.no_thumbnails,
+        chunk_size=args.chunk_size,
+        finished_margin=float(imgdb_settings.LATEST_FILE_CHANGE_MARGIN)
+    )
+    try:
+        backfill.run(roots, analyze=not args.no_analyze)
+    finally:
+        if checkpoint is not None:
+            checkpoint.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,27 +1,42 @@
 from __future__ import annotations
+import io
 import logging
 import threading
+import time
 from datetime import datetime
-from typing import Any, List, Optional
+from typing import Any, Dict, List, Optional, Set, Tuple
 import json
 
 import psycopg2
-from psycopg2 import pool
-from psycopg2.extras import RealDictCursor
+from psycopg2 import pool, sql
+from psycopg2.extras import RealDictCursor, execute_values
 
 import settings as imgdb_settings
+from stage_profiler import profiler
 from image import Image  # Make sure this import does not create a circular dependency
 
 class Database:
     _instance: Optional[Database] = None
     _lock = threading.Lock()
     _pool_init_lock = threading.Lock()
+    _cache_lock = threading.Lock()
 
     def __new__(cls, *args, **kwargs) -> Database:
         with cls._lock:
             if cls._instance is None:
                 cls._instance = super().__new__(cls)
                 cls._instance.connection_pool = None  # Will be set during initialization
+                # folder -> plate_acquisition.id, all images in a folder map to the same acquisition
+                cls._instance._plate_acq_cache = {}
+                # (lowercase filter, channel_map_id) from channel_map_mapping, longest filter first
+                cls._instance._channel_map_filters = None
+                # per thread seconds spent waiting for a free connection, see pool_wait_seconds
+                cls._instance._pool_wait = threading.local()
+                # one slot per connection the pool may open, get_connection waits for a free one
+                cls._instance._pool_slots = None
+                # connections checked out with get_connection and not yet released, see pool_stats
+                cls._instance._pool_in_use = 0
+                cls._instance._pool_in_use_lock = threading.Lock()
         return cls._instance
 
     @classmethod
@@ -45,6 +60,7 @@ class Database:
                     maxconn=10,
                     **connection_info
                 )
+                self._pool_slots = threading.BoundedSemaphore(self.connection_pool.maxconn)
                 self.initialized = True
                 logging.info("Database connection pool initialized.")
             except Exception as e:
@@ -54,41 +70,169 @@ class Database:
     def get_connection(self):
         if self.connection_pool is None:
             raise Exception("Connection pool has not been initialized.")
-        return self.connection_pool.getconn()
+        # ThreadedConnectionPool raises PoolError when all connections are in use,
+        # wait for one to be released instead
+        start = time.perf_counter()
+        self._pool_slots.acquire()
+        self._pool_wait.seconds = getattr(self._pool_wait, 'seconds', 0.0) + time.perf_counter() - start
+        try:
+            conn = self.connection_pool.getconn()
+        except Exception:
+            self._pool_slots.release()
+            raise
+        with self._pool_in_use_lock:
+            self._pool_in_use += 1
+        return conn
+
+    def pool_wait_seconds(self) -> float:
+        """
+        Seconds the calling thread has spent waiting for a free connection (all of the
+        pool's connections in use), for the adaptive concurrency of image_monitor
+        """
+        return getattr(self._pool_wait, 'seconds', 0.0)
+
+    def pool_stats(self) -> Tuple[int, int]:
+        """
+        Returns (connections in use, max connections) of the connection pool
+        """
+        if self.connection_pool is None:
+            return 0, 0
+        with self._pool_in_use_lock:
+            return self._pool_in_use, self.connection_pool.maxconn
 
     def release_connection(self, conn) -> None:
         if self.connection_pool:
-            self.connection_pool.putconn(conn)
+            try:
+                self.connection_pool.putconn(conn)
+            finally:
+                with self._pool_in_use_lock:
+                    self._pool_in_use -= 1
+                self._pool_slots.release()
         else:
             raise Exception("Connection pool has not been initialized.")
 
-    def resolve_channel_map_id(self, conn, img: Image) -> Optional[int]:
+    def has_table(self, table: str, column: Optional[str] = None) -> bool:
         """
-        Resolve the final channel_map_id for a plate acquisition.
+        True if table (and its column, if given) is in the database, for the parts of
+        the schema that db/migrations.sql adds to an existing database
+        """
+        if column is None:
+            query = "SELECT to_regclass(%s) IS NOT NULL"
+            params: Tuple = (table,)
+        else:
+            query = """
+                SELECT EXISTS (SELECT 1 FROM information_schema.columns
+                               WHERE table_name = %s AND column_name = %s)
+            """
+            params = (table, column)
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+                return bool(cursor.fetchone()[0])
+        except Exception as err:
+            logging.exception("Error checking database schema")
+            raise err
+        finally:
+            self.release_connection(conn)
 
-        Uses the parser-provided channel_map_id as the default, then applies
-        the most specific substring match from channel_map_mapping.filter
-        against the full image path.
+    def has_trigger(self, table: str, trigger: str) -> bool:
+        """
+        True if the trigger is on table
+        """
+        query = "SELECT EXISTS (SELECT 1 FROM pg_trigger WHERE tgrelid = to_regclass(%s) AND tgname = %s)"
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (table, trigger))
+                return bool(cursor.fetchone()[0])
+        except Exception as err:
+            logging.exception("Error checking database schema")
+            raise err
+        finally:
+            self.release_connection(conn)
+
+    # --------------------------------------------------------------------------
+    # In-process caches
+    # --------------------------------------------------------------------------
+    def invalidate_plate_acq_cache(self, folder: Optional[str] = None) -> None:
+        """
+        Drops the cached plate acquisition id for a folder, or all of them if
+        no folder is given. Must be called when an acquisition is moved (e.g.
+        to trash) since its folder then changes in the database.
+        """
+        with self._cache_lock:
+            if folder is None:
+                self._plate_acq_cache.clear()
+            else:
+                self._plate_acq_cache.pop(folder, None)
+
+    def _get_cached_plate_acq_id(self, folder: str) -> Optional[int]:
+        with self._cache_lock:
+            return self._plate_acq_cache.get(folder)
+
+    def _set_cached_plate_acq_id(self, folder: str, plate_acq_id: int) -> None:
+        with self._cache_lock:
+            self._plate_acq_cache[folder] = plate_acq_id
+
+    def load_channel_map_mapping(self, conn=None) -> None:
+        """
+        Loads all channel_map_mapping filters into memory so that
+        resolve_channel_map_id does not need a query per new acquisition.
+        Intended to be called once per poll.
         """
-        default_channel_map_id = img.get_channel_map_id()
         query = """
-            SELECT channel_map_id
+            SELECT LOWER(filter), channel_map_id
             FROM channel_map_mapping
             WHERE filter IS NOT NULL
               AND filter <> ''
-              AND POSITION(LOWER(filter) IN LOWER(%s)) > 0
             ORDER BY LENGTH(filter) DESC
-            LIMIT 1
         """
+        own_conn = conn is None
+        if own_conn:
+            conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query)
+                filters = [(row[0], row[1]) for row in cursor.fetchall()]
+        except Exception as err:
+            logging.exception("Error loading channel_map_mapping")
+            raise err
+        finally:
+            if own_conn:
+                self.release_connection(conn)
+
+        with self._cache_lock:
+            self._channel_map_filters = filters
+
+    def resolve_channel_map_id(self, conn, img: Image) -> Optional[int]:
+        """
+        Resolve the final channel_map_id for a plate acquisition.
+
+        Uses the parser-provided channel_map_id as the default, then applies
+        the most specific (longest) substring match from channel_map_mapping.filter
+        against the full image path. Filters are matched in memory, they are
+        loaded with load_channel_map_mapping (lazily, if not done already).
+        """
+        filters = self._channel_map_filters
+        if filters is None:
+            self.load_channel_map_mapping(conn)
+            filters = self._channel_map_filters
 
-        with conn.cursor() as cursor:
-            cursor.execute(query, (img.get_path(),))
-            row = cursor.fetchone()
+        path_lower = img.get_path().lower()
+        for filter_lower, channel_map_id in filters:
+            if filter_lower in path_lower:
+                return channel_map_id
 
-        if row is None:
-            return default_channel_map_id
+        return img.get_channel_map_id()
 
-        return row[0]
+    @staticmethod
+    def _images_row(img: Image, plate_acq_id: Any) -> Tuple:
+        """
+        Column values for one row in the 'images' table, in the same order as
+        the column list used by the insert queries below.
+        """
+        return img.images_row(plate_acq_id)
 
     # --------------------------------------------------------------------------
     # Query methods
@@ -110,25 +254,13 @@ class Database:
                 path
             )
             VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (path) DO NOTHING
             RETURNING id
         """
         conn = self.get_connection()
         try:
             with conn.cursor() as cursor:
-                cursor.execute(
-                    query,
-                    [
-                        plate_acq_id,
-                        img.get_plate_barcode(),
-                        img.get_timepoint(),
-                        img.get("well"),
-                        img.get("wellsample"),
-                        img.get("channel"),
-                        img.get("channel_name"),
-                        img.get("z", 0),
-                        img.get_path()
-                    ]
-                )
+                cursor.execute(query, self._images_row(img, plate_acq_id))
                 row = cursor.fetchone()
             conn.commit()
 
@@ -193,6 +325,142 @@ class Database:
         finally:
             self.release_connection(conn)
 
+    def insert_images_batch(self, images: List[Image], plate_acq_id: Any, chunk_size: int = 1000,
+                            use_copy: bool = False) -> List[Tuple[Image, Any]]:
+        """
+        Bulk inserts images belonging to one plate acquisition into the 'images'
+        table, together with their 'upload_to_s3' rows.
+
+        Every chunk is written with execute_values inside a single transaction,
+        instead of one round trip and commit per statement and image.
+        With use_copy the chunk is instead streamed with COPY into a temp table
+        and inserted from there, which is faster for large chunks (backfill).
+        Images whose path is already in the 'images' table are skipped
+        (ON CONFLICT DO NOTHING on the unique path index).
+        Returns a list of (img, image_id) for the newly inserted images.
+        """
+        inserted = []
+        for start in range(0, len(images), chunk_size):
+            chunk = images[start:start + chunk_size]
+            inserted.extend(self._insert_images_chunk(chunk, plate_acq_id, use_copy))
+        return inserted
+
+    @staticmethod
+    def _copy_text(rows: List[Tuple]) -> io.StringIO:
+        """
+        Rows in COPY text format (tab separated, \\N for NULL)
+        """
+        def field(value):
+            if value is None:
+                return '\\N'
+            return (str(value).replace('\\', '\\\\').replace('\t', '\\t')
+                    .replace('\n', '\\n').replace('\r', '\\r'))
+
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(field(value) for value in row))
+            buffer.write('\n')
+        buffer.seek(0)
+        return buffer
+
+    def _copy_images_rows(self, cursor, rows: List[Tuple]) -> List[Tuple]:
+        """
+        COPY rows into a temp table, then insert them into 'images' from there
+        (COPY itself can not skip conflicts or return ids). Returns (id, path)
+        of the inserted rows.
+        """
+        columns = "plate_acquisition_id, plate_barcode, timepoint, well, site, channel, channel_name, z, path"
+        cursor.execute(f"""
+            CREATE TEMP TABLE IF NOT EXISTS images_copy ON COMMIT DELETE ROWS AS
+            SELECT {columns} FROM images WITH NO DATA
+        """)
+        cursor.copy_expert(f"COPY images_copy ({columns}) FROM STDIN", self._copy_text(rows))
+        cursor.execute(f"""
+            INSERT INTO images({columns})
+            SELECT {columns} FROM images_copy
+            ON CONFLICT (path) DO NOTHING
+            RETURNING id, path
+        """)
+        return cursor.fetchall()
+
+    def _insert_images_chunk(self, images: List[Image], plate_acq_id: Any, use_copy: bool = False) -> List[Tuple[Image, Any]]:
+        images_query = """
+            INSERT INTO images(
+                plate_acquisition_id,
+                plate_barcode,
+                timepoint,
+                well,
+                site,
+                channel,
+                channel_name,
+                z,
+                path
+            )
+            VALUES %s
+            ON CONFLICT (path) DO NOTHING
+            RETURNING id, path
+        """
+        upload_query = """
+            INSERT INTO upload_to_s3 (
+                image_id,
+                path,
+                acq_id,
+                project,
+                status
+            )
+            VALUES %s
+            ON CONFLICT (path) DO NOTHING
+        """
+        folder = images[0].get_folder() if images else None
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                t_insert = time.perf_counter()
+                images_rows = [self._images_row(img, plate_acq_id) for img in images]
+                if use_copy:
+                    rows = self._copy_images_rows(cursor, images_rows)
+                else:
+                    rows = execute_values(
+                        cursor,
+                        images_query,
+                        images_rows,
+                        page_size=len(images),
+                        fetch=True
+                    )
+                t_insert = time.perf_counter() - t_insert
+                # Rows that hit ON CONFLICT are not returned
+                ids_by_path = {path: img_id for img_id, path in rows}
+                inserted = []
+                for img in images:
+                    img_id = ids_by_path.pop(img.get_path(), None)
+                    if img_id is not None:
+                        inserted.append((img, img_id))
+
+                upload_rows = [
+                    img.upload_row(img_id, plate_acq_id)
+                    for img, img_id in inserted
+                    if img.is_upload_to_s3()
+                ]
+                if upload_rows:
+                    with profiler.stage('upload_insert', folder, len(upload_rows)):
+                        execute_values(
+                            cursor,
+                            upload_query,
+                            upload_rows,
+                            template="(%s, %s, %s, %s, 'waiting')",
+                            page_size=len(upload_rows)
+                        )
+            t_commit = time.perf_counter()
+            conn.commit()
+            profiler.record('insert', t_insert + time.perf_counter() - t_commit, folder, len(images))
+            return inserted
+        except Exception as err:
+            logging.exception("Error bulk inserting image metadata")
+            conn.rollback()
+            raise err
+        finally:
+            self.release_connection(conn)
+
     def select_plate_acq_id(self, img: Image) -> Optional[Any]:
         """
         Selects an existing plate acquisition id based on the folder.
@@ -264,6 +532,16 @@ class Database:
 
     def select_or_insert_plate_acq(self, img: Image) -> int:
         folder = img.get_folder()
+
+        cached_id = self._get_cached_plate_acq_id(folder)
+        if cached_id is not None:
+            return cached_id
+
+        plate_acq_id = self._select_or_insert_plate_acq(img, folder)
+        self._set_cached_plate_acq_id(folder, plate_acq_id)
+        return plate_acq_id
+
+    def _select_or_insert_plate_acq(self, img: Image, folder: str) -> int:
         parser = img.get_parser()
         meta_json = json.dumps({"parser": parser}) if parser else None
 
@@ -276,7 +554,16 @@ class Database:
                 if row:
                     return row[0]
 
-                # 2) Not found → try to insert
+                # 2) Not found → lock the folder and check again, so that workers in other
+                #    processes can not insert the same acquisition twice (folder is not unique)
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (folder,))
+                cur.execute("SELECT id FROM plate_acquisition WHERE folder = %s", (folder,))
+                row = cur.fetchone()
+                if row:
+                    conn.commit()
+                    return row[0]
+
+                # 3) Still not found → insert
                 channel_map_id = self.resolve_channel_map_id(conn, img)
                 cur.execute("""
                     INSERT INTO plate_acquisition (
@@ -332,6 +619,28 @@ class Database:
         finally:
             self.release_connection(conn)
 
+    def select_image_paths_in_folder(self, folder: str) -> Set[str]:
+        """
+        Returns the set of image paths in the 'images' table located in the given folder.
+        Used to filter out already imported files with one query per folder
+        instead of one EXISTS query per image.
+        """
+        prefix = folder.rstrip("/") + "/"
+        like_prefix = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        # Only files directly in the folder, the ones in subfolders are not fetched
+        # (an acquisition folder can hold large single_images/ trees)
+        query = "SELECT path FROM images WHERE path LIKE %s AND path NOT LIKE %s"
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (like_prefix + "%", like_prefix + "%/%"))
+                return {row[0] for row in cursor.fetchall()}
+        except Exception as err:
+            logging.exception("Error selecting image paths in folder")
+            raise err
+        finally:
+            self.release_connection(conn)
+
     def select_finished_plate_acq_folder(self) -> List[str]:
         """
         Returns a list of folders from plate_acquisition where finished is not null.
@@ -349,6 +658,29 @@ class Database:
         finally:
             self.release_connection(conn)
 
+    def select_finished_plate_acq_folder_since(self, since: Optional[datetime] = None) -> List[Tuple[str, datetime]]:
+        """
+        Returns (folder, finished) from plate_acquisition for the finished ones whose finished
+        was set or changed (finished_changed) at or after since, all finished ones if since is
+        None. Used to fetch finished folders incrementally, also when finished is backdated.
+        """
+        query = "SELECT folder, finished FROM plate_acquisition WHERE finished IS NOT NULL"
+        params: Tuple = ()
+        if since is not None:
+            query += " AND finished_changed >= %s"
+            params = (since,)
+        conn = self.get_connection()
+        try:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(query, params)
+                results = cursor.fetchall()
+                return [(row["folder"], row["finished"]) for row in results]
+        except Exception as err:
+            logging.exception("Error selecting finished plate acquisition folders")
+            raise err
+        finally:
+            self.release_connection(conn)
+
     def select_unfinished_plate_acq_folder(self) -> List[str]:
         """
         Returns a list of folders from plate_acquisition where finished is null.
@@ -389,6 +721,334 @@ class Database:
         finally:
             self.release_connection(conn)
 
+    def update_acquisitions_finished(self, finished: List[Tuple[str, float]]) -> int:
+        """
+        Sets the 'finished' timestamp of many acquisitions, given as (folder, timestamp),
+        in one statement. Returns the number of rows updated.
+        """
+        if not finished:
+            return 0
+        query = """
+            UPDATE plate_acquisition
+            SET finished = data.finished
+            FROM (VALUES %s) AS data(folder, finished)
+            WHERE plate_acquisition.folder = data.folder
+        """
+        rows = [(folder, datetime.utcfromtimestamp(timestamp)) for folder, timestamp in finished]
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                # one page, so that rowcount is for all of them
+                execute_values(cursor, query, rows, page_size=len(rows))
+                rowcount = cursor.rowcount
+                if rowcount != len(rows):
+                    logging.warning(f"Marked {rowcount} acquisitions finished, expected {len(rows)}")
+            conn.commit()
+            return rowcount
+        except Exception as err:
+            logging.exception("Error updating acquisitions finished timestamps")
+            conn.rollback()
+            raise err
+        finally:
+            self.release_connection(conn)
+
+    def update_acquisition_finished_if_unset(self, folder: str, timestamp: float) -> int:
+        """
+        Sets the 'finished' timestamp of the acquisitions in folder that are not finished yet,
+        returns the number of acquisitions updated.
+        """
+        query = """
+            UPDATE plate_acquisition
+            SET finished = %s
+            WHERE folder = %s AND finished IS NULL
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (datetime.utcfromtimestamp(timestamp), folder))
+                rowcount = cursor.rowcount
+            conn.commit()
+            return rowcount
+        except Exception as err:
+            logging.exception("Error updating acquisition finished timestamp")
+            conn.rollback()
+            raise err
+        finally:
+            self.release_connection(conn)
+
+    def analyze_tables(self, tables: List[str]) -> None:
+        """
+        Updates the planner statistics of the tables (after bulk loads)
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                for table in tables:
+                    cursor.execute(sql.SQL("ANALYZE {}").format(sql.Identifier(table)))
+            conn.commit()
+        except Exception as err:
+            logging.exception("Error analyzing tables")
+            conn.rollback()
+            raise err
+        finally:
+            self.release_connection(conn)
+
+    def upsert_acquisition_ingest_lag(self, folder: str, images: int, lag_p50: float, lag_p95: float, lag_max: float) -> None:
+        """
+        Stores the ingest lag summary (seconds from file mtime to images row committed)
+        of the plate acquisition in the given folder.
+        """
+        query = """
+            INSERT INTO plate_acquisition_ingest_lag (plate_acquisition_id, images, lag_p50, lag_p95, lag_max, computed)
+            SELECT id, %s, %s, %s, %s, %s
+            FROM plate_acquisition
+            WHERE folder = %s
+            ON CONFLICT (plate_acquisition_id) DO UPDATE SET
+                images = EXCLUDED.images,
+                lag_p50 = EXCLUDED.lag_p50,
+                lag_p95 = EXCLUDED.lag_p95,
+                lag_max = EXCLUDED.lag_max,
+                computed = EXCLUDED.computed
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (images, lag_p50, lag_p95, lag_max, datetime.utcnow(), folder))
+            conn.commit()
+        except Exception as err:
+            logging.exception("Error storing acquisition ingest lag")
+            conn.rollback()
+            raise err
+        finally:
+            self.release_connection(conn)
+
+    # --------------------------------------------------------------------------
+    # Ingest work queue (ingest_queue table), see work_queue.py
+    # --------------------------------------------------------------------------
+    def enqueue_folders(self, folders: List[Tuple[str, float]]) -> int:
+        """
+        Adds (folder, dir_mtime) to the ingest queue. A folder already in the queue
+        becomes pending again if its mtime changed. Returns the number of rows
+        inserted or updated.
+        """
+        if not folders:
+            return 0
+        query = """
+            INSERT INTO ingest_queue (folder, dir_mtime)
+            VALUES %s
+            ON CONFLICT (folder) DO UPDATE SET
+                dir_mtime = EXCLUDED.dir_mtime,
+                enqueued = now(),
+                done = NULL,
+                attempts = 0,
+                last_error = NULL
+            WHERE ingest_queue.dir_mtime IS DISTINCT FROM EXCLUDED.dir_mtime
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                execute_values(cursor, query, folders, page_size=1000)
+                rowcount = cursor.rowcount
+            conn.commit()
+            return rowcount
+        except Exception as err:
+            logging.exception("Error enqueueing folders")
+            conn.rollback()
+            raise err
+        finally:
+            self.release_connection(conn)
+
+    def claim_folders(self, worker: str, limit: int, lease_seconds: float, max_attempts: int) -> List[Tuple[str, float]]:
+        """
+        Leases up to limit pending folders (newest first) to worker and returns their
+        (folder, dir_mtime). Rows locked by other workers' claims are skipped, so
+        concurrent workers never get the same folder. Folders whose lease expired
+        (worker died) are claimed again until they reach max_attempts.
+        """
+        query = """
+            UPDATE ingest_queue q
+            SET lease_owner = %s,
+                lease_until = now() + %s * interval '1 second',
+                attempts = q.attempts + 1
+            FROM (
+                SELECT folder
+                FROM ingest_queue
+                WHERE done IS NULL
+                  AND attempts < %s
+                  AND (lease_until IS NULL OR lease_until < now())
+                ORDER BY dir_mtime DESC
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            ) claimed
+            WHERE q.folder = claimed.folder
+            RETURNING q.folder, q.dir_mtime
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (worker, lease_seconds, max_attempts, limit))
+                rows = cursor.fetchall()
+            conn.commit()
+            return sorted(rows, key=lambda row: row[1], reverse=True)
+        except Exception as err:
+            logging.exception("Error claiming folders from ingest queue")
+            conn.rollback()
+            raise err
+        finally:
+            self.release_connection(conn)
+
+    def renew_folder_leases(self, worker: str, folders: List[str], lease_seconds: float) -> Set[str]:
+        """
+        Extends the leases worker holds on folders, returns the folders it still holds.
+        """
+        if not folders:
+            return set()
+        query = """
+            UPDATE ingest_queue
+            SET lease_until = now() + %s * interval '1 second'
+            WHERE folder = ANY(%s) AND lease_owner = %s
+            RETURNING folder
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (lease_seconds, list(folders), worker))
+                held = {row[0] for row in cursor.fetchall()}
+            conn.commit()
+            return held
+        except Exception as err:
+            logging.exception("Error renewing ingest queue leases")
+            conn.rollback()
+            raise err
+        finally:
+            self.release_connection(conn)
+
+    def complete_folder(self, worker: str, folder: str, dir_mtime: float, imported: int = 0,
+                        error: Optional[str] = None, retry_delay: float = 0,
+                        defer_seconds: Optional[float] = None) -> None:
+        """
+        Ends worker's lease on folder. Without error the folder is done, unless it was
+        enqueued again with a new mtime while it was imported. With error it becomes
+        pending again after retry_delay seconds (claim_folders stops at max_attempts).
+        With defer_seconds (files still being written) it becomes pending again after
+        that many seconds, without counting as a failed attempt.
+        """
+        query = """
+            UPDATE ingest_queue
+            SET lease_owner = NULL,
+                lease_until = CASE WHEN %(error)s IS NOT NULL THEN now() + %(retry_delay)s * interval '1 second'
+                                   WHEN %(defer_seconds)s IS NOT NULL THEN now() + %(defer_seconds)s * interval '1 second' END,
+                done = CASE WHEN %(error)s IS NULL AND %(defer_seconds)s IS NULL AND dir_mtime = %(dir_mtime)s THEN now() END,
+                done_by = %(worker)s,
+                attempts = CASE WHEN %(error)s IS NULL THEN 0 ELSE attempts END,
+                last_imported = CASE WHEN %(imported)s > 0 THEN now() ELSE last_imported END,
+                last_error = %(error)s
+            WHERE folder = %(folder)s AND lease_owner = %(worker)s
+        """
+        params = {'worker': worker, 'folder': folder, 'dir_mtime': dir_mtime,
+                  'imported': imported, 'error': error, 'retry_delay': retry_delay, 'defer_seconds': defer_seconds}
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, params)
+                if cursor.rowcount != 1:
+                    logging.warning(f"ingest queue: lease on {folder} was lost before it was completed")
+            conn.commit()
+        except Exception as err:
+            logging.exception("Error completing ingest queue folder")
+            conn.rollback()
+            raise err
+        finally:
+            self.release_connection(conn)
+
+    def release_folder_leases(self, worker: str, folders: List[str]) -> None:
+        """
+        Gives up worker's leases on folders without counting it as an attempt (on shutdown)
+        """
+        if not folders:
+            return
+        query = """
+            UPDATE ingest_queue
+            SET lease_owner = NULL, lease_until = NULL, attempts = GREATEST(attempts - 1, 0)
+            WHERE folder = ANY(%s) AND lease_owner = %s
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (list(folders), worker))
+            conn.commit()
+        except Exception as err:
+            logging.exception("Error releasing ingest queue leases")
+            conn.rollback()
+            raise err
+        finally:
+            self.release_connection(conn)
+
+    def select_ingest_queue_last_imported(self) -> Dict[str, float]:
+        """
+        Returns folder -> epoch time when a worker last imported new images into it,
+        for the folders in the ingest queue that had any
+        """
+        query = """
+            SELECT folder, EXTRACT(EPOCH FROM last_imported) AS last_imported
+            FROM ingest_queue
+            WHERE last_imported IS NOT NULL
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query)
+                return {row[0]: float(row[1]) for row in cursor.fetchall()}
+        except Exception as err:
+            logging.exception("Error selecting ingest queue activity")
+            raise err
+        finally:
+            self.release_connection(conn)
+
+    def mark_io_live(self, mount: str, owner: str, seconds: float) -> None:
+        """
+        Marks mount as read in the live io lane by owner for the next seconds
+        (an earlier mark that lasts longer is kept)
+        """
+        query = """
+            INSERT INTO io_live_lane (mount, live_until, owner)
+            VALUES (%s, now() + make_interval(secs => %s), %s)
+            ON CONFLICT (mount) DO UPDATE SET
+                live_until = GREATEST(io_live_lane.live_until, EXCLUDED.live_until),
+                owner = EXCLUDED.owner
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query, (mount, seconds, owner))
+            conn.commit()
+        except Exception as err:
+            logging.exception("Error marking io live lane")
+            conn.rollback()
+            raise err
+        finally:
+            self.release_connection(conn)
+
+    def select_io_live_mounts(self) -> Set[str]:
+        """
+        Returns the mounts some process currently reads in the live io lane
+        """
+        query = """
+            SELECT mount
+            FROM io_live_lane
+            WHERE live_until > now()
+        """
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(query)
+                return {row[0] for row in cursor.fetchall()}
+        except Exception as err:
+            logging.exception("Error selecting io live lane")
+            raise err
+        finally:
+            self.release_connection(conn)
+
     def delete_image_meta_from_table_images(self, img: Image) -> None:
         """
         This method is for convenience when testing and deleting a test image
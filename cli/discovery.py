@@ -0,0 +1,156 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError, as_completed
+from pathlib import Path
+from typing import Dict, Iterator, List, Tuple
+
+import file_utils
+from file_utils import WalkCache, WalkStats
+from path_trie import PathTrie
+
+
+def read_mount_points(mounts_file: str = '/proc/mounts') -> List[str]:
+    """
+    Mount points from /proc/mounts, longest first. Reading it never touches
+    the (possibly hung) network file systems themselves.
+    """
+    try:
+        with open(mounts_file) as f:
+            mount_points = [line.split()[1].replace('\\040', ' ') for line in f if len(line.split()) > 1]
+    except Exception:
+        logging.exception("Could not read mount points from: " + str(mounts_file))
+        mount_points = []
+    return sorted(set(mount_points), key=len, reverse=True)
+
+
+def mount_of(path: str, mount_points: List[str]) -> str:
+    """
+    Mount point a path is on, by string prefix so that no file system call is made.
+    Falls back to the first two path components (e.g. /share/mikro4).
+    """
+    norm = os.path.normpath(path)
+    for mount_point in mount_points:
+        if mount_point == '/':
+            continue
+        if norm == mount_point or norm.startswith(mount_point.rstrip('/') + '/'):
+            return mount_point
+    parts = norm.split('/')
+    return '/'.join(parts[:3]) if norm.startswith('/') else parts[0]
+
+
+class ParallelDiscovery:
+    """
+    Finds image dirs in all root dirs concurrently, one bounded thread pool per mount,
+    so a slow or hung mount does not delay discovery on the others.
+
+    - Every root has its own WalkCache, kept between polls.
+    - find() yields the dirs of a mount as soon as its walks are done, newest (dir
+      mtime) first within the mount, so imports on fast mounts start without waiting
+      for the slow ones.
+    - find() waits at most timeout seconds for all mounts, a mount that is not done
+      by then contributes the dirs it found so far. Its walk keeps running in the
+      background (a thread stuck in a hung NFS call can not be stopped) and the mount
+      is skipped in later polls until that walk has returned.
+    """
+
+    def __init__(self, workers_per_mount: int = 2, timeout: float = 600):
+        self.workers_per_mount = workers_per_mount
+        self.timeout = timeout
+        self._mount_points = read_mount_points()
+        self._pools: Dict[str, ThreadPoolExecutor] = {}
+        self._running: Dict[str, list] = {}
+        self._caches: Dict[str, WalkCache] = {}
+
+    def _pool(self, mount: str) -> ThreadPoolExecutor:
+        if mount not in self._pools:
+            self._pools[mount] = ThreadPoolExecutor(max_workers=self.workers_per_mount,
+                                                    thread_name_prefix=f"discovery{mount.replace('/', '_')}")
+        return self._pools[mount]
+
+    def _walk_root(self, root: str, skip_dirs: PathTrie, found: List[Tuple[float, str]]) -> None:
+        if not os.path.exists(root):
+            logging.error(f"Path does not exist: {root}")
+            return
+
+        cache = self._caches.setdefault(root, WalkCache())
+        stats = WalkStats(root)
+        for img_dir in file_utils.find_dirs_containing_img_files_recursive(root, True, skip_dirs, cache, stats):
+            mtime = cache.mtime_of(str(img_dir))
+            if mtime is None:
+                try:
+                    stats.stats += 1
+                    mtime = img_dir.stat().st_mtime
+                except Exception:
+                    logging.exception(f"Could not stat {img_dir}")
+                    continue
+            found.append((mtime, str(img_dir)))
+        stats.log()
+        cache.sweep()
+
+    def find(self, path_list: List[str], skip_dirs=None) -> Iterator[Path]:
+        # Skip directories as a trie so that anything below them is skipped too
+        if isinstance(skip_dirs, PathTrie):
+            skip_norm = skip_dirs
+        else:
+            skip_norm = PathTrie(p for p in (skip_dirs or []) if p)
+
+        roots_by_mount: Dict[str, List[str]] = {}
+        for root in path_list:
+            roots_by_mount.setdefault(mount_of(root, self._mount_points), []).append(root)
+
+        t_start = time.perf_counter()
+        found_by_mount: Dict[str, List[Tuple[float, str]]] = {}
+        mount_of_future = {}
+        for mount, roots in roots_by_mount.items():
+            still_running = [fut for fut in self._running.get(mount, []) if not fut.done()]
+            if still_running:
+                logging.warning(f"discovery: previous walk of {mount} has not returned, skipping it this poll")
+                continue
+
+            found: List[Tuple[float, str]] = []
+            found_by_mount[mount] = found
+            mount_futures = [self._pool(mount).submit(self._walk_root, root, skip_norm, found) for root in roots]
+            self._running[mount] = mount_futures
+            for fut in mount_futures:
+                mount_of_future[fut] = mount
+
+        yielded = set()
+        timed_out = 0
+
+        def mount_dirs(mount: str, partial: bool):
+            # newest first; copy since timed out walks may still append
+            dirs = {}
+            for mtime, img_dir in list(found_by_mount[mount]):
+                if img_dir not in yielded:
+                    dirs[img_dir] = mtime
+            logging.info(f"discovery: {mount}: {len(dirs)} dirs in {time.perf_counter() - t_start:.2f}s"
+                         f"{' (timed out, partial)' if partial else ''}")
+            yielded.update(dirs)
+            return sorted(dirs, key=dirs.get, reverse=True)
+
+        pending = {mount: len(futs) for mount, futs in self._running.items() if mount in found_by_mount}
+        try:
+            for fut in as_completed(mount_of_future, timeout=self.timeout):
+                if fut.exception() is not None:
+                    logging.error("discovery walk failed", exc_info=fut.exception())
+                mount = mount_of_future[fut]
+                pending[mount] -= 1
+                if pending[mount] == 0:
+                    for img_dir in mount_dirs(mount, partial=False):
+                        yield Path(img_dir)
+        except TimeoutError:
+            for mount, count in pending.items():
+                if count > 0:
+                    # the deadline also runs while the caller imports, a mount may have finished since
+                    partial = not all(fut.done() for fut in self._running[mount])
+                    timed_out += count if partial else 0
+                    for img_dir in mount_dirs(mount, partial=partial):
+                        yield Path(img_dir)
+
+        logging.info(f"discovery: {len(yielded)} dirs on {len(found_by_mount)} mounts "
+                     f"in {time.perf_counter() - t_start:.2f}s, {timed_out} walks timed out")
+
+    def close(self) -> None:
+        for pool in self._pools.values():
+            pool.shutdown(wait=False)
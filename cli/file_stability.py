@@ -0,0 +1,74 @@
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+#
+# Detects image files that are still being written, from the size and mtime
+# os.scandir gives for them, so the import can defer them to the next poll
+# instead of parsing them and making thumbnails of truncated images.
+#
+
+
+class FileStability:
+    """
+    A file is stable when neither its size nor its mtime has changed for window seconds.
+
+    The mtime alone says when the file was last written; the size and mtime seen at
+    the previous listing also catch writes that the (NFS attribute cached) mtime does
+    not show yet, and a file with an mtime in the future (clock skew) becomes stable
+    once it has been seen unchanged for window seconds. Only deferred files are kept,
+    per folder, and replaced at every listing of the folder.
+    """
+
+    def __init__(self, window: float = 10):
+        self.window = window
+        self._lock = threading.Lock()
+        # folder -> path -> (size, mtime, changed_at)
+        self._deferred: Dict[str, Dict[str, Tuple[int, float, float]]] = {}
+        self._listing: Dict[str, Dict[str, Tuple[int, float, float]]] = {}
+
+    def is_stable(self, folder: str, path: str, size: int, mtime: float, now: Optional[float] = None) -> bool:
+        """
+        Checks one file of a listing of folder, call end_listing(folder) when the listing is done
+        """
+        if self.window <= 0:
+            return True
+        if now is None:
+            now = time.time()
+        with self._lock:
+            previous = self._deferred.get(folder, {}).get(path)
+            if previous is None:
+                changed_at = min(mtime, now)
+            elif previous[:2] == (size, mtime):
+                changed_at = previous[2]
+            else:
+                changed_at = now
+            if now - changed_at >= self.window:
+                return True
+            self._listing.setdefault(folder, {})[path] = (size, mtime, changed_at)
+            return False
+
+    def end_listing(self, folder: str) -> int:
+        """
+        Keeps the files deferred in this listing of folder, returns how many they are
+        """
+        with self._lock:
+            deferred = self._listing.pop(folder, None)
+            if deferred:
+                self._deferred[folder] = deferred
+            else:
+                self._deferred.pop(folder, None)
+            return len(deferred) if deferred else 0
+
+    def deferred_count(self, folder: Optional[str] = None) -> int:
+        """
+        Files deferred at the last listing of folder, or of all folders
+        """
+        with self._lock:
+            if folder is not None:
+                return len(self._deferred.get(folder, ()))
+            return sum(len(files) for files in self._deferred.values())
+
+
+# process wide tracker, the window is set from the FILE_STABLE_SECONDS setting in image_monitor
+file_stability = FileStability()
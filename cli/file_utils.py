@@ -1,8 +1,12 @@
+import itertools
 import os
 import logging
 import time
 from pathlib import Path
-from typing import Dict, List, Set
+from typing import Callable, Dict, Iterable, Iterator, List, Set, Union
+
+from path_trie import PathTrie
+from stage_profiler import profiler
 
 IMAGE_EXTENSIONS = (".tif", ".tiff", ".png", ".jpg", ".jpeg", ".bmp") # lower case in this tuple collection
 EXCLUDED_EXTENSIONS = (".ome.tiff.not.used.anymore") # lower case in this tuple collection
@@ -15,27 +19,133 @@ def has_marker(path):
             return True
     return False
 
-def find_dirs_containing_img_files_recursive_from_list_of_paths(path_list: List[str], skip_dirs=None):
-    # Normalize skip directories once for quick lookups
-    skip_norm: Set[str] = set()
-    if skip_dirs:
-        for p in skip_dirs:
-            if p:
-                skip_norm.add(os.path.normpath(str(p).rstrip("/")))
+class WalkStats:
+    """
+    Counters for one walk of a root dir: dirs visited, metadata calls issued
+    (stat/exists/scandir, each one or more RPCs on NFS), cache hits and time.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.dirs_visited = 0
+        self.stats = 0
+        self.cache_hits = 0
+        self.start = time.perf_counter()
+
+    def log(self):
+        elapsed = time.perf_counter() - self.start
+        profiler.record('discovery', elapsed, self.root, self.dirs_visited)
+        logging.info(
+            f"walk {self.root}: dirs_visited={self.dirs_visited}, stats={self.stats}, "
+            f"cache_hits={self.cache_hits}, time={elapsed:.2f}s"
+        )
+
+
+class WalkCache:
+    """
+    Remembers mtime and classification of every dir between walks.
+
+    A dir's mtime changes when entries are added, removed or renamed directly in it,
+    so while the mtime is unchanged:
+      - an image or marker dir is still one (and has the same single_images subdir)
+      - a container dir still has the same subdirs
+    and the marker checks and scandir can be skipped; only one stat per dir is needed.
+    Content deeper down does not change the mtime of a container, so its subdirs
+    are still visited (and stat'ed) on every walk.
+
+    An entry added in the same mtime tick as the listing would not change the mtime
+    seen, so an entry is only used if the dir had not been modified for MTIME_SLACK
+    when it was listed (as in IngestJournal).
+    """
+
+    # mtime resolution on some (network) file systems is 1-2 s
+    MTIME_SLACK = 2.0
+
+    IMAGE_DIR = 'image'
+    MARKER_DIR = 'marker'
+    CONTAINER = 'container'
+
+    def __init__(self):
+        # path -> (mtime, kind, dirs, listed_at); dirs are the extra dirs to yield
+        # (single_images) for image/marker dirs and the subdirs for containers
+        self._entries: Dict[str, tuple] = {}
+        self._seen: Set[str] = set()
+
+    def get(self, path: str, mtime: float):
+        self._seen.add(path)
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == mtime and entry[3] - mtime >= self.MTIME_SLACK:
+            return entry[1], entry[2]
+        return None
+
+    def put(self, path: str, mtime: float, kind: str, dirs: List[str], listed_at: float):
+        """
+        listed_at is the time just before the dir was listed (marker checks, scandir)
+        """
+        self._seen.add(path)
+        self._entries[path] = (mtime, kind, dirs, listed_at)
+
+    def mtime_of(self, path: str):
+        """
+        mtime of the dir as of the last walk, None if not cached
+        """
+        entry = self._entries.get(path)
+        return entry[0] if entry is not None else None
+
+    def sweep(self):
+        """
+        Drops dirs that were not seen since the previous sweep (deleted or moved)
+        """
+        for path in self._entries.keys() - self._seen:
+            del self._entries[path]
+        self._seen = set()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# cache used by the polling loop, kept between polls
+walk_cache = WalkCache()
+
+def find_dirs_containing_img_files_recursive_from_list_of_paths(path_list: List[str], skip_dirs=None, cache: WalkCache = None):
+    """
+    Walks all root dirs and logs WalkStats for each of them.
+    cache defaults to the module level walk_cache, pass cache=False to walk without it.
+    """
+    if cache is None:
+        cache = walk_cache
+    elif cache is False:
+        cache = None
+
+    # Skip directories as a trie so that anything below them is skipped too
+    if isinstance(skip_dirs, PathTrie):
+        skip_norm = skip_dirs
+    else:
+        skip_norm = PathTrie(p for p in (skip_dirs or []) if p)
 
     for path in path_list:
         if not os.path.exists(path):
             logging.exception(f"Path does not exist: {path}")
         else:
-            yield from find_dirs_containing_img_files_recursive(path, True, skip_norm)
+            stats = WalkStats(path)
+            yield from find_dirs_containing_img_files_recursive(path, True, skip_norm, cache, stats)
+            stats.log()
 
-def find_dirs_containing_img_files_recursive(path: str, sort_dir_entries: bool = False, skip_dirs: Set[str] = None):
+    # only reached when all roots were walked completely
+    if cache is not None:
+        cache.sweep()
+
+def find_dirs_containing_img_files_recursive(path: str, sort_dir_entries: bool = False,
+                                             skip_dirs: Union[Set[str], PathTrie] = None,
+                                             cache: WalkCache = None, stats: WalkStats = None, path_mtime: float = None):
     """
     Yield directories that either:
       - Contain at least one image file (matching IMAGE_EXTENSIONS without excluded prefixes/extensions), OR
       - Contain any MARKER_FILES.
 
     Behavior:
+      0. With a cache: stat the dir, if its mtime is unchanged since last walk use the
+         cached classification and skip steps 1-2 (path_mtime can be passed if already known).
       1. Try os.path.exists(path/marker) for each marker → if found, yield & return immediately.
       2. If no marker found:
          a. Do a single os.scandir(path).
@@ -43,18 +153,49 @@ def find_dirs_containing_img_files_recursive(path: str, sort_dir_entries: bool =
          c. Otherwise, collect subdirectories, sort them if requested, and recurse into each.
       3. Log timing for each major step.
     """
-    # Skip directories that are marked as finished to avoid walking them at all
+    if stats is None:
+        stats = WalkStats(path)
+
+    # Skip directories that are marked as finished (or blacklisted) to avoid walking them at all
     if skip_dirs:
         norm = os.path.normpath(str(path).rstrip("/"))
         if norm in skip_dirs:
             logging.debug(f"[SKIP  ] Finished dir {path!r}")
             return
 
+    stats.dirs_visited += 1
+
+    # ── 0) Cached classification if dir mtime is unchanged ─────────────────────
+    if cache is not None:
+        if path_mtime is None:
+            try:
+                stats.stats += 1
+                path_mtime = os.stat(path).st_mtime
+            except Exception as e:
+                logging.exception(f"Could not stat {path!r}: {e}")
+                return
+
+        cached = cache.get(path, path_mtime)
+        if cached is not None:
+            stats.cache_hits += 1
+            kind, dirs = cached
+            logging.debug(f"[CACHED] {path!r} unchanged, {kind}")
+            if kind == WalkCache.CONTAINER:
+                yield from _recurse_subdirs(path, list(dirs), sort_dir_entries, skip_dirs, cache, stats)
+            else:
+                yield Path(path)
+                for extra_dir in dirs:
+                    logging.debug(f"[YIELD ] 'single_images' subdir in {path!r}")
+                    yield Path(extra_dir)
+            return
+
     # ── 1) Marker check via os.path.exists() ───────────────────────────────────
+    listed_at = time.time()
     t0 = time.perf_counter()
     for marker in MARKER_FILES:
         marker_path = os.path.join(path, marker)
         t_check = time.perf_counter()
+        stats.stats += 1
         exists = os.path.exists(marker_path)
         t_after_exists = time.perf_counter()
         logging.debug(
@@ -68,11 +209,13 @@ def find_dirs_containing_img_files_recursive(path: str, sort_dir_entries: bool =
             )
             yield Path(path)
 
-            single_dir = Path(path) / "single_images"
-            if single_dir.exists():
+            extra_dirs = _single_images_dirs(path, stats)
+            for extra_dir in extra_dirs:
                 logging.debug(f"[YIELD ] 'single_images' subdir in {path!r}")
-                yield single_dir
+                yield Path(extra_dir)
 
+            if cache is not None:
+                cache.put(path, path_mtime, WalkCache.MARKER_DIR, extra_dirs, listed_at)
             return  # stop processing this folder entirely
 
     # ── 2) No marker found → one scandir to get entries ─────────────────────────
@@ -80,6 +223,7 @@ def find_dirs_containing_img_files_recursive(path: str, sort_dir_entries: bool =
     logging.debug(f"[SCANDIR-START] No marker in {path!r}; scandir to detect files/subdirs")
 
     try:
+        stats.stats += 1
         entries = list(os.scandir(path))
     except Exception as e:
         logging.exception(f"Could not scandir {path!r}: {e}")
@@ -116,11 +260,13 @@ def find_dirs_containing_img_files_recursive(path: str, sort_dir_entries: bool =
         logging.debug(f"[YIELD ] {path!r} (image present)")
         yield Path(path)
 
-        single_dir = Path(path) / "single_images"
-        if single_dir.exists():
+        extra_dirs = _single_images_dirs(path, stats)
+        for extra_dir in extra_dirs:
             logging.debug(f"[YIELD ] 'single_images' subdir in {path!r}")
-            yield single_dir
+            yield Path(extra_dir)
 
+        if cache is not None:
+            cache.put(path, path_mtime, WalkCache.IMAGE_DIR, extra_dirs, listed_at)
         return  # stop processing this folder entirely
 
     # ── 4) No marker and no image → collect subdirectory paths ───────────────────
@@ -131,12 +277,31 @@ def find_dirs_containing_img_files_recursive(path: str, sort_dir_entries: bool =
         if e.is_dir(follow_symlinks=False):
             subdir_paths.append(e.path)
 
+    if cache is not None:
+        cache.put(path, path_mtime, WalkCache.CONTAINER, list(subdir_paths), listed_at)
+
+    yield from _recurse_subdirs(path, subdir_paths, sort_dir_entries, skip_dirs, cache, stats)
+
+def _single_images_dirs(path: str, stats: WalkStats) -> List[str]:
+    single_dir = os.path.join(path, "single_images")
+    stats.stats += 1
+    if os.path.exists(single_dir):
+        return [single_dir]
+    return []
+
+def _recurse_subdirs(path: str, subdir_paths: List[str], sort_dir_entries: bool, skip_dirs: Union[Set[str], PathTrie],
+                     cache: WalkCache, stats: WalkStats):
     # ── 5) Sort subdirectories by descending mtime if requested ────────────────
+    # the mtimes are passed on to the recursion so each subdir is only stat'ed once
+    mtimes: Dict[str, float] = {}
     if sort_dir_entries and subdir_paths:
         t_sort_start = time.perf_counter()
         try:
+            for sub in subdir_paths:
+                stats.stats += 1
+                mtimes[sub] = os.stat(sub).st_mtime
             subdir_paths.sort(
-                key=lambda sub: os.stat(sub).st_mtime,
+                key=lambda sub: mtimes[sub],
                 reverse=True
             )
         except Exception as e:
@@ -150,7 +315,8 @@ def find_dirs_containing_img_files_recursive(path: str, sort_dir_entries: bool =
     # ── 6) Recurse into subdirectories (possibly sorted) ────────────────────────
     for subdir in subdir_paths:
         logging.debug(f"[RECURSE] Entering subdir: {subdir!r} under parent {path!r}")
-        yield from find_dirs_containing_img_files_recursive(subdir, sort_dir_entries, skip_dirs)
+        yield from find_dirs_containing_img_files_recursive(subdir, sort_dir_entries, skip_dirs,
+                                                            cache, stats, mtimes.get(subdir))
         logging.debug(f"[RETURN ] Back from subdir: {subdir!r} to parent {path!r}")
 
 def find_dirs_containing_img_files_recursive_old(path: str, sort_dir_entries: bool = False):
@@ -195,16 +361,44 @@ def get_all_image_files(dir):
     # get all files
     logging.info(dir)
 
-    image_files = []
-    for file in os.listdir(dir):
-        file_lower = file.lower()  # Convert to lower case once to avoid multiple conversions
-        if (file_lower.endswith(IMAGE_EXTENSIONS) and
-                not (file_lower.endswith(EXCLUDED_EXTENSIONS) or file_lower.startswith(EXCLUDED_PREFIXES))):
+    return list(iter_image_files(dir))
+
+def iter_image_files(dir):
+    """
+    Yields the image files in dir as they are read with os.scandir, without
+    building the whole list first
+    """
+    with os.scandir(dir) as entries:
+        for entry in entries:
+            if is_image_file(entry.name):
+                yield os.path.join(dir, entry.name)
 
-            absolute_file = os.path.join(dir, file)
-            image_files.append(absolute_file)
+def iter_image_entries(dir):
+    """
+    Like iter_image_files, but yields the os.DirEntry of each image file, so the
+    caller can stat() it (cached on the entry) without another path lookup
+    """
+    with os.scandir(dir) as entries:
+        for entry in entries:
+            if is_image_file(entry.name):
+                yield entry
+
+def sorted_chunks(items: Iterable, chunk_size: int, key: Callable = None) -> Iterator:
+    """
+    Yields items sorted within each chunk of chunk_size, so a long listing is streamed
+    on holding at most one chunk
+    """
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, chunk_size))
+        if not chunk:
+            return
+        yield from sorted(chunk, key=key)
 
-    return image_files
+def is_image_file(name):
+    file_lower = name.lower()  # Convert to lower case once to avoid multiple conversions
+    return (file_lower.endswith(IMAGE_EXTENSIONS) and
+            not (file_lower.endswith(EXCLUDED_EXTENSIONS) or file_lower.startswith(EXCLUDED_PREFIXES)))
 
 def make_thumb_path(image, thumbdir):
     # need to strip / otherwise path can not be joined
@@ -0,0 +1,300 @@
+import argparse
+import glob
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sys
+import time
+from collections import defaultdict
+from unittest import mock
+
+from filenames import filename_parser
+from filenames import pharmbio_squid_filename_standard_new
+
+#
+# Benchmark and golden-corpus check for the filename parsers
+#
+# The corpus is built from the sample paths in the parser modules (mostly their
+# __main__ blocks). Every sample is parsed with the full parser chain and the
+# winning parser plus a digest of the metadata is compared against
+# golden_corpus.json, so any change in parse results fails loudly.
+# The samples are then expanded synthetically per microscope family to measure
+# parses/sec for each parser and for the whole chain, and the two-stage
+# (folder + file) parse is checked against the chain.
+#
+# Runs offline: os.path.getctime and the squid config.json lookup are mocked.
+#
+# python3 -m filenames.benchmark                   (check golden + benchmark)
+# python3 -m filenames.benchmark --update-golden   (after an intended change)
+#
+
+GOLDEN_FILE = os.path.join(os.path.dirname(__file__), 'golden_corpus.json')
+
+SAMPLE_PATH_PATTERN = re.compile(r'["\'](/?share/[^"\']+\.(?:tiff?|png|jpe?g))["\']', re.IGNORECASE)
+
+# Fixed file creation time used instead of os.path.getctime (2024-01-02 03:04:05 UTC)
+MOCK_CTIME = 1704164645.0
+
+# Channels "enabled" in the mocked squid config.json
+MOCK_SQUID_CHANNELS = tuple(sorted(set().union(*pharmbio_squid_filename_standard_new.CHANNEL_MAP.keys())))
+
+FAMILIES = ['squid', 'nikon', 'IMX', 'external']
+
+
+def offline_mocks():
+    return [
+        mock.patch('os.path.getctime', return_value=MOCK_CTIME),
+        mock.patch.object(pharmbio_squid_filename_standard_new, 'load_config_channel_names',
+                          return_value=MOCK_SQUID_CHANNELS),
+    ]
+
+
+def collect_sample_paths():
+    """
+    All sample image paths found in the source of the parser modules.
+    """
+    paths = set()
+    for source_file in glob.glob(os.path.join(os.path.dirname(__file__), '*.py')):
+        with open(source_file) as f:
+            for match in SAMPLE_PATH_PATTERN.finditer(f.read()):
+                paths.add(match.group(1))
+    return sorted(paths)
+
+
+def parse_or_none(path):
+    try:
+        return filename_parser.parse_path_and_file(path)
+    except Exception:
+        return None
+
+
+def metadata_digest(metadata):
+    as_json = json.dumps(metadata, sort_keys=True, default=str)
+    return hashlib.sha1(as_json.encode('utf-8')).hexdigest()
+
+
+def family_of(parser_name):
+    if parser_name.startswith('pharmbio_'):
+        for family in FAMILIES:
+            if f'_{family}_' in parser_name:
+                return family
+    return 'external'
+
+
+def golden_entries(paths):
+    entries = {}
+    for path in paths:
+        metadata = parse_or_none(path)
+        if metadata is None:
+            entries[path] = {'parser': None, 'digest': None}
+        else:
+            entries[path] = {'parser': metadata['parser'], 'digest': metadata_digest(metadata)}
+    return entries
+
+
+def check_golden(entries):
+    """
+    Compares parse results with the golden file, returns number of mismatches.
+    """
+    with open(GOLDEN_FILE) as f:
+        golden = json.load(f)
+
+    mismatches = 0
+    for path, expected in golden.items():
+        actual = entries.get(path)
+        if actual is None:
+            logging.error(f"golden sample no longer in sources: {path}")
+            mismatches += 1
+        elif actual != expected:
+            logging.error(f"MISMATCH {path}\n  expected: {expected}\n  actual:   {actual}")
+            mismatches += 1
+
+    for path in entries.keys() - golden.keys():
+        logging.warning(f"sample not in golden file (run --update-golden): {path}")
+
+    return mismatches
+
+
+def synthetic_paths(samples, count, rng, tries=20):
+    """
+    Expands (sample path, parser module) pairs to count paths by replacing the
+    digits in the file name with random digits (same width). A random name is
+    only kept if the sample's parser still parses it (digits can also be part
+    of a channel name, e.g. a squid wavelength), otherwise the sample itself is
+    used. Directories are kept so that the synthetic files share folders like a
+    real acquisition does.
+    """
+    result = []
+    digit_run = re.compile(r'[0-9]+')
+    while len(result) < count:
+        for sample, parser in samples:
+            dir_path, filename = os.path.split(sample)
+            path = sample
+            for _ in range(tries):
+                new_name = digit_run.sub(lambda m: ''.join(rng.choice('0123456789') for _ in m.group(0)), filename)
+                candidate = os.path.join(dir_path, new_name)
+                if parser.parse_path_and_file(candidate) is not None:
+                    path = candidate
+                    break
+            result.append(path)
+            if len(result) >= count:
+                break
+    return result
+
+
+def parser_modules():
+    return {os.path.basename(parser.__file__): parser for parser in filename_parser.parsers}
+
+
+def bench_chain(paths):
+    start = time.perf_counter()
+    parsed = 0
+    for path in paths:
+        if parse_or_none(path) is not None:
+            parsed += 1
+    return time.perf_counter() - start, parsed
+
+
+def bench_two_stage(paths):
+    """
+    Parses the paths folder by folder with filename_parser.parse_files_in_folder
+    and compares with the full chain. Unparsable paths are left out.
+    Returns (seconds, number of paths, number of mismatches).
+    """
+    by_dir = defaultdict(list)
+    for path in paths:
+        by_dir[os.path.dirname(path)].append(path)
+
+    seconds = 0.0
+    count = 0
+    mismatches = 0
+    for dir_path, dir_paths in by_dir.items():
+        expected = [parse_or_none(path) for path in dir_paths]
+        parsable = [path for path, metadata in zip(dir_paths, expected) if metadata is not None]
+        expected = [metadata for metadata in expected if metadata is not None]
+
+        start = time.perf_counter()
+        actual = filename_parser.parse_files_in_folder(dir_path, parsable)
+        seconds += time.perf_counter() - start
+
+        count += len(parsable)
+        for path, exp, act in zip(parsable, expected, actual):
+            if exp != act:
+                logging.error(f"TWO-STAGE MISMATCH {path}\n  chain:     {exp}\n  two-stage: {act}")
+                mismatches += 1
+    return seconds, count, mismatches
+
+
+def bench_per_parser(paths):
+    """
+    Runs the chain with every parser wrapped in a timer.
+    Returns {parser_name: [calls, matches, seconds]}.
+    """
+    stats = defaultdict(lambda: [0, 0, 0.0])
+
+    def timed(parser):
+        orig = parser.parse_path_and_file
+        name = parser.__name__.split('.')[-1]
+
+        def wrapper(path):
+            start = time.perf_counter()
+            result = orig(path)
+            entry = stats[name]
+            entry[0] += 1
+            entry[1] += result is not None
+            entry[2] += time.perf_counter() - start
+            return result
+        return mock.patch.object(parser, 'parse_path_and_file', wrapper)
+
+    patches = [timed(parser) for parser in filename_parser.parsers]
+    for patch in patches:
+        patch.start()
+    try:
+        for path in paths:
+            parse_or_none(path)
+    finally:
+        for patch in patches:
+            patch.stop()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Filename parser benchmark and golden-corpus check')
+    parser.add_argument('--update-golden', action='store_true', help='Rewrite golden_corpus.json from current parse results')
+    parser.add_argument('--per-family', type=int, default=100000, help='Number of synthetic paths per microscope family')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--skip-bench', action='store_true', help='Only check the golden corpus')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+                        datefmt='%H:%M:%S',
+                        level=logging.INFO)
+
+    patches = offline_mocks()
+    for patch in patches:
+        patch.start()
+    try:
+        # parsers log expected misses with logging.exception, keep them quiet
+        logging.disable(logging.ERROR)
+        samples = collect_sample_paths()
+        entries = golden_entries(samples)
+        logging.disable(logging.NOTSET)
+
+        if args.update_golden:
+            with open(GOLDEN_FILE, 'w') as f:
+                json.dump(entries, f, indent=2, sort_keys=True)
+                f.write('\n')
+            logging.info(f"wrote {len(entries)} samples to {GOLDEN_FILE}")
+            return 0
+
+        mismatches = check_golden(entries)
+        parsed_samples = sum(1 for e in entries.values() if e['parser'] is not None)
+        logging.info(f"golden corpus: {len(entries)} samples, {parsed_samples} parsed, {mismatches} mismatches")
+
+        if args.skip_bench:
+            return 1 if mismatches else 0
+
+        modules = parser_modules()
+        by_family = defaultdict(list)
+        for path, entry in entries.items():
+            if entry['parser'] is not None:
+                by_family[family_of(entry['parser'])].append((path, modules[entry['parser']]))
+
+        rng = random.Random(args.seed)
+        logging.disable(logging.ERROR)
+        print(f"\n{'family':<10} {'paths':>10} {'parsed':>10} {'unparsed':>10} {'seconds':>10} {'parses/sec':>12}"
+              f" {'2-stage/sec':>12} {'2-stage diff':>12}")
+        all_stats = defaultdict(lambda: [0, 0, 0.0])
+        for family in FAMILIES:
+            samples_in_family = by_family.get(family)
+            if not samples_in_family:
+                continue
+            paths = synthetic_paths(samples_in_family, args.per_family, rng)
+            seconds, parsed = bench_chain(paths)
+            two_stage_seconds, two_stage_count, two_stage_mismatches = bench_two_stage(paths)
+            mismatches += two_stage_mismatches
+            two_stage_rate = two_stage_count / two_stage_seconds if two_stage_seconds > 0 else 0
+            print(f"{family:<10} {len(paths):>10} {parsed:>10} {len(paths) - parsed:>10} {seconds:>10.2f} {len(paths) / seconds:>12.0f}"
+                  f" {two_stage_rate:>12.0f} {two_stage_mismatches:>12}")
+            for name, (calls, matches, secs) in bench_per_parser(paths).items():
+                all_stats[name][0] += calls
+                all_stats[name][1] += matches
+                all_stats[name][2] += secs
+        logging.disable(logging.NOTSET)
+
+        print(f"\n{'parser':<58} {'calls':>10} {'matches':>10} {'seconds':>10} {'calls/sec':>12}")
+        for name, (calls, matches, secs) in sorted(all_stats.items(), key=lambda item: -item[1][2]):
+            rate = calls / secs if secs > 0 else 0
+            print(f"{name:<58} {calls:>10} {matches:>10} {secs:>10.2f} {rate:>12.0f}")
+
+        return 1 if mismatches else 0
+    finally:
+        for patch in patches:
+            patch.stop()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,6 @@
 import os
 import logging
+from functools import lru_cache
 from filenames import pharmbio_squid_filename_v1
 from filenames import pharmbio_squid_filename_standard_new
 from filenames import pharmbio_squid_filename_v2_standard
@@ -67,11 +68,65 @@ parsers.append(external_filename_opera_rXcXfXpX_chXskXfkXflX_version2)
 parsers.append(external_filename_opera_rXcXfXpX_chXskXfkXflX)
 parsers.append(external_filename_spheroid_v1)
 
+# Lower case tokens that must all be present in the directory part of a path
+# for the parser's regex to be able to match it (every token is followed by a
+# required "/" in the parser's pattern). Used to narrow down which parsers to
+# try for a directory. Parsers without an entry are always tried.
+PARSER_DIR_TOKENS = {
+    pharmbio_squid_filename_BF_and_other_and_z: ('/squid/',),
+    pharmbio_squid_filename_v1: ('/squid/',),
+    pharmbio_squid_filename_standard_new: ('/squid/',),
+    pharmbio_squid_filename_v2_standard: ('/squid/',),
+    pharmbio_squid_filename_slide: ('/squid/',),
+    pharmbio_nikon_filename_v11_single_default: ('/nikon/',),
+    pharmbio_nikon_filename_v1: ('/nikon/',),
+    pharmbio_nikon_filename_v2_exported: ('/nikon/',),
+    pharmbio_nikon_filename_v3_multi: ('/nikon/',),
+    pharmbio_nikon_filename_v4_multi: ('/nikon/',),
+    pharmbio_nikon_filename_v5_multi: ('/nikon/',),
+    pharmbio_nikon_filename_v6_multi: ('/nikon/',),
+    pharmbio_nikon_filename_v8_single: ('/nikon/',),
+    pharmbio_nikon_filename_v7_single: ('/nikon/',),
+    pharmbio_nikon_filename_v9_single: ('/nikon/',),
+    pharmbio_nikon_filename_v10_single4x: ('/nikon/',),
+    pharmbio_IMX_filename_standard: ('mdc_pharmbio/',),
+    pharmbio_IMX_filename_older: ('mdc_pharmbio/', 'timepoint_'),
+    pharmbio_IMX_filename_relaxed: ('/mdc_pharmbio/',),
+    external_filename_nanoscale_rXcXfXpX_chX: ('/external-datasets/', '/hs/', '/images/'),
+    external_filename_christa_zplane_IMX: ('/external-datasets/christa-patient-painting/', 'timepoint_'),
+    external_filename_yukogawa_spheroid: ('/external-datasets/', '/assayplate_corning_'),
+    external_filename_comp1: ('/external-datasets/gen153-c1/',),
+    external_filename_christa: ('/external-datasets/',),
+    external_filename_morphomac_wide_IMX: ('/external-datasets/morphomac/widefield/', '/timepoint_'),
+    external_filename_IMX: ('/external-datasets/',),
+    external_filename_IMX_v2: ('/external-datasets/',),
+    external_filename_cpjump: ('/external-datasets/', '/images/'),
+    external_filename_david: ('/external-datasets/mini3d/', '/images/'),
+    external_filename_opera_rXcXfXpX_chXskXfkXflX_version2: ('/external-datasets/', '/hs/', '/images/'),
+    external_filename_opera_rXcXfXpX_chXskXfkXflX: ('/external-datasets/', '/images/'),
+    external_filename_spheroid_v1: ('/external-datasets/christa/',),
+}
+
+@lru_cache(maxsize=4096)
+def candidate_parsers(dir_path: str):
+    """
+    Returns the parsers that can match files in dir_path, in the same order as
+    the parsers list. Cached per directory, since all files in a directory
+    are routed to the same candidates.
+    """
+    dir_lower = dir_path.lower() + '/'
+    return tuple(
+        parser for parser in parsers
+        if all(token in dir_lower for token in PARSER_DIR_TOKENS.get(parser, ()))
+    )
+
 def parse_path_and_file(filename):
 
     metadata = None
 
-    for parser in parsers:
+    # First match in parsers-list order wins, candidate_parsers only skips
+    # the parsers that can not match this directory
+    for parser in candidate_parsers(os.path.dirname(filename)):
         metadata = parser.parse_path_and_file(filename)
         if metadata is not None:
             return metadata
@@ -85,6 +140,36 @@ def parse_path_and_file(filename):
     return metadata
 
 
+def parse_files_in_folder(dir_path, filenames):
+    """
+    Two-stage parse of files located directly in dir_path, returns a list with
+    the metadata of each file in the same order (same result as calling
+    parse_path_and_file for each of them).
+
+    If the first candidate parser for the folder supports it (parse_folder /
+    parse_file), the folder fields (project, plate, date...) are extracted once
+    and only the file name is matched per file. Files the file stage can not
+    parse go through the full parser chain.
+    """
+    folder_parser = None
+    folder_meta = None
+    candidates = candidate_parsers(dir_path)
+    if candidates and hasattr(candidates[0], 'parse_folder'):
+        folder_parser = candidates[0]
+        folder_meta = folder_parser.parse_folder(dir_path)
+
+    result = []
+    for filename in filenames:
+        metadata = None
+        if folder_meta is not None and os.path.dirname(filename) == dir_path:
+            metadata = folder_parser.parse_file(folder_meta, filename)
+        if metadata is None:
+            metadata = parse_path_and_file(filename)
+        result.append(metadata)
+
+    return result
+
+
 if __name__ == '__main__':
 
     # python3.10 -m filenames.filename_parser
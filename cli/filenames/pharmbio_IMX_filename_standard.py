@@ -31,41 +31,100 @@ __pattern_path_and_file   = re.compile('^'
                             ,
                             re.IGNORECASE)  # Windows has case-insensitive filenames
 
-def parse_path_and_file(path):
- # If something errors (file not parsable with this parser, then exception and return None)
- try:
-  match = re.search(__pattern_path_and_file, path)
+# The same pattern split in a folder part (matched once per directory, on the
+# directory path with a trailing /) and a file part (matched on the file name).
+# Group numbers of the file pattern are offset by 5 from the full pattern.
+__pattern_folder = re.compile('^'
+                            + '.*'        # any
+                            + 'MDC_pharmbio/(?:IMX B5/)?'
+                            + '(.*?)/' # project (1)
+                            + '(.*?)/' # plate (2)
+                            + '([0-9]{4})-([0-9]{2})-([0-9]{2})' # date (yyyy, mm, dd) (3,4,5)
+                            + '.*\/'      # any until last /
+                            + '$'
+                            ,
+                            re.IGNORECASE)
 
-  if match is None:
-    return None
+__pattern_file = re.compile('^'
+                            + '([0-9]{6}-)?' # maybe date here also (6)
+                            + '([^-]+)'   # project-name (7)
+                            + '-([^-]+)'  # magnification (8)
+                            + '-([^_]+)'  # plate-short (9)
+                            + '_([^_]+)'  # well (10)
+                            + '_s([^_]+)'  # wellsample (11)
+                            + '_w([0-9]+)' # Channel (color channel?) (12)
+                            + '(_thumb)?'  # Thumbnail (13)
+                            + '([A-Z0-9]{8}-[A-Z0-9]{4}-[A-Z0-9]{4}-[A-Z0-9]{4}-[A-Z0-9]{12})'  # Image GUID [14]
+                            + '(\.tiff?)?'  # Extension [15]
+                            + '$'
+                            ,
+                            re.IGNORECASE)
 
-  metadata = {
+def _metadata(path, group):
+  return {
     'path': path,
     'filename': os.path.basename(path),
-    'date_year': int(match.group(3)),
-    'date_month': int(match.group(4)),
-    'date_day_of_month': int(match.group(5)),
-    'project': match.group(1),
-    'magnification': match.group(8),
-    'plate': match.group(2),
+    'date_year': int(group(3)),
+    'date_month': int(group(4)),
+    'date_day_of_month': int(group(5)),
+    'project': group(1),
+    'magnification': group(8),
+    'plate': group(2),
     'plate_acq_name': path,
-    'well': match.group(10),
-    'wellsample': match.group(11),
-    'channel': int(match.group(12)),
-    'is_thumbnail': match.group(13) is not None,
-    'guid': match.group(14),
-    'extension': match.group(15),
+    'well': group(10),
+    'wellsample': group(11),
+    'channel': int(group(12)),
+    'is_thumbnail': group(13) is not None,
+    'guid': group(14),
+    'extension': group(15),
     'timepoint': 1,
     'channel_map_id': 2,
     'microscope': "ImageXpress",
     'parser': os.path.basename(__file__)
   }
 
-  return metadata
+def parse_path_and_file(path):
+ # If something errors (file not parsable with this parser, then exception and return None)
+ try:
+  match = re.search(__pattern_path_and_file, path)
+
+  if match is None:
+    return None
+
+  return _metadata(path, match.group)
  except:
     logging.debug("could not parse filename with this parser")
     return None
 
+def parse_folder(dir_path):
+  """
+  Folder part of parse_path_and_file, returns the fields shared by all files in dir_path
+  (to be passed to parse_file) or None if the folder does not match.
+  """
+  match = re.search(__pattern_folder, dir_path + '/')
+  if match is None:
+    return None
+  return {'groups': match.groups()}
+
+def parse_file(folder_meta, path):
+  """
+  File part of parse_path_and_file, returns the same metadata as parse_path_and_file
+  or None if the file name does not match (caller then falls back to the full parse).
+  """
+  try:
+    match = re.search(__pattern_file, os.path.basename(path))
+    if match is None:
+      return None
+
+    folder_groups = folder_meta['groups']
+    def group(i):
+      return folder_groups[i - 1] if i <= 5 else match.group(i - 5)
+
+    return _metadata(path, group)
+  except:
+    logging.debug("could not parse filename with this parser")
+    return None
+
 if __name__ == '__main__':
         #
     # Configure logging
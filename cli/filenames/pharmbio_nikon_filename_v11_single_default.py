@@ -28,31 +28,44 @@ __pattern_path_and_file = re.compile(
 )
 
 
-def parse_path_and_file(path):
- # If something errors (file not parsable with this parser, then exception and return None)
- try:
-  match = re.search(__pattern_path_and_file, path)
-
-  logging.debug(f'match: {match}')
+# The same pattern split in a folder part (matched once per directory, on the
+# directory path with a trailing /) and a file part (matched on the file name).
+# Group numbers of the file pattern are offset by 6 from the full pattern.
+__pattern_folder = re.compile(
+    r'^'
+    r'.*/nikon/'             # any until /nikon/
+    r'(.*?)/'                # project (1)
+    r'(.*?)/'                # plate (2)
+    r'(?:([0-9]{4})([0-9]{2})([0-9]{2})_[0-9]{6}_[0-9]{3}/)?'  # Optional date folder: YYYYMMDD_HHMMSS_mmm (3,4,5)
+    r'(?:([0-9]+x)[^/]*/)?'  # Optional magnification subdir (6), e.g. 20x/, 4x/, 20x_processed/
+    r'$'
+    ,
+    re.IGNORECASE
+)
 
-  if match is None:
-    return None
+__pattern_file = re.compile(
+    r'^'
+    r'Well-([A-Z])([0-9]+)'  # well (7,8)
+    r'(?:-z([0-9]+)-(.*)\.ome(.*(\..*))|_.*\.ome()()(.*(\..*)))'
+    ,
+    re.IGNORECASE
+)
 
-  logging.debug(f'match: {match.groups() }')
 
-  row = match.group(7)
-  col = int(match.group(8))
+def _metadata(path, group):
+  row = group(7)
+  col = int(group(8))
   well = f'{row}{col:02d}'
 
   # z is optional in some filename variants
-  if match.group(9):
-      z = int(match.group(9))
+  if group(9):
+      z = int(group(9))
   else:
       z = 0
   site = 0
 
   # Channel name is optional; if missing, fall back to a default single channel
-  channel_name = match.group(10)
+  channel_name = group(10)
   if channel_name:
       channels = ['MITO', 'PHAandWGA', 'HOECHST', 'SYTO', 'CONC']
       channel_pos = channels.index(channel_name) + 1
@@ -60,13 +73,13 @@ def parse_path_and_file(path):
       channel_pos = 1
 
   # Optional magnification captured from the path (group 6), e.g. "20x"
-  magnification = match.group(6) if match.group(6) else 'x'
+  magnification = group(6) if group(6) else 'x'
 
   # Parse date from date folder (groups 3–5) if present, otherwise fall back to file creation time
-  if match.group(3) and match.group(4) and match.group(5):
-      year = int(match.group(3))
-      month = int(match.group(4))
-      day = int(match.group(5))
+  if group(3) and group(4) and group(5):
+      year = int(group(3))
+      month = int(group(4))
+      day = int(group(5))
   else:
       c_time = os.path.getctime(path)
       date_create = datetime.datetime.fromtimestamp(c_time)
@@ -76,10 +89,10 @@ def parse_path_and_file(path):
 
   # Plate acquisition name: if a date folder exists, use plate + "_" + <actual date-folder> +
   # optional "_" + magnification subdir. Otherwise, fall back to the full path (legacy behaviour).
-  plate = match.group(2)
-  if match.group(3):
+  plate = group(2)
+  if group(3):
       magnification_dir = ''
-      if match.group(6):
+      if group(6):
           magnification_dir = os.path.basename(os.path.dirname(path))
 
       # Actual date folder name between plate and magnification/filename
@@ -101,7 +114,7 @@ def parse_path_and_file(path):
       'date_year': year,
       'date_month': month,
       'date_day_of_month': day,
-      'project': match.group(1),
+      'project': group(1),
       'magnification': magnification,
       'plate': plate,
       'plate_acq_name': plate_acq_name,
@@ -113,7 +126,7 @@ def parse_path_and_file(path):
       'guid': None,
       # Extension may come from different capture groups depending on which
       # filename variant matched (with or without z/channel).
-      'extension': match.group(11) if match.group(11) else match.group(15),
+      'extension': group(11) if group(11) else group(15),
       'timepoint': 1,
       # Use different channel maps depending on whether we have
       # an explicit channel or not.
@@ -124,12 +137,65 @@ def parse_path_and_file(path):
 
   return metadata
 
+
+def parse_path_and_file(path):
+ # If something errors (file not parsable with this parser, then exception and return None)
+ try:
+  match = re.search(__pattern_path_and_file, path)
+
+  logging.debug(f'match: {match}')
+
+  if match is None:
+    return None
+
+  logging.debug(f'match: {match.groups() }')
+
+  return _metadata(path, match.group)
+
  except:
     logging.exception("exception")
     logging.debug("could not parse")
     return None
 
 
+def parse_folder(dir_path):
+  """
+  Folder part of parse_path_and_file, returns the fields shared by all files in dir_path
+  (to be passed to parse_file) or None if the folder does not match.
+  """
+  # A "Well-" in a folder name could be matched by the full pattern before
+  # the file name is reached, leave those to parse_path_and_file
+  if 'well-' in dir_path.lower():
+    return None
+
+  match = re.search(__pattern_folder, dir_path + '/')
+  if match is None:
+    return None
+
+  return {'groups': match.groups()}
+
+
+def parse_file(folder_meta, path):
+  """
+  File part of parse_path_and_file, returns the same metadata as parse_path_and_file
+  or None if the file name does not match (caller then falls back to the full parse).
+  """
+  try:
+    match = re.search(__pattern_file, os.path.basename(path))
+    if match is None:
+      return None
+
+    folder_groups = folder_meta['groups']
+    def group(i):
+      return folder_groups[i - 1] if i <= 6 else match.group(i - 6)
+
+    return _metadata(path, group)
+  except:
+    logging.exception("exception")
+    logging.debug("could not parse")
+    return None
+
+
 if __name__ == '__main__':
     # Configure logging
     #
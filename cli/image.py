@@ -1,6 +1,40 @@
 import os
 import re
+import sys
 from datetime import datetime
+from functools import lru_cache
+from typing import Any, Optional, Tuple
+
+_BARCODE_PATTERN = re.compile(r'(PB?\d+)')
+
+# images with any of these in the path are not uploaded to s3
+UPLOAD_TO_S3_EXCLUDES = []
+
+
+@lru_cache(maxsize=4096)
+def plate_barcode(plate: str) -> str:
+    """
+    Barcode in the plate name (e.g. "P013725" in "P013725-FA-..."), or the plate name if there is none.
+    Cached, all images of a plate ask for the same one.
+    """
+    # extract barcode from acquisition_name (if there is one)
+    match = _BARCODE_PATTERN.match(plate)
+    if match:
+        return match.group(1)
+    # return default barcode
+    return plate
+
+
+@lru_cache(maxsize=4096)
+def imaged_datetime(date_iso: Optional[str], year, month, day) -> datetime:
+    """
+    datetime from 'date_iso' if there is one, otherwise from year, month and day.
+    Cached, the images of an acquisition share the same date.
+    """
+    if date_iso:
+        return datetime.fromisoformat(date_iso)
+    return datetime(int(year), int(month), int(day))
+
 
 class Image:
 
@@ -77,14 +111,8 @@ class Image:
         Returns a datetime object for the image's file
         If 'date_iso' is available, it uses that; otherwise falls back to year, month and day.
         """
-        date_iso = self.get('date_iso')
-        if date_iso:
-            return datetime.fromisoformat(date_iso)
-        else:
-            year = int(self.get('date_year'))
-            month = int(self.get('date_month'))
-            day = int(self.get('date_day_of_month'))
-            return datetime(year, month, day)
+        return imaged_datetime(self.get('date_iso'), self.get('date_year'), self.get('date_month'),
+                               self.get('date_day_of_month'))
 
     def get_plate_barcode(self) -> str:
         """
@@ -92,15 +120,19 @@ class Image:
         If 'plate' contains a match (e.g., "PB1234"), returns that match.
         Otherwise, returns the plate value unmodified.
         """
-        plate = self.get_plate()
-        # extract barcode from acquisition_name (if there is one)
-        match = re.match(r'(PB?\d+)', plate)
-        if match:
-            return match.group(1)
-        else:
-            # return default barcode
-            barcode = plate
-            return barcode
+        return plate_barcode(self.get_plate())
+
+    def images_row(self, plate_acq_id: Any) -> Tuple:
+        """
+        Column values for the 'images' table, see ImageRecord.images_row
+        """
+        return (plate_acq_id, self.get_plate_barcode(), self.get_timepoint(), self.get('well'),
+                self.get('wellsample'), self.get('channel'), self.get('channel_name'), self.get('z', 0),
+                self.get_path())
+
+    def upload_row(self, img_id: Any, plate_acq_id: Any) -> Tuple:
+        return (img_id, self.get_path(), plate_acq_id, self.get_project())
+
     def exists_in_db(self) -> bool:
         from database import Database
         return Database.get_instance().image_exists_in_db(self)
@@ -114,11 +146,9 @@ class Image:
         return self.get('make_thumb', True)
 
     def is_upload_to_s3(self) -> bool:
-        excludes = []
-
         path = self.get_path()
         if path:
-            for exclude in excludes:
+            for exclude in UPLOAD_TO_S3_EXCLUDES:
                 if exclude in path:
                     return False
         return True
@@ -126,3 +156,131 @@ class Image:
 
     def __str__(self):
         return f"Image(path={self.get_path()}, plate={self.get_plate()}, project={self.get_project()})"
+
+
+class ImageRecord:
+    """
+    The fields of a parsed image that the ingest uses, in slots instead of the
+    parser's metadata dict (about 20 keys, several of them the path again).
+
+    Made once per file from the parser output with from_meta, which also derives
+    the folder, plate barcode and imaged datetime (cached per distinct value, so
+    the images of an acquisition share them). Has the getters of Image, and
+    images_row/upload_row give the tuples the database writer inserts.
+    """
+
+    __slots__ = ('path', 'folder', 'project', 'plate', 'plate_barcode', 'imaged', 'timepoint', 'well', 'site',
+                 'channel', 'channel_name', 'z', 'microscope', 'parser', 'channel_map_id', 'thumbnail',
+                 'make_thumb')
+
+    def __init__(self, path: str, folder: str, project: str, plate: str, plate_barcode: str, imaged: datetime,
+                 timepoint: Any, well: Optional[str], site: Any, channel: Any, channel_name: Optional[str], z: Any,
+                 microscope: Optional[str], parser: Optional[str], channel_map_id: Optional[int],
+                 thumbnail: bool, make_thumb: bool):
+        self.path = path
+        self.folder = folder
+        self.project = project
+        self.plate = plate
+        self.plate_barcode = plate_barcode
+        self.imaged = imaged
+        self.timepoint = timepoint
+        self.well = well
+        self.site = site
+        self.channel = channel
+        self.channel_name = channel_name
+        self.z = z
+        self.microscope = microscope
+        self.parser = parser
+        self.channel_map_id = channel_map_id
+        self.thumbnail = thumbnail
+        self.make_thumb = make_thumb
+
+    @classmethod
+    def from_meta(cls, meta: dict) -> 'ImageRecord':
+        if not isinstance(meta, dict):
+            raise ValueError("meta must be a dictionary")
+        get = meta.get
+        path = get('path')
+        plate = get('plate')
+        # interned, one string per folder instead of one per image
+        folder = sys.intern(get('folder') or os.path.dirname(path))
+        return cls(path, folder, get('project'), plate, plate_barcode(plate),
+                   imaged_datetime(get('date_iso'), get('date_year'), get('date_month'), get('date_day_of_month')),
+                   get('timepoint'), get('well'), get('wellsample'), get('channel'), get('channel_name'),
+                   get('z', 0), get('microscope'), get('parser'), get('channel_map_id'),
+                   bool(get('is_thumbnail')), get('make_thumb', True))
+
+    def images_row(self, plate_acq_id: Any) -> Tuple:
+        """
+        Column values for one row in the 'images' table, in the column order of the
+        database writer: plate_acquisition_id, plate_barcode, timepoint, well, site,
+        channel, channel_name, z, path
+        """
+        return (plate_acq_id, self.plate_barcode, self.timepoint, self.well, self.site, self.channel,
+                self.channel_name, self.z, self.path)
+
+    def upload_row(self, img_id: Any, plate_acq_id: Any) -> Tuple:
+        """
+        Column values for 'upload_to_s3': image_id, path, acq_id, project
+        """
+        return (img_id, self.path, plate_acq_id, self.project)
+
+    def get_path(self):
+        return self.path
+
+    def get_folder(self):
+        return self.folder
+
+    def get_project(self):
+        return self.project
+
+    def get_plate(self):
+        return self.plate
+
+    def get_plate_barcode(self) -> str:
+        return self.plate_barcode
+
+    def get_imaged(self) -> datetime:
+        return self.imaged
+
+    def get_timepoint(self):
+        return self.timepoint
+
+    def get_well(self):
+        return self.well
+
+    def get_wellsample(self):
+        return self.site
+
+    def get_channel(self):
+        return self.channel
+
+    def get_channel_name(self):
+        return self.channel_name
+
+    def get_z(self):
+        return self.z
+
+    def get_microscope(self):
+        return self.microscope
+
+    def get_parser(self):
+        return self.parser
+
+    def get_channel_map_id(self):
+        return self.channel_map_id
+
+    def is_thumbnail(self):
+        return self.thumbnail
+
+    def is_make_thumb(self) -> bool:
+        return self.make_thumb
+
+    def is_upload_to_s3(self) -> bool:
+        return not any(exclude in self.path for exclude in UPLOAD_TO_S3_EXCLUDES)
+
+    def make_thumb_path(self, thumbdir: str) -> str:
+        return os.path.join(thumbdir, self.path.strip("/"))
+
+    def __str__(self):
+        return f"ImageRecord(path={self.path}, plate={self.plate}, project={self.project})"
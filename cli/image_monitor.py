@@ -3,23 +3,40 @@
 import logging
 import argparse
 import os
+import socket
+import threading
 import time
 import traceback
 from pathlib import Path
-from typing import Dict, List
+from typing import Deque, Dict, Iterable, List, Optional, Set, Tuple, Union
 
+import itertools
 import json
-from datetime import datetime
+from collections import deque
+from datetime import datetime, timedelta, timezone
 
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
 
 import filenames.filename_parser
 import image_tools
 import settings as imgdb_settings
 import file_utils
 
+from adaptive_concurrency import add_plate_concurrency
 from database import Database
-from image import Image
+from discovery import ParallelDiscovery
+from file_stability import file_stability
+from image import ImageRecord
+from ingest_journal import IngestJournal, open_journal
+from ingest_lag import ingest_lag
+from metrics import metrics, start_http_server
+from inotify_watcher import IN_CLOSE_WRITE, IN_CREATE, IN_MOVED_TO, InotifyWatcher
+from io_scheduler import BULK, LANE_NAMES, LIVE, IOScheduler, io_scheduler, parse_limits
+from path_trie import PathTrie
+from processed_paths import ProcessedPaths
+from stage_profiler import profiler
+from thumbnail_stage import ThumbnailStage
+from work_queue import FolderWorkQueue
 
 
 def _touch_liveness():
@@ -42,101 +59,411 @@ def _touch_liveness():
         logging.exception("Failed to update liveness file")
 
 
-def addImageToImagedb(img: Image):
+def addImageToImagedb(img: ImageRecord, lane: int = LIVE):
 
-    # check if image exists if so exit, exiting before creating plate_acq means that you can delete plate_acq from db and just keep files
-    if img.exists_in_db():
-        logging.debug('image exists in db already, return')
-        return
+    # Images already in db are filtered out per folder in import_plate_images_and_meta,
+    # before getting here, so a plate_acq is never created for files that are already imported
 
     # First select plate acquisition id, or insert it if not there
-    plate_acq_id = Database.get_instance().select_or_insert_plate_acq(img)
+    with profiler.stage('acq_lookup', img.get_folder()):
+        plate_acq_id = Database.get_instance().select_or_insert_plate_acq(img)
 
     # Insert into images table
-    img_id = Database.get_instance().insert_meta_into_table_images(img, plate_acq_id)
+    with profiler.stage('insert', img.get_folder()):
+        img_id = Database.get_instance().insert_meta_into_table_images(img, plate_acq_id)
 
     # return if nothing was inserted
     if img_id is None:
         # conflict → someone else beat us to it; skip upload & thumb
         return
 
+    metrics.inc('imagedb_images_imported_total')
+    ingest_lag.committed(img.get_folder(), [img.get_path()])
+
     # Insert into upload_to_s3 table
     if img.is_upload_to_s3():
-        Database.get_instance().insert_into_upload_table(img, plate_acq_id, img_id)
+        with profiler.stage('upload_insert', img.get_folder()):
+            Database.get_instance().insert_into_upload_table(img, plate_acq_id, img_id)
 
+    make_thumb(img, lane)
+
+def make_thumb(img: ImageRecord, lane: int = LIVE):
     # create thumb image
     thumb_path = img.make_thumb_path(imgdb_settings.IMAGES_THUMB_FOLDER)
     logging.debug(thumb_path)
 
     # Only create thumb if not exists already and not skip_thumb is specified and set to True
-    # make inside try-catch so a corrupted image doesn't stop it all
-    # also try 3 times with some sleep in between to allow for images that are not
-    # completely uploaded
+    # The thumbnail stage runs in its own process pool, catches errors so a corrupted image
+    # doesn't stop it all, and retries later to allow for images that are not completely uploaded
     if img.is_make_thumb() and not os.path.exists(thumb_path):
-
-        #logging.debug(f'makethumb: {thumb_path}')
-        attempts = 0
-        while attempts < 3:
-            try:
-                image_tools.makeThumb(img.get_path(), thumb_path, False)
-                break
-            except Exception as e:
-                logging.error("Exception making thumb image: %s", e)
-                logging.error("image: " + str(img.get_path()))
-                logging.error("thumb_path: " + str(thumb_path))
-                logging.error(f'will retry x times in x seconds, attempt {attempts}')
-                logging.error("After that Continuing since we don't want to break on a single bad image")
-                attempts += 1
-                time.sleep(10)
-
-def process_image(img_path: str):
+        io_scheduler.acquire_read(img.get_path(), lane, files=0)
+        get_thumbnail_stage().submit(img.get_path(), thumb_path)
+
+def get_thumbnail_stage() -> ThumbnailStage:
+    global thumbnail_stage
+    with thumbnail_stage_lock:
+        if thumbnail_stage is None:
+            thumbnail_stage = ThumbnailStage(
+                workers=int(getattr(imgdb_settings, 'THUMBNAIL_WORKERS', 2)),
+                max_pending=int(getattr(imgdb_settings, 'THUMBNAIL_QUEUE_SIZE', 1000)),
+                retries=int(getattr(imgdb_settings, 'THUMBNAIL_RETRIES', 3)),
+                retry_delay=float(getattr(imgdb_settings, 'THUMBNAIL_RETRY_DELAY', 10)),
+                fast=bool(getattr(imgdb_settings, 'THUMBNAIL_FAST', True))
+            )
+        return thumbnail_stage
+
+def parse_image(img_path: str) -> ImageRecord:
     # parse meta
-    img_meta = filenames.filename_parser.parse_path_and_file(img_path)
+    with profiler.stage('parse', os.path.dirname(img_path)):
+        img_meta = filenames.filename_parser.parse_path_and_file(img_path)
      # img meta should never be None
     if img_meta is None:
         raise Exception('img_meta is None')
 
-    img = Image.from_meta(img_meta)
+    return ImageRecord.from_meta(img_meta)
+
+def parse_images_by_folder(img_paths: List[str]) -> List[ImageRecord]:
+    """
+    Parse images folder by folder with the two-stage parser, so that folder
+    fields (project, plate, date...) are extracted once per folder.
+    """
+    by_dir: Dict[str, List[str]] = {}
+    for img_path in img_paths:
+        by_dir.setdefault(os.path.dirname(img_path), []).append(img_path)
+
+    images = []
+    for dir_path, dir_img_paths in by_dir.items():
+        with profiler.stage('parse', dir_path, len(dir_img_paths)):
+            metas = filenames.filename_parser.parse_files_in_folder(dir_path, dir_img_paths)
+        for img_meta in metas:
+            # img meta should never be None
+            if img_meta is None:
+                raise Exception('img_meta is None')
+            images.append(ImageRecord.from_meta(img_meta))
+    return images
+
+def process_image(img_path: str, lane: int = LIVE):
+    img = parse_image(img_path)
 
     # Skip thumbnails but add images
     if not img.is_thumbnail():
-        addImageToImagedb(img)
+        addImageToImagedb(img, lane)
+    ingest_lag.discard([img_path])
 
     # mark processed
-    processed[img.get_path()] = time.time()
+    processed.add(img.get_path(), time.time())
+    failed_images.pop(img.get_path(), None)
+
+
+def add_plate_to_db(images: Iterable[str], lane: int = LIVE) -> int:
+    """
+    Adds the images as they are streamed from images (e.g. a folder listing),
+    returns the number of images that failed (see record_failed_image).
+    Their thumbnails are read in lane of the io scheduler.
+    """
+    if getattr(imgdb_settings, 'BULK_INSERT', True):
+        return add_plate_to_db_bulk(images, lane)
 
+    return add_plate_to_db_per_image(images, lane)
 
-def add_plate_to_db(images: List[str]):
+
+def add_plate_to_db_bulk(images: Iterable[str], lane: int = LIVE) -> int:
+    """
+    Reads images in chunks of BULK_INSERT_CHUNK_SIZE and bulk inserts them, with as many
+    chunks in flight as the adaptive worker count (add_plate_concurrency) allows, so only
+    that many chunks are held in memory. The images of a chunk that fails are retried one
+    at a time in the same pool, so a bad file only fails itself.
+    """
+    chunk_size = int(getattr(imgdb_settings, 'BULK_INSERT_CHUNK_SIZE', 1000))
+
+    logging.info("start bulk add_plate_metadata to db")
+
+    images = iter(images)
+    # a chunk's future -> its images, a retried image's future -> the image
+    in_flight: Dict[Future, Union[List[str], str]] = {}
+    retry: Deque[str] = deque()
+    done_count = 0
+    failed = 0
+
+    def collect(done_futures):
+        nonlocal done_count, failed
+        for fut in done_futures:
+            task = in_flight.pop(fut)
+            if isinstance(task, str):
+                done_count += 1
+                exception = fut.exception()
+                if exception is not None:
+                    failed += 1
+                    record_failed_image(task, exception)
+                if done_count % 100 != 0:
+                    continue
+            elif fut.result():
+                done_count += len(task)
+            else:
+                retry.extend(task)
+                continue
+            logging.info(f"images processed (including thumbs): {done_count}, failed: {failed}, "
+                         f"workers: {add_plate_concurrency.limit}, {add_plate_concurrency.describe()}")
+
+    with ThreadPoolExecutor(max_workers=add_plate_concurrency.max_limit) as pool:
+        while True:
+            while len(in_flight) >= add_plate_concurrency.limit:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            if retry:
+                img_path = retry.popleft()
+                in_flight[pool.submit(process_image_measured, img_path, lane)] = img_path
+                continue
+            chunk = list(itertools.islice(images, chunk_size))
+            if chunk:
+                in_flight[pool.submit(add_chunk_measured, chunk, chunk_size, lane)] = chunk
+            elif in_flight:
+                # failed chunks still to come back for their retries
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            else:
+                break
+
+    logging.info(f"done bulk add_plate_metadata to db, images processed (including thumbs): {done_count}, "
+                 f"failed: {failed}")
+    return failed
+
+
+def add_chunk_measured(chunk: List[str], chunk_size: int, lane: int = LIVE) -> bool:
+    """
+    add_images_to_db_bulk with its latency and DB pool wait (per image) recorded in
+    add_plate_concurrency, returns False if the chunk failed
+    """
+    start = time.perf_counter()
+    pool_wait_start = Database.get_instance().pool_wait_seconds()
+    try:
+        add_images_to_db_bulk(chunk, chunk_size, lane)
+        ok = True
+    except Exception:
+        logging.exception("bulk insert failed, retrying its images one at a time")
+        ok = False
+    add_plate_concurrency.record((time.perf_counter() - start) / len(chunk),
+                                 (Database.get_instance().pool_wait_seconds() - pool_wait_start) / len(chunk),
+                                 ok, count=len(chunk))
+    return ok
+
+
+def add_images_to_db_bulk(images: List[str], chunk_size: int, lane: int = LIVE):
+    """
+    Parse the images, then insert them with one plate acquisition
+    lookup per folder and one transaction per chunk of images.
+    Thumbnails are made afterwards for the images that were actually inserted.
+    """
     global processed
 
-    total = len(images)
-    logging.info(f"start add_plate_metadata to db, total images (including thumbs): {total}")
+    t_parse = time.perf_counter()
+    parsed = parse_images_by_folder(images)
+    t_parse = time.perf_counter() - t_parse
+    logging.info(f"parse stage: {len(parsed)} images in {t_parse:.2f}s ({len(parsed) / max(t_parse, 1e-6):.0f}/s)")
 
-    max_workers = getattr(imgdb_settings, 'THREADPOOL_WORKERS', 5)
-    futures = []
-    with ThreadPoolExecutor(max_workers=max_workers) as pool:
-        # submit all tasks
-        for img_path in images:
-            futures.append(pool.submit(process_image, img_path))
+    # Group by acquisition folder, skip thumbnails but keep them as processed
+    by_folder: Dict[str, List[ImageRecord]] = {}
+    for img in parsed:
+        if not img.is_thumbnail():
+            by_folder.setdefault(img.get_folder(), []).append(img)
+
+    for folder, folder_images in by_folder.items():
+        t_insert = time.perf_counter()
+        with profiler.stage('acq_lookup', folder):
+            plate_acq_id = Database.get_instance().select_or_insert_plate_acq(folder_images[0])
+        inserted = Database.get_instance().insert_images_batch(folder_images, plate_acq_id, chunk_size)
+        t_insert = time.perf_counter() - t_insert
+        logging.info(f"insert stage: {len(inserted)}/{len(folder_images)} images into acquisition {plate_acq_id} ({folder}) "
+                     f"in {t_insert:.2f}s ({len(folder_images) / max(t_insert, 1e-6):.0f}/s)")
+
+        metrics.inc('imagedb_images_imported_total', len(inserted))
+        ingest_lag.committed(folder, (img.get_path() for img, _ in inserted))
+
+        # Thumbnails are queued to the thumbnail stage, not waited for here
+        for img, _ in inserted:
+            make_thumb(img, lane)
+
+    now = time.time()
+    for img in parsed:
+        processed.add(img.get_path(), now)
+    ingest_lag.discard(images)
+
+
+def process_image_measured(img_path: str, lane: int = LIVE):
+    """
+    process_image, with its latency and DB pool wait recorded in add_plate_concurrency
+    """
+    start = time.perf_counter()
+    pool_wait_start = Database.get_instance().pool_wait_seconds()
+    ok = False
+    try:
+        process_image(img_path, lane)
+        ok = True
+    finally:
+        add_plate_concurrency.record(time.perf_counter() - start,
+                                     Database.get_instance().pool_wait_seconds() - pool_wait_start, ok)
+
+
+def configure_add_plate_concurrency():
+    """
+    Bounds of the adaptive worker count from the THREADPOOL_WORKERS* settings,
+    the max is kept below the DB connection pool size
+    """
+    initial = int(getattr(imgdb_settings, 'THREADPOOL_WORKERS', 5))
+    adaptive = bool(getattr(imgdb_settings, 'THREADPOOL_ADAPTIVE', True))
+    min_workers = int(getattr(imgdb_settings, 'THREADPOOL_WORKERS_MIN', 1)) if adaptive else initial
+    max_workers = int(getattr(imgdb_settings, 'THREADPOOL_WORKERS_MAX', 8)) if adaptive else initial
+    # the main thread, work queue heartbeat and metrics also need connections
+    pool_size = Database.get_instance().pool_stats()[1]
+    if pool_size:
+        max_workers = min(max_workers, max(pool_size - 2, 1))
+    add_plate_concurrency.configure(initial, min_workers, max_workers,
+                                    window=int(getattr(imgdb_settings, 'THREADPOOL_ADAPTIVE_WINDOW', 50)),
+                                    enabled=adaptive)
+    logging.info(f"add_plate concurrency: {add_plate_concurrency.limit} workers "
+                 f"({'adaptive ' + str(add_plate_concurrency.min_limit) + '-' + str(add_plate_concurrency.max_limit) if adaptive else 'fixed'})")
+
+
+def add_plate_to_db_per_image(images: Iterable[str], lane: int = LIVE) -> int:
+    """
+    Processes the images in a thread pool with as many images in flight as the
+    adaptive worker count (add_plate_concurrency) allows, at most
+    ADD_PLATE_MAX_IN_FLIGHT, so images are read from the iterable only as fast
+    as they are processed.
+    """
+    global processed
 
-        # process results as they come in
-        done_count = 0
-        for fut in as_completed(futures):
+    logging.info("start add_plate_metadata to db")
+
+    max_in_flight = int(getattr(imgdb_settings, 'ADD_PLATE_MAX_IN_FLIGHT', 100))
+
+    in_flight: Dict[Future, str] = {}
+    done_count = 0
+    failed = 0
+
+    def collect(done_futures):
+        nonlocal done_count, failed
+        for fut in done_futures:
+            img_path = in_flight.pop(fut)
             done_count += 1
-            try:
-                fut.result()
-            except Exception:
-                # cancel remaining tasks
-                for other in futures:
-                    other.cancel()
-                # re-raise so your outer loop blacklists the folder
-                raise
+            exception = fut.exception()
+            if exception is not None:
+                failed += 1
+                record_failed_image(img_path, exception)
 
             # log progress every 100
-            if done_count % 100 == 0 or done_count == total:
-                logging.info(f"images processed (including thumbs): {done_count}/{total}")
+            if done_count % 100 == 0:
+                logging.info(f"images processed (including thumbs): {done_count}, failed: {failed}, "
+                             f"workers: {add_plate_concurrency.limit}, {add_plate_concurrency.describe()}")
+
+    # the pool has threads for the max worker count, the limit of the moment is kept by
+    # not submitting more images than it allows
+    with ThreadPoolExecutor(max_workers=add_plate_concurrency.max_limit) as pool:
+        for img_path in images:
+            while len(in_flight) >= min(add_plate_concurrency.limit, max_in_flight):
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(done)
+            in_flight[pool.submit(process_image_measured, img_path, lane)] = img_path
+
+        done, _ = wait(in_flight)
+        collect(done)
+
+    logging.info(f"done add_plate_metadata to db, images processed (including thumbs): {done_count}, failed: {failed}, "
+                 f"workers: {add_plate_concurrency.limit}, {add_plate_concurrency.describe()}")
+    return failed
+
+
+def record_failed_image(img_path: str, exception: BaseException):
+    """
+    A bad file should not stop the import of the rest of the folder. The failure is
+    logged (also to failed-images.log in ERROR_LOG_DIR) and the image is tried again
+    on the following polls, after MAX_IMAGE_ATTEMPTS it is marked as processed.
+    """
+    attempts = failed_images.get(img_path, (0, 0.0))[0] + 1
+    failed_images[img_path] = (attempts, time.time())
+    metrics.inc('imagedb_images_failed_total')
+    ingest_lag.discard([img_path])
+    logging.error(f"Exception processing image (attempt {attempts}): {img_path}", exc_info=exception)
+
+    if attempts >= int(getattr(imgdb_settings, 'MAX_IMAGE_ATTEMPTS', 3)):
+        logging.error(f"Giving up on image after {attempts} attempts: {img_path}")
+        processed.add(img_path, time.time())
+        failed_images.pop(img_path, None)
+
+    try:
+        failed_file = os.path.join(imgdb_settings.ERROR_LOG_DIR, "failed-images.log")
+        with open(failed_file, 'a') as f:
+            f.write(f"{datetime.today()}\t{attempts}\t{img_path}\t{exception!r}\n")
+    except Exception:
+        logging.exception("Could not write failed-images.log")
+
+def drop_failed_images_before(cutoff: float) -> int:
+    """
+    Forgets the failed images that have not failed again since cutoff, like processed.drop_before,
+    they start over from the first attempt if they are imported again
+    """
+    global failed_images
+    kept = {path: failure for path, failure in failed_images.items() if failure[1] >= cutoff}
+    dropped = len(failed_images) - len(kept)
+    failed_images = kept
+    return dropped
+
+
+def record_file_mtime(img_path: str):
+    """
+    Remembers when the file was written, for the ingest lag of its acquisition
+    """
+    try:
+        ingest_lag.file_seen(img_path, os.stat(img_path).st_mtime)
+    except OSError:
+        pass
+
+
+def mark_acquisition_finished(plate_acq_folder: str, timestamp: float):
+    Database.get_instance().update_acquisition_finished(plate_acq_folder, timestamp)
+    store_ingest_lag(plate_acq_folder)
+
+
+def mark_acquisitions_finished(plate_acq_folders: List[str], timestamp: float):
+    """
+    Marks all the acquisitions finished in one UPDATE
+    """
+    if not plate_acq_folders:
+        return
+    t_update = time.perf_counter()
+    Database.get_instance().update_acquisitions_finished([(folder, timestamp) for folder in plate_acq_folders])
+    logging.info(f"marked {len(plate_acq_folders)} acquisitions finished in {time.perf_counter() - t_update:.3f}s")
+    for plate_acq_folder in plate_acq_folders:
+        store_ingest_lag(plate_acq_folder)
+
+
+def store_ingest_lag(plate_acq_folder: str):
+    # store the ingest lag of the acquisition, failing to do so should not stop anything
+    lag = ingest_lag.pop_summary(plate_acq_folder)
+    if lag is not None and 'plate_acquisition_ingest_lag' not in missing_schema:
+        logging.info(f"ingest lag {plate_acq_folder}: images={lag['images']}, p50={lag['lag_p50']:.1f}s, "
+                     f"p95={lag['lag_p95']:.1f}s, max={lag['lag_max']:.1f}s")
+        try:
+            Database.get_instance().upsert_acquisition_ingest_lag(plate_acq_folder, **lag)
+        except Exception:
+            logging.exception("Could not store ingest lag for: " + str(plate_acq_folder))
+
+
+def queue_activity_by_folder() -> Dict[str, float]:
+    """
+    Latest import time of the queued image dirs, also under each of their parent
+    dirs (an acquisition folder can be above its image dirs, e.g. TimePoint_1)
+    """
+    activity: Dict[str, float] = {}
+    for folder, last_imported in Database.get_instance().select_ingest_queue_last_imported().items():
+        path = folder.rstrip('/')
+        while path and path != '/':
+            if activity.get(path, 0) >= last_imported:
+                break
+            activity[path] = last_imported
+            path = os.path.dirname(path)
+    return activity
 
-    logging.info("done add_plate_metadata to db")
 
 def update_finished_plate_acquisitions(cutoff_time):
     update_finished_plate_acquisitions_from_cutoff_time(cutoff_time)
@@ -153,61 +480,146 @@ def update_finished_plate_acquisitions_from_file():
         # if coordinates.csv file in plate_acq folder, then set finished
         finished_flag_file = os.path.join(plate_acq_folder, "coordinates.csv")
         if os.path.exists(finished_flag_file):
-            Database.get_instance().update_acquisition_finished(plate_acq_folder, time.time())
+            mark_acquisition_finished(plate_acq_folder, time.time())
 
 
 def update_finished_plate_acquisitions_from_cutoff_time(cutoff_time):
     global processed
 
+    global unfinished_trie
+
     # first get unfinished acq from database
     unfinished = Database.get_instance().select_unfinished_plate_acq_folder()
+    unfinished_trie = PathTrie(unfinished)
+
+    # with a work queue the folders are imported by all workers, the queue knows when they last imported
+    queue_activity = queue_activity_by_folder() if work_queue is not None else {}
 
+    # every lookup below is by folder (dict or primary key), the finished ones are updated together
+    to_finish = []
     for plate_acq_folder in unfinished:
 
-        # loop processed images in reverse to see when last file was processed for this unfinished folder
-        for img_path in reversed(processed):
-            if plate_acq_folder in img_path:
-                proc_time = processed[img_path]
-                logging.info("proc_time=" + str(proc_time))
-                logging.info("cutoff_time=" + str(cutoff_time))
-                if proc_time < cutoff_time:
-                    Database.get_instance().update_acquisition_finished(plate_acq_folder, cutoff_time)
+        last_imported = queue_activity.get(plate_acq_folder.rstrip('/'))
+        if last_imported is not None:
+            if last_imported < cutoff_time:
+                to_finish.append(plate_acq_folder)
+            continue
+
+        # the journal knows when images were last imported, also from before a restart
+        if ingest_journal is not None:
+            last_activity = ingest_journal.last_activity(plate_acq_folder)
+            if last_activity is not None:
+                logging.debug(f"last_activity={last_activity}, cutoff_time={cutoff_time}: {plate_acq_folder}")
+                if last_activity < cutoff_time:
+                    to_finish.append(plate_acq_folder)
+                continue
+
+        # when the last file was processed for this unfinished folder (or below it)
+        proc_time = processed.last_activity(plate_acq_folder)
+        if proc_time is not None:
+            logging.debug(f"proc_time={proc_time}, cutoff_time={cutoff_time}: {plate_acq_folder}")
+            if proc_time < cutoff_time:
+                to_finish.append(plate_acq_folder)
 
-                # latest proc_time for this acquisition is found, time to break
-                break
+    mark_acquisitions_finished(to_finish, cutoff_time)
+    if to_finish:
+        finished = set(to_finish)
+        unfinished_trie = PathTrie(folder for folder in unfinished if folder not in finished)
 
 #
 # Main import function
 #
-def import_plate_images_and_meta(plate_dir: str):
+def import_plate_images_and_meta(plate_dir: str) -> int:
     """
-    Main import function
+    Main import function, returns the number of new images imported
     """
 
     global processed
 
     logging.info("start import_plate_images_and_meta: " + str(plate_dir))
 
-    all_images = sorted(file_utils.get_all_image_files(plate_dir))
+    # stat before listing, files added while importing will change the mtime again
+    checked_at = time.time()
+    dir_mtime = os.stat(plate_dir).st_mtime
+    if ingest_journal is not None and ingest_journal.is_unchanged(plate_dir, dir_mtime):
+        logging.info("unchanged since last import (ingest journal), skipping: " + str(plate_dir))
+        return 0
+
+    # file reads of this folder (stat, thumbnail) wait in its lane of the io scheduler
+    io_lane = folder_io_lane(plate_dir, dir_mtime)
+    if io_scheduler.is_limited(plate_dir):
+        logging.info(f"io lane {LANE_NAMES[io_lane]}: {plate_dir}")
+
+    # the folder listing, streamed on sorted by name per chunk so that the first image, which
+    # creates the plate acquisition (imaged can come from its ctime), is the same on every run
+    # of an unchanged folder without holding a whole 500k file listing; only images not in
+    # processed dict and not already in db are streamed
+    # on (one query for the whole folder instead of one exists-query per image) and of
+    # those only the ones that are completely written, see file_stability
+    counts = {'all': 0, 'new': 0, 'deferred': 0}
+
+    def new_images():
+        known_paths = None
+        listing = profiler.timed_iter('listing', file_utils.iter_image_entries(plate_dir), plate_dir)
+        chunk_size = int(getattr(imgdb_settings, 'BULK_INSERT_CHUNK_SIZE', 1000))
+        for entry in file_utils.sorted_chunks(listing, chunk_size, key=lambda entry: entry.name):
+            img = entry.path
+            counts['all'] += 1
+            if img in processed:
+                continue
+            if known_paths is None:
+                with profiler.stage('db_exists', plate_dir):
+                    known_paths = Database.get_instance().select_image_paths_in_folder(plate_dir)
+            if img in known_paths:
+                processed.add(img, time.time())
+                continue
+            io_scheduler.acquire(img, io_lane, files=1)
+            try:
+                stat = entry.stat()
+            except OSError:
+                # removed or renamed since the listing
+                continue
+            if not file_stability.is_stable(plate_dir, img, stat.st_size, stat.st_mtime):
+                counts['deferred'] += 1
+                continue
+            counts['new'] += 1
+            ingest_lag.file_seen(img, stat.st_mtime)
+            yield img
+
+    # import images, if there are any new
+    failed = 0
+    image_stream = new_images()
+    try:
+        first_image = next(image_stream, None)
+        if first_image is not None:
+            failed = add_plate_to_db(itertools.chain([first_image], image_stream), io_lane)
+    finally:
+        file_stability.end_listing(plate_dir)
 
     # if no images and marker present, bail out and let polling_loop blacklist
-    if not all_images:
+    if counts['all'] == 0:
         marker = os.path.join(plate_dir, "coordinates.csv")
         if os.path.exists(marker):
             logging.info("no images in %s but found marker file, blacklisting", plate_dir)
             raise Exception("No images and marker file present — blacklist this dir")
 
-    # create a new list with only images not in processed dict
-    new_images = [img for img in all_images if img not in processed]
-
-    # import images (if later than latest_import_filedate)
-    if len(new_images) > 0:
-        add_plate_to_db(new_images)
+    if failed:
+        # images that were added are in processed and in the db, the next poll continues with the failed ones
+        if failed == counts['new']:
+            raise Exception(f"All {failed} new images failed — blacklist this dir")
+        logging.warning(f"{failed}/{counts['new']} new images failed in {plate_dir}, will retry next poll")
+    elif counts['deferred']:
+        # not in the journal, the folder mtime does not change when the deferred files are done
+        logging.info(f"{counts['deferred']} images still being written in {plate_dir}, deferred to next poll")
+    elif ingest_journal is not None:
+        ingest_journal.record(plate_dir, counts['all'], dir_mtime, checked_at, counts['new'] > 0)
 
     logging.info("done import_plate_images_and_meta: " + str(plate_dir))
     # mark liveness after finishing one plate directory
     _touch_liveness()
 
+    return counts['new'] - failed
+
 
 # directories that don't have images or are throwing errors when processed
 blacklist: List[str] = [
@@ -218,11 +630,327 @@ blacklist: List[str] = [
     '/share/mikro4/squid/trash/'
 ]
 
-# processed filenames and timestamp when processed
-processed: Dict[str, float] = {}
+# processed filenames, with the time of the latest one per folder
+processed: ProcessedPaths = ProcessedPaths()
+
+# filenames that failed to import -> (number of attempts, time of the last one), see record_failed_image
+failed_images: Dict[str, Tuple[int, float]] = {}
+
+# thumbnail process pool stage, created on first use
+thumbnail_stage: Optional[ThumbnailStage] = None
+thumbnail_stage_lock = threading.Lock()
+
+# persistent per-folder watermarks, opened in polling_loop
+ingest_journal: Optional[IngestJournal] = None
+
+# concurrent per-mount discovery of image dirs, created in polling_loop
+discovery: Optional[ParallelDiscovery] = None
+
+# finished acquisitions ('finished') and blacklisted dirs ('blacklisted'),
+# the finished ones are fetched incrementally, see refresh_skip_trie
+skip_trie: PathTrie = PathTrie()
+finished_watermark: Optional[datetime] = None
+finished_full_reload_time: float = 0
+
+
+# acquisitions not finished in the db, refreshed every poll by the finisher (live lane of the
+# io scheduler, processed keeps their activity)
+unfinished_trie: PathTrie = PathTrie()
+
+# schema that is not in the database yet (db/migrations.sql), e.g. 'plate_acquisition_ingest_lag',
+# the features that need it are turned off, see check_schema
+missing_schema: Set[str] = set()
+
+
+def configure_file_stability():
+    file_stability.window = float(getattr(imgdb_settings, 'FILE_STABLE_SECONDS', 10))
+
+
+def configure_io_scheduler():
+    io_scheduler.configure(
+        files_per_sec=parse_limits(getattr(imgdb_settings, 'IO_MOUNT_FILES_PER_SEC', '')),
+        bytes_per_sec=parse_limits(getattr(imgdb_settings, 'IO_MOUNT_BYTES_PER_SEC', '')),
+        default_files_per_sec=float(getattr(imgdb_settings, 'IO_FILES_PER_SEC', 0)),
+        default_bytes_per_sec=float(getattr(imgdb_settings, 'IO_BYTES_PER_SEC', 0))
+    )
+    share_io_live_lane(io_scheduler)
+
+
+def share_io_live_lane(scheduler: IOScheduler):
+    """
+    Shares the live lane of scheduler with other processes through the io_live_lane table
+    (IO_SHARED_LIVE_LANE), see io_scheduler
+    """
+    if not getattr(imgdb_settings, 'IO_SHARED_LIVE_LANE', False):
+        scheduler.share_live_lane(None, None)
+        return
+    try:
+        has_table = Database.get_instance().has_table('io_live_lane')
+    except Exception:
+        has_table = False
+    if not has_table:
+        logging.warning("IO_SHARED_LIVE_LANE is on but the io_live_lane table is missing (run db/migrations.sql), "
+                        "the live lane is not shared")
+        scheduler.share_live_lane(None, None)
+        return
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    scheduler.share_live_lane(
+        mark_live=lambda mount, seconds: Database.get_instance().mark_io_live(mount, owner, seconds),
+        select_live=Database.get_instance().select_io_live_mounts,
+        hold_seconds=float(getattr(imgdb_settings, 'IO_LIVE_HOLD_SECONDS', 10))
+    )
+
+
+def folder_io_lane(plate_dir: str, dir_mtime: float) -> int:
+    """
+    LIVE for recently modified folders and folders of unfinished acquisitions,
+    BULK for historical ones (e.g. in an exhaustive initial poll)
+    """
+    live_window = float(getattr(imgdb_settings, 'IO_LIVE_WINDOW', 86400))
+    if dir_mtime >= time.time() - live_window or unfinished_trie.find(plate_dir) is not None:
+        return LIVE
+    return BULK
+
+
+def refresh_skip_trie(now: float):
+    """
+    Adds acquisitions finished since the last poll to skip_trie: the ones whose
+    finished was set or changed (finished_changed, set by a trigger for every writer)
+    since the previous refresh, with an overlap for rows that were committed late.
+    A full reload every FINISHED_FULL_RELOAD_INTERVAL seconds drops acquisitions that
+    have been moved or un-finished since.
+    """
+    global skip_trie, finished_watermark, finished_full_reload_time
+
+    full_reload_interval = float(getattr(imgdb_settings, 'FINISHED_FULL_RELOAD_INTERVAL', 86400))
+    overlap = timedelta(seconds=float(getattr(imgdb_settings, 'FINISHED_WATERMARK_OVERLAP', 86400)))
+
+    t_refresh = time.perf_counter()
+    # the next refresh fetches what changed since this one started (the overlap also covers clock skew to the db)
+    refresh_start = datetime.fromtimestamp(now, timezone.utc)
+    if (finished_watermark is None or now - finished_full_reload_time > full_reload_interval
+            or 'plate_acquisition.finished_changed' in missing_schema):
+        rows = Database.get_instance().select_finished_plate_acq_folder_since(None)
+        trie = PathTrie(blacklist, 'blacklisted')
+        finished_full_reload_time = now
+        full_reload = True
+    else:
+        rows = Database.get_instance().select_finished_plate_acq_folder_since(finished_watermark - overlap)
+        trie = skip_trie
+        full_reload = False
+
+    for folder, _ in rows:
+        trie.add(folder, 'finished')
+    finished_watermark = refresh_start
+    skip_trie = trie
+
+    # acquisitions finished by other processes (work queue workers, dbscripts) have no lag to store here
+    ingest_lag.drop_folders(lambda folder: skip_trie.find(folder) is not None)
+
+    logging.info(f"finished acquisitions: fetched {len(rows)} ({'full' if full_reload else 'incremental'}), "
+                 f"skip trie size {len(skip_trie)}, in {time.perf_counter() - t_refresh:.2f}s")
+
+
+# inotify watcher for --watch mode, created in polling_loop
+watcher: Optional[InotifyWatcher] = None
+
+# metrics http server (if METRICS_PORT), started in polling_loop
+metrics_server = None
+
+# ingest_queue table shared with other image_monitors (WORK_QUEUE setting), created in polling_loop
+work_queue: Optional[FolderWorkQueue] = None
+
+
+def watch_dir(img_dir: str):
+    """
+    Watches an acquisition folder, and its parent where new acquisitions show up
+    """
+    watcher.add_watch(img_dir)
+    watcher.add_watch(os.path.dirname(img_dir.rstrip('/')))
+
+
+def watch_new_dir(new_dir: str, pending: Dict[str, List[str]]):
+    """
+    Watches a dir that was just created, with its sub dirs. Files written before
+    the watches were in place are added to pending if they are completely written
+    (see file_stability), the others are imported on their close_write event or
+    by the next poll.
+    """
+    for dirpath, _, filenames in os.walk(new_dir):
+        watcher.add_watch(dirpath)
+        for filename in filenames:
+            if file_utils.is_image_file(filename):
+                img = os.path.join(dirpath, filename)
+                try:
+                    stat = os.stat(img)
+                except OSError:
+                    continue
+                if file_stability.is_stable(dirpath, img, stat.st_size, stat.st_mtime):
+                    pending.setdefault(dirpath, []).append(img)
+        file_stability.end_listing(dirpath)
+
+
+def import_watched_files(pending: Dict[str, List[str]]):
+    for folder, files in pending.items():
+        if skip_trie.find(folder) is not None:
+            continue
+        new_files = [img for img in dict.fromkeys(files) if img not in processed]
+        if not new_files:
+            continue
+        for img in new_files:
+            record_file_mtime(img)
+        logging.info(f"watch: {len(new_files)} new images in {folder}")
+        try:
+            # just written, so read in the live lane
+            add_plate_to_db(new_files, LIVE)
+        except Exception:
+            # the next poll imports the folder as usual (and blacklists it if needed)
+            logging.exception("Exception importing watched images in: " + str(folder))
+    _touch_liveness()
+
+
+def wait_for_changes(sleep_time: float):
+    """
+    Used instead of sleeping between polls in --watch mode: imports image files as
+    inotify reports them written, in batches of at most WATCH_DEBOUNCE seconds, until
+    it is time for the next poll. The polls are still needed for NFS, where events
+    from other hosts are not delivered, and for overflowed event queues.
+    """
+    debounce = float(getattr(imgdb_settings, 'WATCH_DEBOUNCE', 2))
+    deadline = time.time() + sleep_time
+    pending: Dict[str, List[str]] = {}
+    first_pending = None
+
+    while time.time() < deadline:
+        events = watcher.read_events(min(deadline - time.time(), debounce))
+        for event in events:
+            if event.is_overflow:
+                logging.warning("watch: inotify event queue overflow, polling now")
+                import_watched_files(pending)
+                return
+
+            if event.is_dir:
+                if event.mask & (IN_CREATE | IN_MOVED_TO):
+                    watch_new_dir(event.path, pending)
+            elif event.mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and file_utils.is_image_file(os.path.basename(event.path)):
+                pending.setdefault(os.path.dirname(event.path), []).append(event.path)
+
+            if pending and first_pending is None:
+                first_pending = time.time()
+
+        if pending and (not events or time.time() - first_pending >= debounce):
+            import_watched_files(pending)
+            pending = {}
+            first_pending = None
+
+    import_watched_files(pending)
+
+
+def log_dir_exception(img_dir):
+    """
+    Appends the exception being handled to exceptions-last-poll.log
+    """
+    exception_file = os.path.join(imgdb_settings.ERROR_LOG_DIR, "exceptions-last-poll.log")
+    with open(exception_file, 'a') as exc_file:
+        exc_file.write(f"Exception, time: {datetime.today()}\n")
+        exc_file.write(f"img_dir: {img_dir}\n")
+        exc_file.write(traceback.format_exc())
+
+
+def drain_work_queue(deadline: float) -> bool:
+    """
+    Claims folders from the work queue and imports them until the queue is empty
+    or deadline (epoch) has passed. Returns True if the queue was emptied.
+    Failing folders are retried by the queue (any worker) instead of blacklisted.
+    """
+    claim_batch = int(getattr(imgdb_settings, 'WORK_QUEUE_CLAIM_BATCH', 4))
+    folder_count = 0
+    emptied = False
+    while time.time() < deadline:
+        claimed = work_queue.claim(claim_batch)
+        if not claimed:
+            emptied = True
+            break
 
+        for folder, dir_mtime in claimed:
+            try:
+                imported = import_plate_images_and_meta(folder)
+            except Exception as e:
+                logging.exception("Exception in queued img_dir")
+                log_dir_exception(folder)
+                work_queue.complete(folder, dir_mtime, error=repr(e))
+            else:
+                # files still being written keep the folder pending, claimable again when they should be done
+                deferred = file_stability.deferred_count(folder)
+                work_queue.complete(folder, dir_mtime, imported=imported,
+                                    defer_seconds=file_stability.window if deferred else None)
+            folder_count += 1
+
+    logging.info(f"work queue: imported {folder_count} folders as {work_queue.worker_id}"
+                 f"{'' if emptied else ', more are queued'}")
+    return emptied
+
+
+def start_metrics():
+    """
+    Registers the gauges read from the monitor state and starts the
+    metrics http server if METRICS_PORT is set
+    """
+    global metrics_server
+
+    start_time = time.time()
+    metrics.gauge('imagedb_processed_size', 'Paths in the processed set', lambda: len(processed))
+    metrics.gauge('imagedb_processed_folders', 'Folders in the processed set', lambda: processed.folder_count())
+    metrics.gauge('imagedb_blacklist_size', 'Blacklisted dirs', lambda: len(blacklist))
+    metrics.gauge('imagedb_files_deferred', 'Image files deferred to the next poll, still being written',
+                  lambda: file_stability.deferred_count())
+    metrics.gauge('imagedb_thumbnail_pending', 'Thumbnails queued or being made',
+                  lambda: thumbnail_stage.pending() if thumbnail_stage is not None else 0)
+    metrics.gauge('imagedb_db_pool_connections_in_use', 'DB connections checked out of the pool',
+                  lambda: Database.get_instance().pool_stats()[0])
+    metrics.gauge('imagedb_db_pool_connections_max', 'DB connection pool size',
+                  lambda: Database.get_instance().pool_stats()[1])
+    metrics.gauge('imagedb_add_plate_workers', 'Images processed concurrently (adaptive)',
+                  lambda: add_plate_concurrency.limit)
+    metrics.gauge('imagedb_add_plate_image_latency_seconds', 'Mean per-image latency of the last window',
+                  lambda: add_plate_concurrency.latency)
+    metrics.gauge('imagedb_io_live_wait_seconds', 'Seconds live lane reads waited for the io scheduler',
+                  lambda: io_scheduler.wait_seconds[LIVE])
+    metrics.gauge('imagedb_io_bulk_wait_seconds', 'Seconds bulk lane reads waited for the io scheduler',
+                  lambda: io_scheduler.wait_seconds[BULK])
+    metrics.gauge('imagedb_seconds_since_last_successful_poll', 'Seconds since the last poll completed (or since start)',
+                  lambda: time.time() - (metrics.get('imagedb_last_successful_poll_timestamp_seconds') or start_time))
+
+    port = int(getattr(imgdb_settings, 'METRICS_PORT', 0))
+    if port and metrics_server is None:
+        try:
+            metrics_server = start_http_server(port)
+        except Exception:
+            logging.exception(f"Could not start metrics http server on port {port}")
 
-def polling_loop(poll_dirs_margin_days, latest_file_change_margin, sleep_time, proj_root_dirs, exhaustive_initial_poll, continuous_polling):
+
+def check_schema(work_queue_mode: str = 'off'):
+    """
+    Looks for the tables, columns and triggers that db/migrations.sql adds to an existing
+    database. The features that need a missing one are turned off with a warning, except
+    the work queue, which has to be asked for and fails instead.
+    """
+    db = Database.get_instance()
+    missing_schema.clear()
+    if not (db.has_table('plate_acquisition', 'finished_changed')
+            and db.has_trigger('plate_acquisition', 'tr_plate_acquisition_finished_changed')):
+        missing_schema.add('plate_acquisition.finished_changed')
+        logging.warning("plate_acquisition.finished_changed or its trigger is missing (run db/migrations.sql), "
+                        "finished acquisitions are reloaded in full every poll")
+    if not db.has_table('plate_acquisition_ingest_lag'):
+        missing_schema.add('plate_acquisition_ingest_lag')
+        logging.warning("plate_acquisition_ingest_lag table is missing (run db/migrations.sql), "
+                        "the ingest lag of acquisitions is not stored")
+    if work_queue_mode != 'off' and not db.has_table('ingest_queue'):
+        raise Exception("work queue is on but the ingest_queue table is missing, run db/migrations.sql")
+
+
+def connect_to_db():
     Database.get_instance().initialize_connection_pool(
                 user=imgdb_settings.DB_USER,
                 password=imgdb_settings.DB_PASS,
@@ -231,7 +959,54 @@ def polling_loop(poll_dirs_margin_days, latest_file_change_margin, sleep_time, p
                 database=imgdb_settings.DB_NAME
     )
 
-    global processed, blacklist
+
+def polling_loop(poll_dirs_margin_days, latest_file_change_margin, sleep_time, proj_root_dirs, exhaustive_initial_poll, continuous_polling, watch=False, work_queue_mode='off'):
+    connect_to_db()
+    check_schema(work_queue_mode)
+
+    global processed, blacklist, ingest_journal, discovery, watcher, work_queue
+
+    profiler.enabled = bool(getattr(imgdb_settings, 'PROFILE_STAGES', False))
+    configure_file_stability()
+    configure_io_scheduler()
+    configure_add_plate_concurrency()
+    start_metrics()
+
+    journal_file = getattr(imgdb_settings, 'INGEST_JOURNAL_FILE', None)
+    if journal_file and ingest_journal is None:
+        ingest_journal = open_journal(journal_file)
+
+    if getattr(imgdb_settings, 'DISCOVERY_PARALLEL', True) and discovery is None:
+        discovery = ParallelDiscovery(
+            workers_per_mount=int(getattr(imgdb_settings, 'DISCOVERY_WORKERS_PER_MOUNT', 2)),
+            timeout=float(getattr(imgdb_settings, 'DISCOVERY_TIMEOUT', 600))
+        )
+
+    if work_queue_mode not in ('off', 'enqueue', 'worker', 'both'):
+        raise ValueError(f"Unknown work queue mode: {work_queue_mode}")
+    if work_queue_mode != 'off' and work_queue is None:
+        work_queue = FolderWorkQueue(
+            worker_id=getattr(imgdb_settings, 'WORK_QUEUE_WORKER_ID', '') or f"{socket.gethostname()}:{os.getpid()}",
+            lease_seconds=float(getattr(imgdb_settings, 'WORK_QUEUE_LEASE_SECONDS', 300)),
+            max_attempts=int(getattr(imgdb_settings, 'WORK_QUEUE_MAX_ATTEMPTS', 3)),
+            retry_delay=float(getattr(imgdb_settings, 'WORK_QUEUE_RETRY_DELAY', 600))
+        )
+    discover = work_queue_mode != 'worker'
+    drain_seconds = float(getattr(imgdb_settings, 'WORK_QUEUE_DRAIN_SECONDS', 600))
+
+    if watch and work_queue is not None:
+        # watched files would be imported here, outside of the queue
+        logging.warning("watch mode is not used together with the work queue, only polling")
+        watch = False
+
+    if watch and watcher is None:
+        try:
+            watcher = InotifyWatcher(max_watches=int(getattr(imgdb_settings, 'WATCH_MAX_DIRS', 8192)))
+            for root_dir in proj_root_dirs:
+                watcher.add_watch(root_dir)
+        except Exception:
+            logging.exception("Could not start inotify watcher, only polling")
+            watcher = None
 
     is_initial_poll = True
 
@@ -242,6 +1017,8 @@ def polling_loop(poll_dirs_margin_days, latest_file_change_margin, sleep_time, p
     logging.info("  proj_root_dirs=%s", proj_root_dirs)
     logging.info("  exhaustive_initial_poll=%s", exhaustive_initial_poll)
     logging.info("  continuous_polling=%s", continuous_polling)
+    logging.info("  watch=%s", watch)
+    logging.info("  work_queue=%s", work_queue_mode)
 
     while True:
 
@@ -253,25 +1030,49 @@ def polling_loop(poll_dirs_margin_days, latest_file_change_margin, sleep_time, p
         logging.info("")
 
         start_loop = time.time()
+        imported_at_start = metrics.get('imagedb_images_imported_total')
 
         now = time.time()
         # create new cutoff time for finished acquisitions / processed dict
         cutoff_time = now - latest_file_change_margin
 
-        # get finished ones from db
-        finished_acq_folders = Database.get_instance().select_finished_plate_acq_folder()
+        # Refresh in-process caches once per poll: acquisitions may have been moved
+        # (e.g. to trash) or channel_map_mapping edited since the last poll
+        Database.get_instance().invalidate_plate_acq_cache()
+        Database.get_instance().load_channel_map_mapping()
 
-        # get all image dirs within root dirs (yields dirs sorted by date, most recent first),
-        # pruning finished acquisitions so we don't walk them at all
-        for img_dir in file_utils.find_dirs_containing_img_files_recursive_from_list_of_paths(
-            proj_root_dirs, skip_dirs=finished_acq_folders
-        ):
+        # get finished ones from db (only the newly finished ones, except for a periodic full reload),
+        # if that fails the previous skip trie is used, without one the poll only imports queued folders
+        skip_trie_ok = True
+        if discover:
+            try:
+                refresh_skip_trie(now)
+            except Exception:
+                logging.exception("Could not refresh finished acquisitions")
+                skip_trie_ok = finished_watermark is not None
+
+        # get all image dirs within root dirs (yields dirs sorted by date, most recent first, per mount as its walk is done),
+        # pruning finished acquisitions and blacklisted dirs so we don't walk them at all
+        if not discover or not skip_trie_ok:
+            img_dirs = []
+        elif discovery is not None:
+            img_dirs = discovery.find(proj_root_dirs, skip_dirs=skip_trie)
+        else:
+            img_dirs = file_utils.find_dirs_containing_img_files_recursive_from_list_of_paths(
+                proj_root_dirs, skip_dirs=skip_trie
+            )
+
+        # (folder, dir mtime) for the work queue, instead of importing them here
+        to_enqueue = []
+
+        for img_dir in img_dirs:
 
             logging.debug(f"img_dir: {img_dir}")
 
-            # remove finished acquisitions
-            if str(img_dir) in finished_acq_folders:
-                logging.debug(f"removed because finished: {img_dir}")
+            # remove finished acquisitions and blacklisted dirs (or dirs below them)
+            skip_reason = skip_trie.find(str(img_dir))
+            if skip_reason is not None:
+                logging.debug(f"removed because {skip_reason}: {img_dir}")
                 continue
 
             # remove old dirs
@@ -286,23 +1087,18 @@ def polling_loop(poll_dirs_margin_days, latest_file_change_margin, sleep_time, p
                     logging.debug(f"removed because old: {img_dir} ")
                     continue
 
-            # Initialize the flag for blacklisted items
-            is_blacklisted = False
-            norm_img_dir = str(img_dir).rstrip('/') + '/'
-            for blacklisted_item in blacklist:
-                norm_blacklisted = blacklisted_item.rstrip('/') + '/'
-                # Treat any directory under a blacklisted root as blacklisted
-                if norm_img_dir.startswith(norm_blacklisted):
-                    logging.debug(f"removed because blacklisted: {img_dir}")
-                    is_blacklisted = True
-                    break  # Exit the inner loop as we found a match
-            # If the directory is blacklisted, continue with the next img_dir
-            if is_blacklisted:
+            if work_queue is not None:
+                to_enqueue.append((str(img_dir), img_dir.stat().st_mtime))
                 continue
 
+            norm_img_dir = str(img_dir).rstrip('/') + '/'
+
             try:
                 import_plate_images_and_meta(str(img_dir))
 
+                if watcher is not None:
+                    watch_dir(str(img_dir))
+
             except Exception as e:
                 logging.exception("Exception in img_dir")
                 # add dir to blacklist if there are more than X wrong files in dir
@@ -310,32 +1106,50 @@ def polling_loop(poll_dirs_margin_days, latest_file_change_margin, sleep_time, p
                 # Ensure trailing slash for consistency
                 if norm_img_dir not in [b.rstrip('/') + '/' for b in blacklist]:
                     blacklist.append(norm_img_dir)
-                exception_file = os.path.join(imgdb_settings.ERROR_LOG_DIR, "exceptions-last-poll.log")
-                with open(exception_file, 'a') as exc_file:
-                    exc_file.write(f"Exception, time: {datetime.today()}\n")
-                    exc_file.write(f"img_dir: {img_dir}\n")
-                    exc_file.write(traceback.format_exc())
+                skip_trie.add(norm_img_dir, 'blacklisted')
+                log_dir_exception(img_dir)
+
+        if to_enqueue:
+            work_queue.enqueue(to_enqueue)
 
+        # import queued folders, with the other workers
+        queue_emptied = True
+        if work_queue_mode in ('worker', 'both'):
+            queue_emptied = drain_work_queue(time.time() + drain_seconds)
 
         # If time > 60 min (default cutoff_time) since last uploaded from unfinished plate_acquisitions
-        # If so update plate_acq to finished
-        update_finished_plate_acquisitions(cutoff_time)
-
-        # If latest processed file was longer ago than cutofftime,
-        # clear processed dict (mainly to release memory)
-        clear_processed = False
-        for img_path in reversed(processed):
-            proc_time = processed[img_path]
-            if proc_time < cutoff_time:
-                logging.info("clear processed dict")
-                clear_processed = True
-            # Only check the last
-            break
-        if clear_processed:
-            processed.clear()
+        # If so update plate_acq to finished (by the monitor that runs discovery)
+        if discover:
+            update_finished_plate_acquisitions(cutoff_time)
+
+        # Forget processed files of folders with nothing processed since cutofftime
+        # (mainly to release memory), their images are found in the db if they are listed again.
+        # Folders of acquisitions still unfinished are kept: without the journal the finisher
+        # goes by their activity, they are dropped once it has marked them finished
+        dropped = processed.drop_before(cutoff_time, keep=lambda folder: unfinished_trie.find(folder) is not None)
+        if dropped:
+            logging.info(f"dropped {dropped} processed files of idle folders, {len(processed)} left "
+                         f"in {processed.folder_count()} folders")
+        drop_failed_images_before(cutoff_time)
+        ingest_lag.drop_idle(time.time() - float(getattr(imgdb_settings, 'INGEST_LAG_IDLE_SECONDS', 86400)))
 
         logging.info("elapsed: " + str(time.time() - start_loop) + " sek")
 
+        poll_duration = time.time() - start_loop
+        metrics.inc('imagedb_polls_total')
+        metrics.set('imagedb_last_poll_duration_seconds', poll_duration)
+        metrics.set('imagedb_images_per_second',
+                    (metrics.get('imagedb_images_imported_total') - imported_at_start) / max(poll_duration, 1e-6))
+        metrics.set('imagedb_last_successful_poll_timestamp_seconds', time.time())
+        metrics_textfile = getattr(imgdb_settings, 'METRICS_TEXTFILE', '')
+        if metrics_textfile:
+            metrics.write_textfile(metrics_textfile)
+        if thumbnail_stage is not None:
+            thumbnail_stage.log_stats()
+
+        # stage timings of this poll (if PROFILE_STAGES), next to blacklist.json
+        profiler.write_report(os.path.join(imgdb_settings.ERROR_LOG_DIR, "stage-profile-last-poll.json"))
+
         # dump blacklist in log dir
         if blacklist:
             logfile = os.path.join(imgdb_settings.ERROR_LOG_DIR, "blacklist.json")
@@ -347,22 +1161,51 @@ def polling_loop(poll_dirs_margin_days, latest_file_change_margin, sleep_time, p
 
         # Sleep until next polling action
         is_initial_poll = False
-        logging.info(f"Going to sleep for: {sleep_time} sek")
-        logging.info("")
-        time.sleep(sleep_time)
+        if not queue_emptied:
+            logging.info("Folders left in the work queue, not sleeping")
+        elif watcher is not None and continuous_polling:
+            logging.info(f"Watching {watcher.watch_count()} dirs for: {sleep_time} sek")
+            logging.info("")
+            wait_for_changes(sleep_time)
+        else:
+            logging.info(f"Going to sleep for: {sleep_time} sek")
+            logging.info("")
+            time.sleep(sleep_time)
 
         # TODO could skip sleeping if images were inserted... but difficult then with 2 hour margin (all files would be tried again)
 
         if continuous_polling != True:
             break
 
+    # let queued thumbnails finish before returning
+    if thumbnail_stage is not None:
+        thumbnail_stage.close()
+
+    if ingest_journal is not None:
+        ingest_journal.close()
+        ingest_journal = None
+
+    if discovery is not None:
+        discovery.close()
+        discovery = None
+
+    if watcher is not None:
+        watcher.close()
+        watcher = None
+
+    if work_queue is not None:
+        work_queue.close()
+        work_queue = None
+
 def rebuild_thumbs(plate_dir: str):
     logging.info("start make_thumbs: " + str(plate_dir))
+    if not io_scheduler.enabled:
+        configure_io_scheduler()
     images = sorted(file_utils.get_all_image_files(plate_dir))
     for idx, img_path in enumerate(images):
 
         img_meta = filenames.filename_parser.parse_path_and_file(img_path)
-        img = Image.from_meta(img_meta)
+        img = ImageRecord.from_meta(img_meta)
 
         # Skip thumbnails
         if not img.is_thumbnail():
@@ -375,7 +1218,8 @@ def rebuild_thumbs(plate_dir: str):
 
             if not thumb_path.is_file():
                 logging.info(f"Make thumb: {thumb_path}")
-                image_tools.makeThumb(img.get_path(), str(thumb_path), False)
+                io_scheduler.acquire_read(img.get_path(), BULK)
+                image_tools.makeThumb(img.get_path(), str(thumb_path), False, bool(getattr(imgdb_settings, 'THUMBNAIL_FAST', True)))
 
 
 def main():
@@ -407,6 +1251,10 @@ def main():
                         default=imgdb_settings.EXHAUSTIVE_INITIAL_POLL)
     parser.add_argument('-lfcm', '--latest-file-change-margin', help='Description for xxx argument',
                         default=imgdb_settings.LATEST_FILE_CHANGE_MARGIN)
+    parser.add_argument('-wq', '--work-queue', help='Share ingest with other monitors through the ingest_queue table: off, enqueue, worker or both',
+                        choices=['off', 'enqueue', 'worker', 'both'], default=imgdb_settings.WORK_QUEUE)
+    parser.add_argument('-w', '--watch', help='Import new image files as inotify reports them, polling stays as a safety net (not for NFS)',
+                        nargs='?', const=True, default=imgdb_settings.WATCH)
     # parser.add_argument('-ll', '--log-level', help='Description for xxx argument',
     #                    default=imgdb_settings.LOG_LEVEL)
 
@@ -431,6 +1279,7 @@ def main():
     sleep_time               = _as_int(args.poll_interval, imgdb_settings.POLL_INTERVAL)
     exhaustive_initial_poll  = _as_bool(args.exhaustive_initial_poll)
     continuous_polling       = _as_bool(args.continuous_polling)
+    watch                    = _as_bool(args.watch)
 
     proj_root_dirs_arg = args.proj_root_dirs
     if isinstance(proj_root_dirs_arg, str):
@@ -443,7 +1292,9 @@ def main():
                  sleep_time,
                  proj_root_dirs,
                  exhaustive_initial_poll,
-                 continuous_polling)
+                 continuous_polling,
+                 watch,
+                 args.work_queue)
 
 
 if __name__ == "__main__":
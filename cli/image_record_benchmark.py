@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+
+import argparse
+import contextlib
+import gc
+import sys
+import time
+import tracemalloc
+from unittest import mock
+
+from filenames import filename_parser, pharmbio_squid_filename_standard_new
+from filenames.benchmark import MOCK_CTIME, MOCK_SQUID_CHANNELS
+from image import Image, ImageRecord
+
+#
+# Benchmark of the ingest objects: Image (wraps the parser's metadata dict)
+# against ImageRecord (slots, derived fields computed once)
+#
+# Parses synthetic squid folders with the two-stage parser (offline, the squid
+# config.json is mocked), then for both classes reports:
+#   - objects/s   making the objects from the parsed metadata and the rows the
+#                 database writer inserts (images_row, upload_row, and the
+#                 plate acquisition fields, barcode and imaged)
+#   - bytes/image memory held by a folder batch of objects (tracemalloc), the
+#                 parse included, since Image keeps the metadata dict alive
+#
+# python3 image_record_benchmark.py --folders 20 --images 5000
+#
+
+CHANNELS = ['Fluorescence_405_nm_Ex', 'Fluorescence_488_nm_Ex', 'Fluorescence_561_nm_Ex',
+            'Fluorescence_638_nm_Ex', 'Fluorescence_730_nm_Ex']
+
+
+def offline_patches():
+    """
+    Like filenames.benchmark.offline_mocks, with plain functions: a Mock keeps every
+    call (with its path) and that memory would be counted as the images'
+    """
+    return [
+        mock.patch('os.path.getctime', new=lambda path: MOCK_CTIME),
+        mock.patch.object(pharmbio_squid_filename_standard_new, 'load_config_channel_names',
+                          new=lambda dir_path: MOCK_SQUID_CHANNELS),
+    ]
+
+
+def make_folders(folder_count: int, images_per_folder: int):
+    folders = []
+    for f in range(folder_count):
+        folder = f"/share/mikro2/squid/benchmark-project/benchmark-P{f:05d}-FA_2024-01-01_12.00.{f % 60:02d}"
+        paths = []
+        for i in range(images_per_folder):
+            well = f"{'BCDEFGHIJKLMNO'[i // 2000 % 14]}{i // 100 % 20 + 2:02d}"
+            paths.append(f"{folder}/{well}_s{i // len(CHANNELS) % 20 + 1}_x0_y0_z{i // 20000}_"
+                         f"{CHANNELS[i % len(CHANNELS)]}.tiff")
+        folders.append((folder, paths))
+    return folders
+
+
+def parse(folders):
+    return [filename_parser.parse_files_in_folder(folder, paths) for folder, paths in folders]
+
+
+def to_rows(images):
+    rows = 0
+    for img in images:
+        img.images_row(1)
+        img.upload_row(1, 1)
+        img.get_plate_barcode()
+        img.get_imaged()
+        rows += 1
+    return rows
+
+
+def objects_per_sec(make, metas_by_folder, repeat: int):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = 0
+        for metas in metas_by_folder:
+            count += to_rows([make(meta) for meta in metas])
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    return count / best
+
+
+def bytes_per_image(make, folders):
+    """
+    Memory held by the objects of one folder, made from a fresh parse
+    """
+    folder, paths = folders[0]
+    gc.collect()
+    tracemalloc.start()
+    images = [make(meta) for meta in filename_parser.parse_files_in_folder(folder, paths)]
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del images
+    return size / len(paths)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Image (dict) against ImageRecord (slots) in the ingest path')
+    parser.add_argument('--folders', type=int, default=20)
+    parser.add_argument('--images', type=int, default=5000, help='Images per folder')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs, the best is reported')
+    args = parser.parse_args()
+
+    with contextlib.ExitStack() as stack:
+        for patch in offline_patches():
+            stack.enter_context(patch)
+
+        folders = make_folders(args.folders, args.images)
+        metas_by_folder = parse(folders)
+
+        results = []
+        for label, make in (('Image (dict)', Image.from_meta), ('ImageRecord', ImageRecord.from_meta)):
+            # the folder batch is measured first, before the caches of ImageRecord are warm from the timing runs
+            size = bytes_per_image(make, folders)
+            results.append((label, objects_per_sec(make, metas_by_folder, args.repeat), size))
+
+    print(f"\n{args.folders * args.images} images in {args.folders} folders")
+    print(f"{'':<14} {'objects/s':>12} {'bytes/image':>12}")
+    for label, rate, size in results:
+        print(f"{label:<14} {rate:>12.0f} {size:>12.0f}")
+    print(f"{'ratio':<14} {results[1][1] / results[0][1]:>11.2f}x {results[0][2] / results[1][2]:>11.2f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
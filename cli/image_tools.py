@@ -5,6 +5,7 @@ import logging
 import os
 from PIL import Image
 import cv2 as cv2
+import numpy as np
 import subprocess
 import time
 import glob
@@ -27,7 +28,32 @@ def read_tiff_info(path):
   output = str(result.stdout.decode())
   return colon_delimited_to_dict(output)
 
-def makeThumb(path, thumbpath, overwrite):
+THUMB_SIZE = (120,120)
+
+# TIFF NewSubfileType tag, bit 0 set means "reduced-resolution version of another image"
+TIFF_TAG_NEW_SUBFILE_TYPE = 254
+
+# Formats whose decoder really reads a reduced image: JPEG (IMREAD_REDUCED_* scales in
+# libjpeg) and TIFF only through its embedded reduced-resolution pages, a plain TIFF is
+# decoded in full by IMREAD_REDUCED_* as well
+JPEG_EXTENSIONS = ('.jpg', '.jpeg')
+TIFF_EXTENSIONS = ('.tif', '.tiff')
+
+# dir -> whether its TIFFs have a usable reduced-resolution page, probed on the first TIFF
+# of the dir (the images of an acquisition are written the same way), so that plain TIFFs
+# are not opened an extra time for the probe
+_tiff_pages_by_dir = {}
+TIFF_PAGES_CACHE_SIZE = 10000
+
+def makeThumb(path, thumbpath, overwrite, fast=True):
+  # fast mode decodes a reduced image where the format has one, the full decode is used
+  # for the other formats and if that fails
+  if fast:
+    try:
+      if makeThumb_opencv_reduced(path, thumbpath, overwrite):
+        return
+    except Exception as e:
+      logging.debug(f"reduced thumb failed, falling back to full decode: {path}, {e}")
   return makeThumb_opencv(path, thumbpath, overwrite)
 
 
@@ -89,6 +115,119 @@ def makeThumb_opencv(path, thumbpath, overwrite):
           logging.error("Error making thumb could be that image is multi-doc-tiff?")
           raise
 
+def reduced_scale(width, height, min_size):
+  """
+  Largest IMREAD_REDUCED_* scale (8, 4, 2) that still keeps the image at least min_size, or 1
+  """
+  for scale in (8, 4, 2):
+    if min(width, height) // scale >= min_size:
+      return scale
+  return 1
+
+def read_tiff_subresolution(path, min_size):
+  """
+  Returns the smallest embedded reduced-resolution page of a (pyramid) TIFF that is
+  still at least min_size, as a numpy array, or None if there is no such page
+  """
+  with Image.open(path) as im:
+    if getattr(im, "n_frames", 1) < 2:
+      return None
+
+    best_page = None
+    best_size = None
+    for page in range(im.n_frames):
+      im.seek(page)
+      if not im.tag_v2.get(TIFF_TAG_NEW_SUBFILE_TYPE, 0) & 1:
+        continue
+      if min(im.size) < min_size:
+        continue
+      if best_size is None or min(im.size) < best_size:
+        best_page = page
+        best_size = min(im.size)
+
+    if best_page is None:
+      return None
+
+    im.seek(best_page)
+    img = np.array(im)
+
+  if img.ndim == 3:
+    img = cv2.cvtColor(img, cv2.COLOR_RGB2BGR)
+  return img
+
+def makeThumb_opencv_reduced(path, thumbpath, overwrite):
+  """
+  Same as makeThumb_opencv but without decoding the full image: uses the embedded
+  reduced-resolution page of a TIFF, or reads a JPEG with cv2.IMREAD_REDUCED_*, and
+  normalizes the reduced image instead of the full one.
+  Returns False, without reading the image, if it has no reduced read (other formats,
+  TIFFs without reduced pages), True if the thumb was made or already exists.
+  """
+
+  # replace old ext with png
+  thumbpath_with_ext = os.path.splitext(thumbpath)[0]+'.png'
+
+  if not overwrite and os.path.isfile(thumbpath_with_ext):
+    return True
+
+  maxsize = THUMB_SIZE
+  normalize = "nikon" in path
+  path_lower = path.lower()
+
+  if path_lower.endswith(TIFF_EXTENSIONS):
+    directory = os.path.dirname(path)
+    if _tiff_pages_by_dir.get(directory) is False:
+      return False
+    img = read_tiff_subresolution(path, min(maxsize))
+    if len(_tiff_pages_by_dir) >= TIFF_PAGES_CACHE_SIZE:
+      _tiff_pages_by_dir.clear()
+    _tiff_pages_by_dir[directory] = img is not None
+    if img is None:
+      return False
+    if not normalize:
+      # same 8-bit BGR as cv2.imread(path) in makeThumb_opencv
+      if img.dtype != np.uint8:
+        img = (img // 256).astype(np.uint8)
+      if img.ndim == 2:
+        img = cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+  elif path_lower.endswith(JPEG_EXTENSIONS):
+    # only reads the header to get the size
+    with Image.open(path) as im:
+      width, height = im.size
+    scale = reduced_scale(width, height, min(maxsize))
+
+    if normalize:
+      flags = {1: cv2.IMREAD_GRAYSCALE,
+               2: cv2.IMREAD_REDUCED_GRAYSCALE_2,
+               4: cv2.IMREAD_REDUCED_GRAYSCALE_4,
+               8: cv2.IMREAD_REDUCED_GRAYSCALE_8}[scale] | cv2.IMREAD_ANYDEPTH
+    else:
+      flags = {1: cv2.IMREAD_COLOR,
+               2: cv2.IMREAD_REDUCED_COLOR_2,
+               4: cv2.IMREAD_REDUCED_COLOR_4,
+               8: cv2.IMREAD_REDUCED_COLOR_8}[scale]
+    img = cv2.imread(path, flags)
+
+  else:
+    return False
+
+  if img is None:
+    raise Exception(f"Could not read image: {path}")
+
+  imRes = cv2.resize(img, maxsize, interpolation = cv2.INTER_AREA)
+  if normalize:
+    imRes = cv2.normalize(imRes, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+
+  # create dir if needed
+  directory = os.path.dirname(thumbpath_with_ext)
+  if not os.path.exists(directory):
+    os.makedirs(directory)
+
+  # save thumb
+  cv2.imwrite(thumbpath_with_ext, imRes)
+  return True
+
 def tif2png_recursive(in_path, out_path):
   exts = ['.tif', '.tiff']
   files = [p for p in Path(in_path).rglob('*') if p.suffix in exts]
@@ -0,0 +1,117 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+
+class IngestJournal:
+    """
+    Persistent per-folder ingest watermarks, kept in a small SQLite file
+    (default under ERROR_LOG_DIR) so they survive restarts of image_monitor.
+
+    For every imported folder it records:
+      - file_count      number of image files when the folder was last listed
+      - max_mtime       mtime of the folder itself at that listing (changes when files are added/removed)
+      - last_processed  last time new images were found and imported from the folder
+      - checked_at      time of the last successful import run of the folder
+
+    A folder whose mtime is the same as at the last successful import can be skipped
+    without listing it or querying the database, and last_processed replaces the
+    in-memory processed dict as the "last activity" time of an acquisition.
+    """
+
+    # mtime resolution on some (network) file systems is 1-2 s, a folder is only
+    # treated as unchanged if it had not been modified for this long when it was listed
+    MTIME_SLACK = 2.0
+
+    def __init__(self, path: str):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS folders (
+                folder          TEXT PRIMARY KEY,
+                file_count      INTEGER NOT NULL,
+                max_mtime       REAL NOT NULL,
+                last_processed  REAL,
+                checked_at      REAL NOT NULL
+            )""")
+        self._conn.commit()
+
+    @staticmethod
+    def _norm(folder: str) -> str:
+        return os.path.normpath(str(folder))
+
+    def is_unchanged(self, folder: str, dir_mtime: float) -> bool:
+        """
+        True if the folder has not been modified since its last successful import.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT max_mtime, checked_at FROM folders WHERE folder = ?",
+                (self._norm(folder),)
+            ).fetchone()
+        if row is None:
+            return False
+        max_mtime, checked_at = row
+        return max_mtime == dir_mtime and checked_at - max_mtime > self.MTIME_SLACK
+
+    def record(self, folder: str, file_count: int, dir_mtime: float, checked_at: float,
+               new_images: bool) -> None:
+        """
+        Records a successful import of the folder. dir_mtime must be stat'ed
+        before the folder was listed, so files added during the import are
+        picked up by the next poll.
+        """
+        last_processed = checked_at if new_images else None
+        with self._lock:
+            self._conn.execute("""
+                INSERT INTO folders (folder, file_count, max_mtime, last_processed, checked_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (folder) DO UPDATE SET
+                    file_count = excluded.file_count,
+                    max_mtime = excluded.max_mtime,
+                    last_processed = COALESCE(excluded.last_processed, folders.last_processed),
+                    checked_at = excluded.checked_at
+                """, (self._norm(folder), file_count, dir_mtime, last_processed, checked_at))
+            self._conn.commit()
+
+    def last_activity(self, folder: str) -> Optional[float]:
+        """
+        Latest last_processed of the folder and its sub folders (e.g. single_images),
+        None if nothing has been imported from it.
+        """
+        norm = self._norm(folder).rstrip('/')
+        # sub folders are the keys from norm + '/' up to (not including) norm + '0', the
+        # character after '/', a range the primary key index answers without a table scan
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(last_processed) FROM folders WHERE folder = ? OR (folder >= ? AND folder < ?)",
+                (norm, norm + '/', norm + '0')
+            ).fetchone()
+        return row[0] if row else None
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def open_journal(path: str) -> Optional[IngestJournal]:
+    """
+    Opens the journal, or returns None (and logs) if it can not be opened,
+    the monitor then works as without a journal.
+    """
+    try:
+        t_open = time.perf_counter()
+        journal = IngestJournal(path)
+        logging.info(f"ingest journal: {path} (opened in {time.perf_counter() - t_open:.3f}s)")
+        return journal
+    except Exception:
+        logging.exception("Could not open ingest journal: " + str(path))
+        return None
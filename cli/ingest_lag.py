@@ -0,0 +1,102 @@
+import math
+import threading
+import time
+from array import array
+from typing import Callable, Dict, Iterable, Optional
+
+
+def percentile(sorted_values, fraction: float) -> float:
+    """
+    Nearest-rank percentile of an already sorted sequence
+    """
+    index = max(0, min(len(sorted_values) - 1, int(math.ceil(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class IngestLag:
+    """
+    Lag from a file's mtime (when the microscope wrote it) until its row in images
+    is committed and the image is browsable, collected per acquisition folder.
+
+    file_seen() is called with the mtime from the folder scan, committed() after
+    the insert commit, and pop_summary() when the acquisition is marked finished.
+    Lags are kept as 4-byte floats, so a 100k image acquisition uses ~400 kB until
+    it is finished. Only images imported by this process are counted. Folders that
+    another process finishes, or that are never finished, are forgotten with
+    drop_folders and drop_idle.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._mtimes: Dict[str, float] = {}
+        self._lags: Dict[str, array] = {}
+        # folder -> time of its latest commit, for drop_idle
+        self._last_commit: Dict[str, float] = {}
+
+    def file_seen(self, path: str, mtime: float) -> None:
+        with self._lock:
+            self._mtimes[path] = mtime
+
+    def committed(self, folder: str, paths: Iterable[str], commit_time: Optional[float] = None) -> None:
+        if commit_time is None:
+            commit_time = time.time()
+        with self._lock:
+            lags = None
+            for path in paths:
+                mtime = self._mtimes.pop(path, None)
+                if mtime is None:
+                    continue
+                if lags is None:
+                    lags = self._lags.setdefault(folder, array('f'))
+                    self._last_commit[folder] = commit_time
+                lags.append(max(commit_time - mtime, 0.0))
+
+    def discard(self, paths: Iterable[str]) -> None:
+        """
+        Forgets mtimes of files that were not inserted (thumbnails, conflicts, failures)
+        """
+        with self._lock:
+            for path in paths:
+                self._mtimes.pop(path, None)
+
+    def summary(self, folder: str) -> Optional[dict]:
+        with self._lock:
+            lags = self._lags.get(folder)
+            if not lags:
+                return None
+            sorted_lags = sorted(lags)
+        return {
+            'images': len(sorted_lags),
+            'lag_p50': percentile(sorted_lags, 0.50),
+            'lag_p95': percentile(sorted_lags, 0.95),
+            'lag_max': sorted_lags[-1],
+        }
+
+    def pop_summary(self, folder: str) -> Optional[dict]:
+        result = self.summary(folder)
+        with self._lock:
+            self._lags.pop(folder, None)
+            self._last_commit.pop(folder, None)
+        return result
+
+    def drop_folders(self, is_done: Callable[[str], bool]) -> int:
+        """
+        Forgets the lags of the folders is_done(folder) is True for (e.g. finished by
+        another process), returns how many folders were dropped
+        """
+        with self._lock:
+            done = [folder for folder in self._lags if is_done(folder)]
+            for folder in done:
+                del self._lags[folder]
+                self._last_commit.pop(folder, None)
+            return len(done)
+
+    def drop_idle(self, cutoff: float) -> int:
+        """
+        Forgets the lags of the folders without commits since cutoff, returns how many folders were dropped
+        """
+        return self.drop_folders(lambda folder: self._last_commit.get(folder, 0.0) < cutoff)
+
+
+# process wide lag tracking
+ingest_lag = IngestLag()
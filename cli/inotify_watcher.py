@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+from typing import Dict, List, NamedTuple
+
+#
+# Minimal Linux inotify binding (ctypes, no extra dependencies)
+#
+# Events are only delivered for changes made through the local kernel, so this
+# works on local disks, bind mounts and tmpfs but not for files written to NFS
+# by other hosts - image_monitor keeps polling as a safety net.
+#
+# python3 inotify_watcher.py /dev/shm/test-tree   (prints events, for testing)
+#
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+# files written in place (close_write), moved in (moved_to) and new sub dirs (create + isdir)
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyEvent(NamedTuple):
+    path: str
+    mask: int
+
+    @property
+    def is_dir(self) -> bool:
+        return bool(self.mask & IN_ISDIR)
+
+    @property
+    def is_overflow(self) -> bool:
+        return bool(self.mask & IN_Q_OVERFLOW)
+
+
+class InotifyWatcher:
+    """
+    Watches a set of directories (not recursive, every dir needs its own watch)
+    and returns their events as InotifyEvent with the full path.
+    """
+
+    def __init__(self, max_watches: int = 8192):
+        self.max_watches = max_watches
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self._fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, "inotify_init1: " + os.strerror(err))
+        self._paths: Dict[int, str] = {}
+        self._wds: Dict[str, int] = {}
+
+    def add_watch(self, path: str) -> bool:
+        """
+        Returns False if the dir could not be watched (gone, too many watches)
+        """
+        path = os.path.normpath(path)
+        if path in self._wds:
+            return True
+        if len(self._wds) >= self.max_watches:
+            logging.warning(f"inotify: max_watches {self.max_watches} reached, not watching {path}")
+            return False
+
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                logging.warning(f"inotify: out of watches (fs.inotify.max_user_watches), not watching {path}")
+            elif err not in (errno.ENOENT, errno.ENOTDIR):
+                logging.warning(f"inotify: could not watch {path}: {os.strerror(err)}")
+            return False
+
+        self._paths[wd] = path
+        self._wds[path] = wd
+        return True
+
+    def is_watched(self, path: str) -> bool:
+        return os.path.normpath(path) in self._wds
+
+    def watch_count(self) -> int:
+        return len(self._wds)
+
+    def read_events(self, timeout: float) -> List[InotifyEvent]:
+        """
+        Waits at most timeout seconds for events, returns all that are available.
+        """
+        readable, _, _ = select.select([self._fd], [], [], timeout)
+        if not readable:
+            return []
+
+        try:
+            data = os.read(self._fd, 256 * 1024)
+        except BlockingIOError:
+            return []
+
+        events = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            wd, mask, _cookie, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            offset += _EVENT_HEADER.size
+            name = data[offset:offset + name_len].rstrip(b'\0')
+            offset += name_len
+
+            if mask & IN_Q_OVERFLOW:
+                events.append(InotifyEvent('', mask))
+                continue
+
+            dir_path = self._paths.get(wd)
+            if dir_path is None:
+                continue
+
+            if mask & IN_IGNORED:
+                # watch removed (dir deleted or unmounted)
+                del self._paths[wd]
+                self._wds.pop(dir_path, None)
+                continue
+
+            path = os.path.join(dir_path, os.fsdecode(name)) if name else dir_path
+            events.append(InotifyEvent(path, mask))
+        return events
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    watcher = InotifyWatcher()
+    for root_dir in sys.argv[1:]:
+        for dirpath, _, _ in os.walk(root_dir):
+            watcher.add_watch(dirpath)
+    print(f"watching {watcher.watch_count()} dirs, ctrl-c to stop")
+    while True:
+        for event in watcher.read_events(1.0):
+            if event.is_dir and event.mask & (IN_CREATE | IN_MOVED_TO):
+                watcher.add_watch(event.path)
+            print(f"{event.mask:#010x} {'dir ' if event.is_dir else 'file'} {event.path}")
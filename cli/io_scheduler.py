@@ -0,0 +1,271 @@
+import logging
+import os
+import threading
+import time
+from typing import Callable, Dict, Optional, Set, Tuple
+
+from discovery import mount_of, read_mount_points
+
+#
+# Per-mount I/O rate limits with two priority lanes, shared by the import in
+# image_monitor, rebuild_thumbs and backfill.
+#
+# Every mount has a token bucket for files/s and one for bytes/s. Work for live
+# acquisitions (LIVE lane) always goes ahead of historical folders (BULK lane):
+# a BULK request waits as long as a LIVE request is waiting for the same mount.
+# The rate limits are per process, separate processes (e.g. a backfill next to
+# image_monitor) each need their own share of the mount's bandwidth.
+#
+# The LIVE lane can also be shared between processes and hosts (share_live_lane,
+# in image_monitor from the database table io_live_lane when IO_SHARED_LIVE_LANE
+# is on): a process reading a mount in the LIVE lane marks it live for a few
+# seconds, renewed while it keeps reading, and BULK requests of every process
+# wait while the mount is marked.
+#
+
+LIVE = 0
+BULK = 1
+LANE_NAMES = {LIVE: 'live', BULK: 'bulk'}
+
+
+def parse_limits(limits: str) -> Dict[str, float]:
+    """
+    "/share/mikro=200,/share/mikro2=5e6" -> {'/share/mikro': 200.0, '/share/mikro2': 5000000.0}
+    """
+    result = {}
+    for item in (limits or '').split(','):
+        if item.strip():
+            path, rate = item.rsplit('=', 1)
+            result[os.path.normpath(path.strip())] = float(rate)
+    return result
+
+
+class TokenBucket:
+    """
+    rate tokens per second, at most burst saved up. A request is let through when the
+    bucket is not in debt and may take it below zero, so requests larger than the
+    burst (a big file) pass and are paid back by the following ones waiting.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else rate
+        self.tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, now: float) -> float:
+        self._refill(now)
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def take(self, amount: float, now: float) -> None:
+        self._refill(now)
+        self.tokens -= amount
+
+
+class IOScheduler:
+    """
+    Token buckets (files/s, bytes/s) per mount and the LIVE/BULK lanes, see the module comment.
+    Limits are keyed by path prefix (longest match), other paths are grouped by their
+    mount point and get the default limits. Without any limits acquire() returns at once.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._mark_live: Optional[Callable[[str, float], None]] = None
+        self._select_live: Optional[Callable[[], Set[str]]] = None
+        self.configure({}, {})
+
+    def configure(self, files_per_sec: Dict[str, float], bytes_per_sec: Dict[str, float],
+                  default_files_per_sec: float = 0, default_bytes_per_sec: float = 0) -> None:
+        with self._cond:
+            self._files_per_sec = files_per_sec
+            self._bytes_per_sec = bytes_per_sec
+            self._default_files_per_sec = default_files_per_sec
+            self._default_bytes_per_sec = default_bytes_per_sec
+            self._prefixes = sorted(set(files_per_sec) | set(bytes_per_sec), key=len, reverse=True)
+            self._limited = bool(self._prefixes or default_files_per_sec or default_bytes_per_sec)
+            self._buckets: Dict[str, Tuple[Optional[TokenBucket], Optional[TokenBucket]]] = {}
+            self._live_waiting: Dict[str, int] = {}
+            self.wait_seconds = {LIVE: 0.0, BULK: 0.0}
+            self._update_enabled()
+        if self._limited:
+            logging.info(f"io scheduler: files/s {files_per_sec} (default {default_files_per_sec}), "
+                         f"bytes/s {bytes_per_sec} (default {default_bytes_per_sec})")
+
+    def share_live_lane(self, mark_live: Optional[Callable[[str, float], None]],
+                        select_live: Optional[Callable[[], Set[str]]],
+                        hold_seconds: float = 10, refresh_seconds: float = 2) -> None:
+        """
+        Shares the LIVE lane with other processes: mark_live(mount, seconds) records that this
+        process reads mount in the LIVE lane for the next seconds, select_live() returns the
+        mounts some process has marked. None for both stops sharing.
+        """
+        with self._cond:
+            self._mark_live = mark_live
+            self._select_live = select_live
+            self._hold_seconds = hold_seconds
+            self._refresh_seconds = refresh_seconds
+            self._marked_at: Dict[str, float] = {}
+            self._shared_live: Set[str] = set()
+            self._shared_live_at = float('-inf')
+            self._update_enabled()
+            self._cond.notify_all()
+
+    def _update_enabled(self) -> None:
+        self.enabled = self._limited or self._select_live is not None
+        self._mount_points = read_mount_points() if self.enabled else []
+
+    def _shared_live_mounts(self) -> Set[str]:
+        # the mounts from the last read of the table, see _refresh_shared_live
+        if self._select_live is None:
+            return set()
+        return self._shared_live
+
+    def _refresh_shared_live(self) -> None:
+        # the table is read at most every refresh_seconds, by the first waiting BULK request,
+        # outside the lock (like _mark_live_lane) so that the other mounts and lanes don't wait for it
+        now = time.monotonic()
+        with self._cond:
+            select_live = self._select_live
+            if select_live is None or now - self._shared_live_at < self._refresh_seconds:
+                return
+            self._shared_live_at = now
+        try:
+            shared_live = set(select_live())
+        except Exception:
+            logging.warning("io scheduler: could not read the shared live lane", exc_info=True)
+            shared_live = set()
+        with self._cond:
+            if self._select_live is select_live:
+                self._shared_live = shared_live
+            self._cond.notify_all()
+
+    def _mark_live_lane(self, mount: str) -> None:
+        # renewed when a third of the hold time is left, outside the lock since it writes to the database
+        now = time.monotonic()
+        with self._cond:
+            mark_live = self._mark_live
+            if mark_live is None or now - self._marked_at.get(mount, float('-inf')) < self._hold_seconds / 3:
+                return
+            self._marked_at[mount] = now
+            hold_seconds = self._hold_seconds
+        try:
+            mark_live(mount, hold_seconds)
+        except Exception:
+            logging.warning(f"io scheduler: could not mark the live lane of {mount}", exc_info=True)
+
+    def mount(self, path: str) -> str:
+        for prefix in self._prefixes:
+            if path == prefix or path.startswith(prefix.rstrip('/') + '/'):
+                return prefix
+        return mount_of(path, self._mount_points)
+
+    def _mount_buckets(self, mount: str) -> Tuple[Optional[TokenBucket], Optional[TokenBucket]]:
+        buckets = self._buckets.get(mount)
+        if buckets is None:
+            files_rate = self._files_per_sec.get(mount, self._default_files_per_sec)
+            bytes_rate = self._bytes_per_sec.get(mount, self._default_bytes_per_sec)
+            buckets = (TokenBucket(files_rate) if files_rate > 0 else None,
+                       TokenBucket(bytes_rate) if bytes_rate > 0 else None)
+            self._buckets[mount] = buckets
+        return buckets
+
+    def is_limited(self, path: str) -> bool:
+        if not self.enabled:
+            return False
+        with self._cond:
+            return any(bucket is not None for bucket in self._mount_buckets(self.mount(path)))
+
+    def limits_bytes(self, path: str) -> bool:
+        if not self.enabled:
+            return False
+        with self._cond:
+            return self._mount_buckets(self.mount(path))[1] is not None
+
+    def _wait_time(self, mount: str, lane: int, now: float) -> float:
+        wait = max((bucket.wait_time(now) for bucket in self._mount_buckets(mount) if bucket is not None), default=0.0)
+        if lane == BULK and self._live_waiting.get(mount):
+            # until the live requests are through, they notify when they are
+            wait = max(wait, 1.0)
+        if lane == BULK and mount in self._shared_live_mounts():
+            # until no process reads the mount in the LIVE lane any more
+            wait = max(wait, self._refresh_seconds)
+        return wait
+
+    def _take(self, mount: str, files: int, nbytes: int, now: float) -> None:
+        files_bucket, bytes_bucket = self._mount_buckets(mount)
+        if files_bucket is not None and files:
+            files_bucket.take(files, now)
+        if bytes_bucket is not None and nbytes:
+            bytes_bucket.take(nbytes, now)
+
+    def wait_time(self, path: str, lane: int = BULK) -> float:
+        """
+        Seconds until a request for path in lane would be let through (for dispatchers that can't block)
+        """
+        if not self.enabled:
+            return 0.0
+        if lane == BULK:
+            self._refresh_shared_live()
+        with self._cond:
+            return self._wait_time(self.mount(path), lane, time.monotonic())
+
+    def charge(self, path: str, files: int = 0, nbytes: int = 0) -> None:
+        """
+        Takes files and bytes from the buckets of path's mount without waiting (for I/O already done)
+        """
+        if not self.enabled:
+            return
+        with self._cond:
+            self._take(self.mount(path), files, nbytes, time.monotonic())
+
+    def acquire(self, path: str, lane: int = LIVE, files: int = 0, nbytes: int = 0) -> float:
+        """
+        Waits until files and nbytes may be read from path's mount in lane, returns the seconds waited
+        """
+        if not self.enabled:
+            return 0.0
+        mount = self.mount(path)
+        start = time.monotonic()
+        if lane == LIVE:
+            self._mark_live_lane(mount)
+            with self._cond:
+                self._live_waiting[mount] = self._live_waiting.get(mount, 0) + 1
+        try:
+            while True:
+                if lane == BULK:
+                    self._refresh_shared_live()
+                with self._cond:
+                    wait = self._wait_time(mount, lane, time.monotonic())
+                    if wait <= 0:
+                        now = time.monotonic()
+                        self._take(mount, files, nbytes, now)
+                        waited = now - start
+                        self.wait_seconds[lane] += waited
+                        return waited
+                    self._cond.wait(timeout=wait)
+        finally:
+            if lane == LIVE:
+                with self._cond:
+                    self._live_waiting[mount] -= 1
+                    self._cond.notify_all()
+
+    def acquire_read(self, path: str, lane: int = LIVE, files: int = 1) -> float:
+        """
+        acquire() for reading the file at path, its size is only stat'ed if the mount has a bytes/s limit
+        """
+        nbytes = 0
+        if self.limits_bytes(path):
+            try:
+                nbytes = os.path.getsize(path)
+            except OSError:
+                pass
+        return self.acquire(path, lane, files, nbytes)
+
+
+# process wide scheduler, configured from the IO_* settings (see image_monitor.configure_io_scheduler)
+io_scheduler = IOScheduler()
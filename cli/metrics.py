@@ -0,0 +1,126 @@
+import logging
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional
+
+#
+# Prometheus text-format metrics for image_monitor, without extra dependencies.
+# Exposed on http://<host>:METRICS_PORT/metrics and/or written to METRICS_TEXTFILE
+# (for the node_exporter textfile collector) after every poll.
+#
+
+
+class Metrics:
+    """
+    Counters and gauges, thread safe. A gauge can have a function that is
+    called when the metrics are rendered, for values owned by someone else.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._types: Dict[str, str] = {}
+        self._help: Dict[str, str] = {}
+        self._values: Dict[str, float] = {}
+        self._gauge_funcs: Dict[str, Callable[[], float]] = {}
+
+    def counter(self, name: str, help_text: str) -> None:
+        with self._lock:
+            self._types[name] = 'counter'
+            self._help[name] = help_text
+            self._values.setdefault(name, 0)
+
+    def gauge(self, name: str, help_text: str, func: Optional[Callable[[], float]] = None) -> None:
+        with self._lock:
+            self._types[name] = 'gauge'
+            self._help[name] = help_text
+            self._values.setdefault(name, 0)
+            if func is not None:
+                self._gauge_funcs[name] = func
+
+    def inc(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self._values[name] = self._values.get(name, 0) + value
+
+    def set(self, name: str, value: float) -> None:
+        with self._lock:
+            self._values[name] = value
+
+    def get(self, name: str) -> float:
+        with self._lock:
+            return self._values.get(name, 0)
+
+    def render(self) -> str:
+        with self._lock:
+            names = list(self._types)
+            values = dict(self._values)
+            gauge_funcs = dict(self._gauge_funcs)
+
+        lines = []
+        for name in names:
+            value = values.get(name, 0)
+            if name in gauge_funcs:
+                try:
+                    value = gauge_funcs[name]()
+                except Exception:
+                    logging.exception("Could not get metric: " + name)
+                    continue
+            lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} {self._types[name]}")
+            lines.append(f"{name} {float(value)!r}")
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, path: str) -> None:
+        """
+        Writes the metrics atomically (textfile collector reads must not see half a file)
+        """
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                f.write(self.render())
+            os.replace(tmp_path, path)
+        except Exception:
+            logging.exception("Could not write metrics textfile: " + str(path))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = metrics.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # don't log every scrape
+        pass
+
+
+def start_http_server(port: int, addr: str = '') -> ThreadingHTTPServer:
+    """
+    Serves /metrics from a daemon thread
+    """
+    server = ThreadingHTTPServer((addr, port), _MetricsHandler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True)
+    thread.start()
+    logging.info(f"metrics: serving http://{addr or '0.0.0.0'}:{server.server_address[1]}/metrics")
+    return server
+
+
+# process wide metrics
+metrics = Metrics()
+metrics.counter('imagedb_images_imported_total', 'Images inserted into the images table')
+metrics.counter('imagedb_images_failed_total', 'Images that failed to import (each attempt)')
+metrics.counter('imagedb_thumbnails_made_total', 'Thumbnails made')
+metrics.counter('imagedb_thumbnails_failed_total', 'Thumbnails given up on after retries')
+metrics.counter('imagedb_thumbnail_pool_restarts_total', 'Thumbnail process pools replaced after a worker died')
+metrics.counter('imagedb_polls_total', 'Completed polls')
+metrics.gauge('imagedb_images_per_second', 'Images imported per second during the last poll')
+metrics.gauge('imagedb_last_poll_duration_seconds', 'Duration of the last poll')
+metrics.gauge('imagedb_last_successful_poll_timestamp_seconds', 'Unix time when the last poll completed')
@@ -0,0 +1,53 @@
+import os
+from typing import Any, Dict, Iterable, Optional
+
+
+class PathTrie:
+    """
+    Path-component trie answering "is this dir, or any of its ancestors, in the trie"
+    in O(path depth), independent of the number of paths in it.
+
+    Every path can carry a label (e.g. 'finished' or 'blacklisted'), find() returns
+    the label of the closest match. `path in trie` is True for the path itself and
+    everything below it.
+    """
+
+    # key for the label in a node, can not be a path component
+    _LABEL = '\0'
+
+    def __init__(self, paths: Iterable[str] = (), label: Any = True):
+        self._root: Dict[str, Any] = {}
+        self._len = 0
+        for path in paths:
+            self.add(path, label)
+
+    @staticmethod
+    def _components(path: str):
+        return [part for part in os.path.normpath(str(path)).split('/') if part]
+
+    def add(self, path: str, label: Any = True) -> None:
+        node = self._root
+        for part in self._components(path):
+            node = node.setdefault(part, {})
+        if self._LABEL not in node:
+            self._len += 1
+        node[self._LABEL] = label
+
+    def find(self, path: str) -> Optional[Any]:
+        """
+        Label of the path or its closest ancestor in the trie, None if there is none.
+        """
+        node = self._root
+        found = node.get(self._LABEL)
+        for part in self._components(path):
+            node = node.get(part)
+            if node is None:
+                break
+            found = node.get(self._LABEL, found)
+        return found
+
+    def __contains__(self, path: str) -> bool:
+        return self.find(path) is not None
+
+    def __len__(self) -> int:
+        return self._len
@@ -0,0 +1,162 @@
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from itertools import accumulate, chain
+from typing import Callable, Dict, Optional
+
+#
+# Compact set of the image paths image_monitor has processed, replacing a
+# Dict[str, float] with one full path string and one float per image
+#
+# Paths are kept per folder: the folder string once (interned), the basenames
+# sorted by their 64-bit hash in an array, with the names themselves packed in
+# one bytes string (8 + 4 bytes + the name per image), and one timestamp for the
+# folder. See processed_paths_benchmark.py for the memory use against the dict.
+# The latest timestamp of every folder and its parents is kept in an index, so
+# the last activity of an acquisition is one dict lookup.
+#
+
+
+class _Folder:
+    __slots__ = ('hashes', 'offsets', 'names', 'recent', 'last')
+
+    def __init__(self):
+        # sorted basename hashes, basename i is names[offsets[i]:offsets[i + 1]] (utf-8),
+        # and the basenames added since the last merge into them
+        self.hashes = array('q')
+        self.offsets = array('I', [0])
+        self.names = b''
+        self.recent = set()
+        self.last = 0.0
+
+    def _encoded(self, index: int) -> bytes:
+        return self.names[self.offsets[index]:self.offsets[index + 1]]
+
+    def contains(self, name: str, name_hash: int) -> bool:
+        if name in self.recent:
+            return True
+        # a hash hit is only a match if the stored name is the same, colliding names sort next to each other
+        encoded = None
+        index = bisect_left(self.hashes, name_hash)
+        while index < len(self.hashes) and self.hashes[index] == name_hash:
+            if encoded is None:
+                encoded = _encode(name)
+            if self._encoded(index) == encoded:
+                return True
+            index += 1
+        return False
+
+    def merge(self) -> None:
+        offsets = self.offsets
+        names = [self.names[start:end] for start, end in zip(offsets, offsets[1:])]
+        names.extend(_encode(name) for name in self.recent)
+        hashes = list(chain(self.hashes, (hash(name) for name in self.recent)))
+        order = sorted(range(len(hashes)), key=hashes.__getitem__)
+        names = [names[i] for i in order]
+        self.hashes = array('q', [hashes[i] for i in order])
+        self.offsets = array('I', accumulate(map(len, names), initial=0))
+        self.names = b''.join(names)
+        self.recent = set()
+
+
+def _encode(name: str) -> bytes:
+    # surrogateescape keeps the names os.scandir decoded from invalid utf-8 unique
+    return name.encode('utf-8', 'surrogateescape')
+
+
+class ProcessedPaths:
+    """
+    "Already seen" test for image paths and last activity time per folder.
+
+    Basenames are looked up by their (64-bit) hash and a hit is confirmed against
+    the stored name, so a hash collision never reports a path that was not added.
+    """
+
+    # recent names are merged into the sorted array when they are this many, or a
+    # quarter of the array, so that merging stays amortized O(log n) per path
+    MERGE_MIN = 64
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._folders: Dict[str, _Folder] = {}
+        # folder and each of its parents -> latest timestamp at or below it
+        self._activity: Dict[str, float] = {}
+        self._len = 0
+        # time of the latest add, None when empty
+        self.latest: Optional[float] = None
+
+    @staticmethod
+    def _split(path: str):
+        folder, _, name = path.rpartition('/')
+        return folder, name, hash(name)
+
+    def __contains__(self, path: str) -> bool:
+        folder, name, name_hash = self._split(path)
+        with self._lock:
+            entry = self._folders.get(folder)
+            return entry is not None and entry.contains(name, name_hash)
+
+    def add(self, path: str, timestamp: float) -> None:
+        folder, name, name_hash = self._split(path)
+        with self._lock:
+            entry = self._folders.get(folder)
+            if entry is None:
+                entry = self._folders[sys.intern(folder)] = _Folder()
+            if not entry.contains(name, name_hash):
+                entry.recent.add(name)
+                self._len += 1
+                if len(entry.recent) >= max(self.MERGE_MIN, len(entry.hashes) // 4):
+                    entry.merge()
+            if timestamp > entry.last:
+                entry.last = timestamp
+                self._touch(folder, timestamp)
+            if self.latest is None or timestamp > self.latest:
+                self.latest = timestamp
+
+    def _touch(self, folder: str, timestamp: float) -> None:
+        # a parent is never older than its sub folders, so the climb stops at the first one that is not
+        path = folder
+        while path and self._activity.get(path, 0.0) < timestamp:
+            self._activity[path] = timestamp
+            path = path.rpartition('/')[0]
+
+    def last_activity(self, folder: str) -> Optional[float]:
+        """
+        Latest add in folder or below it (e.g. TimePoint_1, single_images), None if there was none
+        """
+        return self._activity.get(folder.rstrip('/'))
+
+    def drop_before(self, cutoff: float, keep: Optional[Callable[[str], bool]] = None) -> int:
+        """
+        Forgets the folders without adds since cutoff (except the ones keep returns True for),
+        returns how many paths were dropped
+        """
+        with self._lock:
+            idle = [path for path, entry in self._folders.items()
+                    if entry.last < cutoff and not (keep is not None and keep(path))]
+            dropped = 0
+            for path in idle:
+                entry = self._folders.pop(path)
+                dropped += len(entry.hashes) + len(entry.recent)
+            self._len -= dropped
+            if idle:
+                self._activity = {}
+                for path, entry in self._folders.items():
+                    self._touch(path, entry.last)
+            if not self._folders:
+                self.latest = None
+            return dropped
+
+    def clear(self) -> None:
+        with self._lock:
+            self._folders.clear()
+            self._activity.clear()
+            self._len = 0
+            self.latest = None
+
+    def folder_count(self) -> int:
+        return len(self._folders)
+
+    def __len__(self) -> int:
+        return self._len
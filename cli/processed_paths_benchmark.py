@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+
+from processed_paths import ProcessedPaths
+
+#
+# Memory benchmark of the processed set of image_monitor: the Dict[str, float]
+# it used before against ProcessedPaths
+#
+# Generates squid-like image paths (acquisition folder + well/site/channel file
+# name), adds them to both and reports the memory they hold (tracemalloc), the
+# time to add them and the time of an "already seen" lookup.
+#
+# python3 processed_paths_benchmark.py --images 2000000 --per-folder 20000
+#
+
+CHANNELS = ['Fluorescence_405_nm_Ex', 'Fluorescence_488_nm_Ex', 'Fluorescence_561_nm_Ex',
+            'Fluorescence_638_nm_Ex', 'Fluorescence_730_nm_Ex']
+
+
+def make_paths(images: int, per_folder: int):
+    paths = []
+    for n in range(images):
+        folder = n // per_folder
+        i = n % per_folder
+        well = f"{'BCDEFGHIJKLMNO'[i // 2000 % 14]}{i // 100 % 20 + 2:02d}"
+        paths.append(f"/share/mikro2/squid/benchmark-project/benchmark-P{folder:05d}_2024-01-01_12.00.{folder % 60:02d}/"
+                     f"{well}_s{i // len(CHANNELS) % 20 + 1}_x0_y0_z{i // 20000}_{CHANNELS[i % len(CHANNELS)]}.tiff")
+    return paths
+
+
+def measure(make, add, paths):
+    """
+    Returns (the filled structure, bytes it holds, seconds to add the paths)
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    structure = make()
+    for path in paths:
+        add(structure, path)
+    seconds = time.perf_counter() - start
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return structure, size, seconds
+
+
+def lookup_us(structure, paths):
+    start = time.perf_counter()
+    for path in paths:
+        if path not in structure:
+            raise AssertionError(f"missing: {path}")
+    return (time.perf_counter() - start) / len(paths) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory of the processed dict against ProcessedPaths')
+    parser.add_argument('--images', type=int, default=1000000, help='Number of image paths')
+    parser.add_argument('--per-folder', type=int, default=10000, help='Images per acquisition folder')
+    args = parser.parse_args()
+
+    # the paths are copied for each structure, so their strings are counted where they are kept
+    paths = make_paths(args.images, args.per_folder)
+    now = time.time()
+    lookups = paths[::max(1, len(paths) // 100000)]
+
+    def add_dict(d, path):
+        d[''.join(path)] = now
+
+    def add_compact(p, path):
+        p.add(''.join(path), now)
+
+    results = []
+    for label, make, add in (('dict', dict, add_dict), ('ProcessedPaths', ProcessedPaths, add_compact)):
+        structure, size, seconds = measure(make, add, paths)
+        results.append((label, size, seconds, lookup_us(structure, lookups)))
+        del structure
+
+    print(f"\n{args.images} paths in {-(-args.images // args.per_folder)} folders")
+    print(f"{'':<16} {'MB':>10} {'bytes/path':>12} {'add s':>8} {'lookup us':>10}")
+    for label, size, seconds, lookup in results:
+        print(f"{label:<16} {size / 1e6:>10.1f} {size / args.images:>12.1f} {seconds:>8.2f} {lookup:>10.2f}")
+    print(f"{'ratio':<16} {results[0][1] / results[1][1]:>10.1f}x")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
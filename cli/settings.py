@@ -25,6 +25,91 @@ with open(conf_file) as json_file:
   CONTINUOUS_POLLING = os.getenv('CONTINUOUS_POLLING', js_conf["CONTINUOUS_POLLING"]).lower() == 'true'
   THREADPOOL_WORKERS = os.getenv('THREADPOOL_WORKERS', js_conf["THREADPOOL_WORKERS"])
 
+  # Worker count of the import (THREADPOOL_WORKERS at start; images in flight, or chunks of BULK_INSERT_CHUNK_SIZE
+  # with BULK_INSERT) is adapted between min and max from the per-image latency and the time spent waiting for
+  # a free DB connection, after every window of images (AIMD)
+  THREADPOOL_ADAPTIVE = str(os.getenv('THREADPOOL_ADAPTIVE', js_conf.get('THREADPOOL_ADAPTIVE', 'true'))).lower() == 'true'
+  THREADPOOL_WORKERS_MIN = int(os.getenv('THREADPOOL_WORKERS_MIN', js_conf.get('THREADPOOL_WORKERS_MIN', 1)))
+  THREADPOOL_WORKERS_MAX = int(os.getenv('THREADPOOL_WORKERS_MAX', js_conf.get('THREADPOOL_WORKERS_MAX', 8)))
+  THREADPOOL_ADAPTIVE_WINDOW = int(os.getenv('THREADPOOL_ADAPTIVE_WINDOW', js_conf.get('THREADPOOL_ADAPTIVE_WINDOW', 50))) # images
+
+  # Insert a folder's images in bulk (one transaction per chunk) instead of one image at a time
+  BULK_INSERT = str(os.getenv('BULK_INSERT', js_conf.get('BULK_INSERT', 'true'))).lower() == 'true'
+  BULK_INSERT_CHUNK_SIZE = int(os.getenv('BULK_INSERT_CHUNK_SIZE', js_conf.get('BULK_INSERT_CHUNK_SIZE', 1000)))
+
+  # Images are streamed into the worker pool with at most this many submitted and not done
+  ADD_PLATE_MAX_IN_FLIGHT = int(os.getenv('ADD_PLATE_MAX_IN_FLIGHT', js_conf.get('ADD_PLATE_MAX_IN_FLIGHT', 100)))
+  # A failing image is retried on following polls, then skipped
+  MAX_IMAGE_ATTEMPTS = int(os.getenv('MAX_IMAGE_ATTEMPTS', js_conf.get('MAX_IMAGE_ATTEMPTS', 3)))
+
+  # Thumbnails are made in a separate process pool, fed by a bounded queue
+  THUMBNAIL_WORKERS = int(os.getenv('THUMBNAIL_WORKERS', js_conf.get('THUMBNAIL_WORKERS', 2)))
+  THUMBNAIL_QUEUE_SIZE = int(os.getenv('THUMBNAIL_QUEUE_SIZE', js_conf.get('THUMBNAIL_QUEUE_SIZE', 1000)))
+  THUMBNAIL_RETRIES = int(os.getenv('THUMBNAIL_RETRIES', js_conf.get('THUMBNAIL_RETRIES', 3)))
+  THUMBNAIL_RETRY_DELAY = float(os.getenv('THUMBNAIL_RETRY_DELAY', js_conf.get('THUMBNAIL_RETRY_DELAY', 10))) # sec
+  THUMBNAIL_FAST = str(os.getenv('THUMBNAIL_FAST', js_conf.get('THUMBNAIL_FAST', 'true'))).lower() == 'true'
+
+  # Image files whose size or mtime changed within this time are still being written, they are deferred to the next poll (0 = off)
+  FILE_STABLE_SECONDS = float(os.getenv('FILE_STABLE_SECONDS', js_conf.get('FILE_STABLE_SECONDS', 10))) # sec
+
+  # Persistent per-folder ingest watermarks (SQLite), empty string disables the journal
+  INGEST_JOURNAL_FILE = os.getenv('INGEST_JOURNAL_FILE', js_conf.get('INGEST_JOURNAL_FILE', os.path.join(ERROR_LOG_DIR, 'ingest_journal.sqlite')))
+
+  # Walk the root dirs concurrently, one thread pool per mount, with a timeout per poll
+  DISCOVERY_PARALLEL = str(os.getenv('DISCOVERY_PARALLEL', js_conf.get('DISCOVERY_PARALLEL', 'true'))).lower() == 'true'
+  DISCOVERY_WORKERS_PER_MOUNT = int(os.getenv('DISCOVERY_WORKERS_PER_MOUNT', js_conf.get('DISCOVERY_WORKERS_PER_MOUNT', 2)))
+  DISCOVERY_TIMEOUT = float(os.getenv('DISCOVERY_TIMEOUT', js_conf.get('DISCOVERY_TIMEOUT', 600))) # sec
+
+  # Finished acquisitions are fetched incrementally (finished set or changed since the previous fetch - overlap),
+  # with a periodic full reload
+  FINISHED_WATERMARK_OVERLAP = float(os.getenv('FINISHED_WATERMARK_OVERLAP', js_conf.get('FINISHED_WATERMARK_OVERLAP', 86400))) # sec
+  FINISHED_FULL_RELOAD_INTERVAL = float(os.getenv('FINISHED_FULL_RELOAD_INTERVAL', js_conf.get('FINISHED_FULL_RELOAD_INTERVAL', 86400))) # sec
+
+  # Watch acquisition folders with inotify between polls (local/bind-mounted storage, not NFS)
+  WATCH = str(os.getenv('WATCH', js_conf.get('WATCH', 'false'))).lower() == 'true'
+  WATCH_DEBOUNCE = float(os.getenv('WATCH_DEBOUNCE', js_conf.get('WATCH_DEBOUNCE', 2))) # sec
+  WATCH_MAX_DIRS = int(os.getenv('WATCH_MAX_DIRS', js_conf.get('WATCH_MAX_DIRS', 8192)))
+
+  # Time the ingest stages and write stage-profile-last-poll.json to ERROR_LOG_DIR after every poll
+  PROFILE_STAGES = str(os.getenv('PROFILE_STAGES', js_conf.get('PROFILE_STAGES', 'false'))).lower() == 'true'
+
+  # Prometheus metrics: http endpoint on this port (0 = off) and/or textfile written after every poll ('' = off)
+  METRICS_PORT = int(os.getenv('METRICS_PORT', js_conf.get('METRICS_PORT', 0)))
+  METRICS_TEXTFILE = os.getenv('METRICS_TEXTFILE', js_conf.get('METRICS_TEXTFILE', ''))
+  # Ingest lags of acquisitions without new images for this long are forgotten, if this process did not finish them
+  INGEST_LAG_IDLE_SECONDS = float(os.getenv('INGEST_LAG_IDLE_SECONDS', js_conf.get('INGEST_LAG_IDLE_SECONDS', 86400))) # sec
+
+  # Share the ingest between several image_monitors through the ingest_queue table:
+  # 'off', 'enqueue' (discovery only), 'worker' (only import queued folders) or 'both'
+  WORK_QUEUE = str(os.getenv('WORK_QUEUE', js_conf.get('WORK_QUEUE', 'off'))).lower()
+  WORK_QUEUE_WORKER_ID = os.getenv('WORK_QUEUE_WORKER_ID', js_conf.get('WORK_QUEUE_WORKER_ID', '')) # '' = hostname:pid
+  WORK_QUEUE_LEASE_SECONDS = float(os.getenv('WORK_QUEUE_LEASE_SECONDS', js_conf.get('WORK_QUEUE_LEASE_SECONDS', 300))) # sec
+  WORK_QUEUE_CLAIM_BATCH = int(os.getenv('WORK_QUEUE_CLAIM_BATCH', js_conf.get('WORK_QUEUE_CLAIM_BATCH', 4)))
+  WORK_QUEUE_MAX_ATTEMPTS = int(os.getenv('WORK_QUEUE_MAX_ATTEMPTS', js_conf.get('WORK_QUEUE_MAX_ATTEMPTS', 3)))
+  WORK_QUEUE_RETRY_DELAY = float(os.getenv('WORK_QUEUE_RETRY_DELAY', js_conf.get('WORK_QUEUE_RETRY_DELAY', 600))) # sec
+  # A 'both' monitor goes back to discovery after importing queued folders for this long
+  WORK_QUEUE_DRAIN_SECONDS = float(os.getenv('WORK_QUEUE_DRAIN_SECONDS', js_conf.get('WORK_QUEUE_DRAIN_SECONDS', 600))) # sec
+
+  # I/O limits per mount for the import, rebuild_thumbs and backfill of a process (0 = unlimited),
+  # e.g. IO_MOUNT_FILES_PER_SEC="/share/mikro=500,/share/mikro2=1000", unlisted mounts get IO_FILES_PER_SEC
+  IO_MOUNT_FILES_PER_SEC = os.getenv('IO_MOUNT_FILES_PER_SEC', js_conf.get('IO_MOUNT_FILES_PER_SEC', ''))
+  IO_MOUNT_BYTES_PER_SEC = os.getenv('IO_MOUNT_BYTES_PER_SEC', js_conf.get('IO_MOUNT_BYTES_PER_SEC', ''))
+  IO_FILES_PER_SEC = float(os.getenv('IO_FILES_PER_SEC', js_conf.get('IO_FILES_PER_SEC', 0)))
+  IO_BYTES_PER_SEC = float(os.getenv('IO_BYTES_PER_SEC', js_conf.get('IO_BYTES_PER_SEC', 0)))
+  # Folders modified within this time, or of unfinished acquisitions, go ahead of older ones (live lane)
+  IO_LIVE_WINDOW = float(os.getenv('IO_LIVE_WINDOW', js_conf.get('IO_LIVE_WINDOW', 86400))) # sec
+  # Share the live lane with other processes and hosts through the io_live_lane table, so that e.g.
+  # backfill holds back reads from a mount while image_monitor reads unfinished acquisitions from it (off by default)
+  IO_SHARED_LIVE_LANE = str(os.getenv('IO_SHARED_LIVE_LANE', js_conf.get('IO_SHARED_LIVE_LANE', 'false'))).lower() == 'true'
+  IO_LIVE_HOLD_SECONDS = float(os.getenv('IO_LIVE_HOLD_SECONDS', js_conf.get('IO_LIVE_HOLD_SECONDS', 10))) # sec
+
+  # backfill.py: parse processes (0 = cpu count), resume checkpoint and images/s per mount,
+  # e.g. BACKFILL_MOUNT_RATES="/share/mikro=200,/share/mikro2=500" (0 or unlisted = BACKFILL_RATE, 0 = unlimited)
+  BACKFILL_WORKERS = int(os.getenv('BACKFILL_WORKERS', js_conf.get('BACKFILL_WORKERS', 0)))
+  BACKFILL_CHECKPOINT_FILE = os.getenv('BACKFILL_CHECKPOINT_FILE', js_conf.get('BACKFILL_CHECKPOINT_FILE', os.path.join(ERROR_LOG_DIR, 'backfill_checkpoint.sqlite')))
+  BACKFILL_MOUNT_RATES = os.getenv('BACKFILL_MOUNT_RATES', js_conf.get('BACKFILL_MOUNT_RATES', ''))
+  BACKFILL_RATE = float(os.getenv('BACKFILL_RATE', js_conf.get('BACKFILL_RATE', 0))) # images/sec
+
   # Liveness probe file for image_monitor; can be overridden via env
   # If missing in JSON, default to /tmp/image_monitor_alive
   LIVENESS_FILE = os.getenv('LIVENESS_FILE', js_conf.get('LIVENESS_FILE', '/tmp/image_monitor_alive'))
@@ -0,0 +1,175 @@
+import json
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterable, Iterator, Optional
+
+# Stages of the ingest pipeline, in pipeline order (the report lists them in this order)
+STAGES = [
+    'discovery',      # walking a root dir for acquisition folders
+    'listing',        # listing the image files of a folder
+    'db_exists',      # query for the paths of a folder that are already in the db
+    'parse',          # filename parsing
+    'acq_lookup',     # select or insert plate acquisition
+    'insert',         # images insert (incl. commit)
+    'upload_insert',  # upload_to_s3 insert
+    'thumbnail',      # thumbnail generation (in the thumbnail process pool)
+]
+
+# histogram bucket upper bounds in ms: 1, 2, 4, ... 65536, and one bucket above
+BUCKET_BOUNDS_MS = [2 ** i for i in range(17)]
+
+
+class _Histogram:
+
+    def __init__(self):
+        self.count = 0
+        self.items = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.buckets = [0] * (len(BUCKET_BOUNDS_MS) + 1)
+
+    def add(self, seconds: float, items: int):
+        self.count += 1
+        self.items += items
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        ms = seconds * 1000
+        index = 0 if ms <= 1 else min(int(math.ceil(math.log2(ms))), len(BUCKET_BOUNDS_MS))
+        self.buckets[index] += 1
+
+    def percentile_ms(self, fraction: float) -> float:
+        """
+        Upper bound of the bucket the percentile falls in
+        """
+        wanted = fraction * self.count
+        seen = 0
+        for bound, bucket_count in zip(BUCKET_BOUNDS_MS, self.buckets):
+            seen += bucket_count
+            if seen >= wanted:
+                return bound
+        return self.max_seconds * 1000
+
+    def to_dict(self) -> dict:
+        buckets = {f'<={bound}': n for bound, n in zip(BUCKET_BOUNDS_MS, self.buckets) if n}
+        if self.buckets[-1]:
+            buckets[f'>{BUCKET_BOUNDS_MS[-1]}'] = self.buckets[-1]
+        return {
+            'count': self.count,
+            'items': self.items,
+            'seconds': round(self.seconds, 6),
+            'items_per_sec': round(self.items / self.seconds, 1) if self.seconds > 0 else None,
+            'max_ms': round(self.max_seconds * 1000, 3),
+            'p50_ms': self.percentile_ms(0.5),
+            'p95_ms': self.percentile_ms(0.95),
+            'buckets_ms': buckets,
+        }
+
+
+class StageProfiler:
+    """
+    Opt-in timing of the ingest stages (see STAGES), per poll and per folder.
+
+    Every timed call goes into a histogram per stage for the poll, and into the
+    totals per folder and stage. write_report() writes both as JSON and starts
+    a new poll. When disabled, stage() and timed_iter() cost next to nothing.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self._poll_start = time.time()
+        self._stages: Dict[str, _Histogram] = {}
+        self._folders: Dict[str, Dict[str, list]] = {}
+
+    def record(self, stage: str, seconds: float, folder: Optional[str] = None, items: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._stages.setdefault(stage, _Histogram()).add(seconds, items)
+            if folder is not None:
+                totals = self._folders.setdefault(str(folder), {}).setdefault(stage, [0, 0.0])
+                totals[0] += items
+                totals[1] += seconds
+
+    @contextmanager
+    def _timed(self, stage: str, folder: Optional[str], items: int):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, folder, items)
+
+    def stage(self, stage: str, folder: Optional[str] = None, items: int = 1):
+        """
+        with profiler.stage('parse', folder, len(paths)): ...
+        """
+        if not self.enabled:
+            return nullcontext()
+        return self._timed(stage, folder, items)
+
+    def timed_iter(self, stage: str, iterable: Iterable, folder: Optional[str] = None) -> Iterator:
+        """
+        Passes on the items of iterable and records the time spent getting them,
+        as one call, when the iteration is done (for streamed listings).
+        """
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        seconds = 0.0
+        items = 0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    seconds += time.perf_counter() - start
+                items += 1
+                yield item
+        finally:
+            self.record(stage, seconds, folder, items)
+
+    def report(self) -> dict:
+        with self._lock:
+            stage_names = [s for s in STAGES if s in self._stages] + sorted(set(self._stages) - set(STAGES))
+            return {
+                'poll_start': self._poll_start,
+                'poll_seconds': round(time.time() - self._poll_start, 3),
+                'stages': {name: self._stages[name].to_dict() for name in stage_names},
+                'folders': {
+                    folder: {stage: {'items': items, 'seconds': round(seconds, 6)}
+                             for stage, (items, seconds) in stages.items()}
+                    for folder, stages in self._folders.items()
+                },
+            }
+
+    def write_report(self, path: str):
+        """
+        Writes the report of the current poll and starts a new one
+        """
+        if not self.enabled:
+            return
+        report = self.report()
+        with self._lock:
+            self._reset()
+        try:
+            with open(path, 'w') as filehandle:
+                json.dump(report, filehandle, indent=1)
+        except Exception:
+            logging.exception("Could not write stage profile: " + str(path))
+
+        summary = ", ".join(f"{name}={stage['seconds']:.2f}s" for name, stage in report['stages'].items())
+        logging.info(f"stage profile: {summary}")
+
+
+# process wide profiler, enabled from image_monitor with the PROFILE_STAGES setting
+profiler = StageProfiler()
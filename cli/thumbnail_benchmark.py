@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+import image_tools
+
+#
+# Benchmark of the full-decode thumbnail path (image_tools.makeThumb_opencv)
+# against the default fast path (image_tools.makeThumb with fast=True), which
+# only decodes a reduced image for JPEGs and TIFFs with reduced-resolution
+# pages and uses the full decode for plain TIFFs.
+#
+# Writes synthetic 8-bit and 16-bit plain TIFFs, pyramid TIFFs (with a
+# reduced-resolution page) and 8-bit JPEGs to a temp dir, makes thumbnails of
+# them with both paths and reports ms/image, speedup and the mean absolute
+# difference between the two thumbnails (0-255 scale).
+# 16-bit images are written below a "nikon" dir so that they take the
+# normalizing code path, the same as real nikon images.
+#
+# python3 thumbnail_benchmark.py --size 2048 --count 20
+#
+
+def make_synthetic_image(size, dtype, rng):
+    """
+    Smooth gradient with some blobs and noise, roughly like a fluorescence image
+    """
+    max_val = np.iinfo(dtype).max
+    y, x = np.mgrid[0:size, 0:size].astype(np.float32) / size
+    img = 0.2 * (x + y)
+    for _ in range(20):
+        cx, cy, r = rng.random(3)
+        img += 0.5 * np.exp(-((x - cx) ** 2 + (y - cy) ** 2) / (0.001 + 0.01 * r))
+    img += 0.05 * rng.random((size, size), dtype=np.float32)
+    img = img / img.max() * max_val * 0.8
+    return img.astype(dtype)
+
+
+def write_pyramid_tiff(path, img, reduction=8):
+    """
+    TIFF with the full image as first page and a reduced-resolution page
+    (NewSubfileType 1) after it
+    """
+    full = Image.fromarray(img)
+    small = full.resize((img.shape[1] // reduction, img.shape[0] // reduction), Image.BOX)
+    small.encoderinfo = {'tiffinfo': {image_tools.TIFF_TAG_NEW_SUBFILE_TYPE: 1}}
+    full.save(path, save_all=True, append_images=[small])
+
+
+def write_images(root, size, count, seed):
+    rng = np.random.default_rng(seed)
+    kinds = (('8-bit tif', np.uint8, 'plain', '.tif', cv2.imwrite),
+             ('16-bit tif', np.uint16, 'nikon', '.tif', cv2.imwrite),
+             ('8-bit pyramid', np.uint8, 'plain_pyramid', '.tif', write_pyramid_tiff),
+             ('16-bit pyramid', np.uint16, 'nikon_pyramid', '.tif', write_pyramid_tiff),
+             ('8-bit jpeg', np.uint8, 'plain_jpeg', '.jpg', cv2.imwrite))
+    paths = {}
+    for label, dtype, subdir, ext, write in kinds:
+        directory = os.path.join(root, 'images', subdir)
+        os.makedirs(directory)
+        paths[label] = []
+        for i in range(count):
+            path = os.path.join(directory, f'img_{i}{ext}')
+            write(path, make_synthetic_image(size, dtype, rng))
+            paths[label].append(path)
+    return paths
+
+
+def make_thumb_fast(path, thumbpath, overwrite):
+    image_tools.makeThumb(path, thumbpath, overwrite, fast=True)
+
+
+def bench(make_thumb, paths, thumb_dir):
+    start = time.perf_counter()
+    for path in paths:
+        make_thumb(path, os.path.join(thumb_dir, os.path.basename(path)), True)
+    return (time.perf_counter() - start) / len(paths) * 1000
+
+
+def mean_abs_diff(paths, full_dir, fast_dir):
+    diffs = []
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0] + '.png'
+        full = cv2.imread(os.path.join(full_dir, name), cv2.IMREAD_UNCHANGED).astype(np.float32)
+        fast = cv2.imread(os.path.join(fast_dir, name), cv2.IMREAD_UNCHANGED).astype(np.float32)
+        diffs.append(np.abs(full - fast).mean())
+    return float(np.mean(diffs))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Thumbnail full vs reduced-resolution decode benchmark')
+    parser.add_argument('--size', type=int, default=2048, help='Width and height of the synthetic images')
+    parser.add_argument('--count', type=int, default=20, help='Number of images per kind')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s,%(msecs)d %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
+                        datefmt='%H:%M:%S',
+                        level=logging.INFO)
+
+    root = tempfile.mkdtemp(prefix='thumbnail_benchmark_')
+    try:
+        logging.info(f"writing {args.count} x 5 synthetic {args.size}x{args.size} images to {root}")
+        paths = write_images(root, args.size, args.count, args.seed)
+
+        print(f"\n{'images':<16} {'full ms':>10} {'fast ms':>10} {'speedup':>10} {'mean diff':>10}")
+        for label, label_paths in paths.items():
+            full_dir = os.path.join(root, 'thumbs_full', label)
+            fast_dir = os.path.join(root, 'thumbs_fast', label)
+            full_ms = bench(image_tools.makeThumb_opencv, label_paths, full_dir)
+            fast_ms = bench(make_thumb_fast, label_paths, fast_dir)
+            diff = mean_abs_diff(label_paths, full_dir, fast_dir)
+            print(f"{label:<16} {full_ms:>10.1f} {fast_ms:>10.1f} {full_ms / fast_ms:>9.2f}x {diff:>10.2f}")
+    finally:
+        shutil.rmtree(root)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
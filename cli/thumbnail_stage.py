@@ -0,0 +1,181 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import image_tools
+from metrics import metrics
+from stage_profiler import profiler
+
+
+def _make_thumb_timed(img_path: str, thumb_path: str, fast: bool) -> float:
+    """
+    Runs in the process pool, returns the time it took (for the stage profiler)
+    """
+    start = time.perf_counter()
+    image_tools.makeThumb(img_path, thumb_path, False, fast)
+    return time.perf_counter() - start
+
+
+def _mp_context():
+    # the pool is made from worker threads of a process holding DB connections and
+    # locks, forking it is unsafe: start workers from a clean forkserver (or spawn)
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+class ThumbnailStage:
+    """
+    Makes thumbnails in a separate process pool, decoupled from the threads doing DB inserts.
+
+    - submit() blocks when max_pending thumbnails are queued or running (bounded queue),
+      so a slow thumbnail stage slows down the import instead of growing memory.
+    - A failed thumbnail (e.g. an image that is not completely written yet) is
+      rescheduled after retry_delay seconds, up to retries times, instead of
+      sleeping in a worker.
+    - Failures are logged and never raised, a single bad image should not stop an import.
+    - fast=True decodes a reduced-resolution image of JPEGs and pyramid TIFFs, other images
+      are decoded in full (see image_tools.makeThumb_opencv_reduced).
+    - A worker that dies (e.g. OOM on a large TIFF) breaks the process pool, it is then
+      replaced and the thumbnails that were in it are submitted again (as a retry).
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 1000, retries: int = 3, retry_delay: float = 10,
+                 fast: bool = True):
+        self.retries = retries
+        self.fast = fast
+        self.retry_delay = retry_delay
+        self.workers = workers
+        self._pool_lock = threading.Lock()
+        self._pool = self._new_pool()
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Condition()
+        self._pending = 0
+        self._closed = False
+
+        # stats since last call to log_stats
+        self._stats_start = time.time()
+        self._made = 0
+        self._retried = 0
+        self._failed = 0
+        self._pool_restarts = 0
+
+    def _new_pool(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(max_workers=self.workers, mp_context=_mp_context())
+
+    def _replace_pool(self, broken: ProcessPoolExecutor) -> None:
+        # every future of a broken pool fails, only the first one to see it replaces the pool
+        with self._pool_lock:
+            if self._pool is not broken or self._closed:
+                return
+            logging.error("thumbnail process pool is broken (a worker died), starting a new one")
+            self._pool = self._new_pool()
+        with self._lock:
+            self._pool_restarts += 1
+        metrics.inc('imagedb_thumbnail_pool_restarts_total')
+        broken.shutdown(wait=False)
+
+    def submit(self, img_path: str, thumb_path: str) -> None:
+        self._slots.acquire()
+        with self._lock:
+            self._pending += 1
+        self._submit(img_path, thumb_path, 0)
+
+    def _submit(self, img_path: str, thumb_path: str, attempt: int) -> None:
+        pool = self._pool
+        try:
+            try:
+                future = pool.submit(_make_thumb_timed, img_path, thumb_path, self.fast)
+            except BrokenProcessPool:
+                self._replace_pool(pool)
+                pool = self._pool
+                future = pool.submit(_make_thumb_timed, img_path, thumb_path, self.fast)
+        except Exception:
+            logging.exception("Could not submit thumb to process pool: " + str(img_path))
+            self._finish(made=False)
+            return
+        future.add_done_callback(lambda fut: self._on_done(fut, pool, img_path, thumb_path, attempt))
+
+    def _on_done(self, future, pool: ProcessPoolExecutor, img_path: str, thumb_path: str, attempt: int) -> None:
+        exception = future.exception()
+        if exception is None:
+            profiler.record('thumbnail', future.result(), os.path.dirname(img_path))
+            self._finish(made=True)
+            return
+
+        if isinstance(exception, BrokenProcessPool):
+            # which image killed the worker is not known, all of them count it as an attempt
+            # and are resubmitted at once to the new pool
+            self._replace_pool(pool)
+            if attempt + 1 < self.retries and not self._closed:
+                with self._lock:
+                    self._retried += 1
+                self._submit(img_path, thumb_path, attempt + 1)
+            else:
+                logging.error("Giving up on thumb after the process pool broke: " + str(img_path))
+                self._finish(made=False)
+            return
+
+        logging.error("Exception making thumb image: %s", exception)
+        logging.error("image: " + str(img_path))
+        logging.error("thumb_path: " + str(thumb_path))
+
+        if attempt + 1 < self.retries and not self._closed:
+            logging.error(f'will retry in {self.retry_delay} seconds, attempt {attempt}')
+            with self._lock:
+                self._retried += 1
+            timer = threading.Timer(self.retry_delay, self._submit, args=(img_path, thumb_path, attempt + 1))
+            timer.daemon = True
+            timer.start()
+        else:
+            logging.error("Giving up on thumb, continuing since we don't want to break on a single bad image")
+            self._finish(made=False)
+
+    def _finish(self, made: bool) -> None:
+        metrics.inc('imagedb_thumbnails_made_total' if made else 'imagedb_thumbnails_failed_total')
+        with self._lock:
+            self._pending -= 1
+            if made:
+                self._made += 1
+            else:
+                self._failed += 1
+            self._lock.notify_all()
+        self._slots.release()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        Waits until all submitted thumbnails (including scheduled retries) are done.
+        Returns False on timeout.
+        """
+        with self._lock:
+            return self._lock.wait_for(lambda: self._pending == 0, timeout)
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._pending
+
+    def log_stats(self) -> None:
+        """
+        Logs thumbnail throughput since the previous call, and resets the counters.
+        """
+        with self._lock:
+            elapsed = max(time.time() - self._stats_start, 1e-6)
+            logging.info(
+                f"thumbnail stage: made={self._made} ({self._made / elapsed:.1f}/s), "
+                f"retried={self._retried}, failed={self._failed}, pending={self._pending}, "
+                f"pool restarts={self._pool_restarts}"
+            )
+            self._stats_start = time.time()
+            self._made = 0
+            self._retried = 0
+            self._failed = 0
+            self._pool_restarts = 0
+
+    def close(self) -> None:
+        # drained first, the pending thumbnails still get their retries
+        self.wait()
+        self._closed = True
+        self._pool.shutdown(wait=True)
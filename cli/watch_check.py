@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import image_monitor
+import settings as imgdb_settings
+from file_stability import file_stability
+from inotify_watcher import IN_CLOSE_WRITE, IN_CREATE, IN_MOVED_TO, InotifyWatcher
+from io_scheduler import LIVE
+from path_trie import PathTrie
+from processed_paths import ProcessedPaths
+
+#
+# Checks the --watch mode of image_monitor against a tmpfs tree (/dev/shm)
+#
+# Makes an acquisition folder, watches it like polling_loop does and then
+# creates files and dirs in it, checking the inotify events and which images
+# wait_for_changes passes on for import (add_plate_to_db is replaced, no
+# database is needed):
+#   - an image written in a watched folder is imported
+#   - an image moved into a watched folder is imported
+#   - a new acquisition dir is watched with its sub dirs, the images already
+#     written in it are imported, one still being written only when it is closed
+#   - all of them in the live lane of the io scheduler
+#
+# CONF_FILE=settings_test.json python3 watch_check.py
+#
+
+
+def write_image(path: str, mtime: float = None) -> None:
+    with open(path, 'wb') as f:
+        f.write(b'\0' * 1024)
+    if mtime is not None:
+        os.utime(path, (mtime, mtime))
+
+
+def events_of(watcher: InotifyWatcher, timeout: float = 1.0):
+    events = []
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        events.extend(watcher.read_events(0.1))
+    return events
+
+
+class WatchCheck:
+
+    def __init__(self, root: str):
+        self.root = root
+        self.failures = []
+        self.imported = []
+        self.lanes = set()
+
+    def expect(self, ok: bool, what: str) -> None:
+        logging.info(f"{'ok    ' if ok else 'FAILED'} {what}")
+        if not ok:
+            self.failures.append(what)
+
+    def add_plate_to_db(self, images, lane=None) -> int:
+        images = list(images)
+        self.lanes.add(lane)
+        self.imported.extend(images)
+        for img in images:
+            image_monitor.processed.add(img, time.time())
+        return 0
+
+    def check_events(self) -> None:
+        folder = os.path.join(self.root, 'events')
+        os.makedirs(folder)
+        watcher = InotifyWatcher()
+        watcher.add_watch(folder)
+
+        write_image(os.path.join(folder, 'A01_s1.tiff'))
+        os.makedirs(os.path.join(folder, 'sub'))
+        write_image(os.path.join(self.root, 'moved.tiff'))
+        os.rename(os.path.join(self.root, 'moved.tiff'), os.path.join(folder, 'moved.tiff'))
+        events = {(os.path.basename(event.path), event.mask & (IN_CLOSE_WRITE | IN_CREATE | IN_MOVED_TO), event.is_dir)
+                  for event in events_of(watcher)}
+        watcher.close()
+
+        self.expect(('A01_s1.tiff', IN_CLOSE_WRITE, False) in events, "close_write event for a written file")
+        self.expect(('sub', IN_CREATE, True) in events, "create event for a new dir")
+        self.expect(('moved.tiff', IN_MOVED_TO, False) in events, "moved_to event for a file moved in")
+
+    def check_imports(self) -> None:
+        project = os.path.join(self.root, 'project')
+        acquisition = os.path.join(project, 'acq-1')
+        os.makedirs(acquisition)
+        image_monitor.watch_dir(acquisition)
+
+        # written in a watched acquisition folder
+        written = os.path.join(acquisition, 'A01_s1.tiff')
+        write_image(written)
+        image_monitor.wait_for_changes(1.0)
+        self.expect(self.imported == [written], "image written in a watched folder is imported")
+
+        # moved in
+        self.imported.clear()
+        moved = os.path.join(acquisition, 'A01_s2.tiff')
+        write_image(os.path.join(self.root, 'A01_s2.tiff'))
+        os.rename(os.path.join(self.root, 'A01_s2.tiff'), moved)
+        image_monitor.wait_for_changes(1.0)
+        self.expect(self.imported == [moved], "image moved into a watched folder is imported")
+
+        # a new acquisition, with images written before its watch is in place: one
+        # complete (written a minute ago) and one that is still open for writing
+        self.imported.clear()
+        new_acquisition = os.path.join(project, 'acq-2')
+        os.makedirs(os.path.join(new_acquisition, 'single_images'))
+        complete = os.path.join(new_acquisition, 'B02_s1.tiff')
+        write_image(complete, time.time() - 60)
+        in_progress = os.path.join(new_acquisition, 'B02_s2.tiff')
+        with open(in_progress, 'wb') as f:
+            f.write(b'\0' * 1024)
+            f.flush()
+            image_monitor.wait_for_changes(1.0)
+            self.expect(image_monitor.watcher.is_watched(new_acquisition)
+                        and image_monitor.watcher.is_watched(os.path.join(new_acquisition, 'single_images')),
+                        "new acquisition dir is watched with its sub dirs")
+            self.expect(self.imported == [complete], "complete image in a new dir is imported")
+            self.expect(in_progress not in self.imported, "image still being written in a new dir is not imported")
+            f.write(b'\0' * 1024)
+
+        self.imported.clear()
+        image_monitor.wait_for_changes(1.0)
+        self.expect(self.imported == [in_progress], "image in a new dir is imported when it is closed")
+
+        # in a sub dir created later
+        self.imported.clear()
+        in_subdir = os.path.join(new_acquisition, 'single_images', 'B02_s3.tiff')
+        write_image(in_subdir)
+        image_monitor.wait_for_changes(1.0)
+        self.expect(self.imported == [in_subdir], "image written in a sub dir of a new dir is imported")
+        self.expect(self.lanes == {LIVE}, "watched images are imported in the live lane")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Checks the inotify watch mode of image_monitor')
+    parser.add_argument('--root', default='/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir(),
+                        help='Dir to make the test tree in (tmpfs)')
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', level=logging.INFO)
+
+    root = tempfile.mkdtemp(prefix='watch-check-', dir=args.root)
+    check = WatchCheck(root)
+    imgdb_settings.WATCH_DEBOUNCE = 0.2
+    file_stability.window = 10
+    image_monitor.processed = ProcessedPaths()
+    image_monitor.skip_trie = PathTrie()
+    image_monitor.watcher = InotifyWatcher()
+    try:
+        with mock.patch.object(image_monitor, 'add_plate_to_db', new=check.add_plate_to_db), \
+                mock.patch.object(image_monitor, '_touch_liveness'):
+            check.check_events()
+            check.check_imports()
+    finally:
+        image_monitor.watcher.close()
+        image_monitor.watcher = None
+        shutil.rmtree(root, ignore_errors=True)
+
+    logging.info("OK" if not check.failures else f"FAILED: {len(check.failures)} checks")
+    return 0 if not check.failures else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from database import Database
+
+#
+# Folder work queue for running several image_monitor workers (e.g. one per pod)
+#
+# Discovery enqueues acquisition folders with their dir mtime into the ingest_queue
+# table, workers claim them with FOR UPDATE SKIP LOCKED and hold a lease while they
+# import. A heartbeat thread renews the leases, a worker that dies loses its
+# folders to the other workers when the lease expires.
+#
+
+
+class FolderWorkQueue:
+    """
+    One worker's view of the ingest_queue table: the folders it has claimed and
+    the heartbeat thread that keeps their leases alive.
+    """
+
+    def __init__(self, worker_id: str, lease_seconds: float = 300, max_attempts: int = 3, retry_delay: float = 600):
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self._lock = threading.Lock()
+        self._held: Dict[str, float] = {}
+        self._stop = threading.Event()
+        self._heartbeat: Optional[threading.Thread] = None
+
+    def enqueue(self, folders: Iterable[Tuple[str, float]]) -> int:
+        """
+        Adds (folder, dir_mtime), returns how many were new or changed
+        """
+        # one row per folder, ON CONFLICT can not update the same row twice in a statement
+        unique = dict(folders)
+        count = Database.get_instance().enqueue_folders(list(unique.items()))
+        logging.info(f"work queue: enqueued {count} new or changed of {len(unique)} folders")
+        return count
+
+    def claim(self, limit: int) -> List[Tuple[str, float]]:
+        """
+        Leases up to limit folders to this worker, returns (folder, dir_mtime) newest first
+        """
+        claimed = Database.get_instance().claim_folders(self.worker_id, limit, self.lease_seconds, self.max_attempts)
+        if claimed:
+            with self._lock:
+                self._held.update(claimed)
+            self._start_heartbeat()
+        return claimed
+
+    def complete(self, folder: str, dir_mtime: float, imported: int = 0, error: Optional[str] = None,
+                 defer_seconds: Optional[float] = None) -> None:
+        """
+        Ends the lease on folder, with defer_seconds the folder is not done (files still
+        being written) and can be claimed again after that many seconds
+        """
+        with self._lock:
+            self._held.pop(folder, None)
+        Database.get_instance().complete_folder(self.worker_id, folder, dir_mtime, imported, error, self.retry_delay,
+                                                defer_seconds)
+
+    def held(self) -> List[str]:
+        with self._lock:
+            return list(self._held)
+
+    def _start_heartbeat(self) -> None:
+        if self._heartbeat is not None and self._heartbeat.is_alive():
+            return
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name='work-queue-heartbeat', daemon=True)
+        self._heartbeat.start()
+
+    def _heartbeat_loop(self) -> None:
+        # renew three times per lease, so one missed renewal does not lose the lease
+        interval = max(self.lease_seconds / 3, 1)
+        while not self._stop.wait(interval):
+            folders = self.held()
+            if not folders:
+                continue
+            try:
+                still_held = Database.get_instance().renew_folder_leases(self.worker_id, folders, self.lease_seconds)
+            except Exception:
+                logging.exception("work queue: could not renew leases")
+                continue
+            lost = set(folders) - still_held
+            for folder in lost:
+                # the import carries on, ON CONFLICT keeps another worker's rows from being duplicated
+                logging.warning(f"work queue: lease on {folder} was lost (expired or taken over)")
+
+    def close(self) -> None:
+        """
+        Stops the heartbeat and gives up the leases on folders that were not completed
+        """
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join(timeout=5)
+            self._heartbeat = None
+        folders = self.held()
+        if folders:
+            try:
+                Database.get_instance().release_folder_leases(self.worker_id, folders)
+            except Exception:
+                logging.exception("work queue: could not release leases")
+            with self._lock:
+                self._held.clear()
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+
+import argparse
+import logging
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+import settings as imgdb_settings
+from database import Database
+
+#
+# Checks that several work queue workers split a folder tree without duplicate rows
+#
+# Makes a synthetic squid tree, enqueues its folders, lets --workers processes import
+# them from the queue and checks images, plate_acquisition and ingest_queue afterwards.
+# Run against a test database (created from db/db_commands.sql), the rows are left
+# in the tables:
+#
+# CONF_FILE=settings_test.json python3 work_queue_check.py --folders 20 --images 50 --workers 2
+#
+
+WELLS = [f"{row}{col:02d}" for row in "BCDEFG" for col in range(2, 12)]
+CHANNELS = ['Fluorescence_405_nm_Ex', 'Fluorescence_488_nm_Ex', 'Fluorescence_561_nm_Ex',
+            'Fluorescence_638_nm_Ex', 'Fluorescence_730_nm_Ex']
+
+
+def connect():
+    Database.get_instance().initialize_connection_pool(
+        user=imgdb_settings.DB_USER,
+        password=imgdb_settings.DB_PASS,
+        host=imgdb_settings.DB_HOSTNAME,
+        port=imgdb_settings.DB_PORT,
+        database=imgdb_settings.DB_NAME
+    )
+
+
+def make_tree(root: str, folder_count: int, images_per_folder: int):
+    tiff = np.random.default_rng(0).integers(0, 255, (16, 16), dtype=np.uint8)
+    # written an hour ago, so the files are not deferred as still being written (FILE_STABLE_SECONDS)
+    written = time.time() - 3600
+    folders = []
+    for i in range(folder_count):
+        folder = os.path.join(root, 'squid', 'wq-check', f"wq-check-P{i:03d}_2024-01-01_12.00.{i % 60:02d}")
+        os.makedirs(folder)
+        for n in range(images_per_folder):
+            well = WELLS[n // (len(CHANNELS) * 4) % len(WELLS)]
+            site = n // len(CHANNELS) % 4 + 1
+            channel = CHANNELS[n % len(CHANNELS)]
+            path = os.path.join(folder, f"{well}_s{site}_x0_y0_z{n // (len(CHANNELS) * 4 * len(WELLS))}_{channel}.tiff")
+            cv2.imwrite(path, tiff)
+            os.utime(path, (written, written))
+        folders.append((folder, os.stat(folder).st_mtime))
+    return folders
+
+
+def run_worker(worker_id: str):
+    logging.basicConfig(format=f'%(asctime)s {worker_id} %(levelname)-8s %(message)s', level=logging.WARNING)
+    import image_monitor
+    from work_queue import FolderWorkQueue
+
+    connect()
+    Database.get_instance().load_channel_map_mapping()
+    image_monitor.configure_file_stability()
+    image_monitor.work_queue = FolderWorkQueue(worker_id, lease_seconds=30)
+    try:
+        image_monitor.drain_work_queue(time.time() + 3600)
+    finally:
+        image_monitor.work_queue.close()
+        if image_monitor.thumbnail_stage is not None:
+            image_monitor.thumbnail_stage.close()
+
+
+def query(sql, params):
+    conn = Database.get_instance().get_connection()
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+    finally:
+        Database.get_instance().release_connection(conn)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Checks that work queue workers split a tree without duplicates')
+    parser.add_argument('--root', default=tempfile.gettempdir(), help='Dir to make the synthetic tree in')
+    parser.add_argument('--folders', type=int, default=20)
+    parser.add_argument('--images', type=int, default=50, help='Images per folder')
+    parser.add_argument('--workers', type=int, default=2)
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s %(levelname)-8s %(message)s', level=logging.INFO)
+
+    root = tempfile.mkdtemp(prefix='wq-check-', dir=args.root)
+    folders = make_tree(root, args.folders, args.images)
+    like_root = root.replace('_', '\\_') + '/%'
+    logging.info(f"made {len(folders)} folders with {args.images} images each in {root}")
+
+    connect()
+    Database.get_instance().enqueue_folders(folders)
+
+    # spawn, so that no worker inherits the connection pool of this process
+    context = multiprocessing.get_context('spawn')
+    start = time.time()
+    workers = [context.Process(target=run_worker, args=(f"wq-check-{i}",)) for i in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    logging.info(f"{args.workers} workers done in {time.time() - start:.1f}s")
+
+    images = query("SELECT count(*), count(DISTINCT path) FROM images WHERE path LIKE %s", (like_root,))[0]
+    acquisitions = query("SELECT count(*), count(DISTINCT folder) FROM plate_acquisition WHERE folder LIKE %s", (like_root,))[0]
+    uploads = query("SELECT count(*), count(DISTINCT path) FROM upload_to_s3 WHERE path LIKE %s", (like_root,))[0]
+    by_worker = query("SELECT done_by, count(*) FROM ingest_queue WHERE folder LIKE %s AND done IS NOT NULL "
+                      "GROUP BY done_by ORDER BY done_by", (like_root,))
+    not_done = query("SELECT count(*) FROM ingest_queue WHERE folder LIKE %s AND done IS NULL", (like_root,))[0][0]
+
+    logging.info(f"images: {images[0]} rows, {images[1]} distinct paths (expected {args.folders * args.images})")
+    logging.info(f"plate_acquisition: {acquisitions[0]} rows, {acquisitions[1]} distinct folders (expected {args.folders})")
+    logging.info(f"upload_to_s3: {uploads[0]} rows, {uploads[1]} distinct paths")
+    logging.info(f"folders per worker: {dict(by_worker)}, not done: {not_done}")
+
+    ok = (images[0] == images[1] == args.folders * args.images
+          and acquisitions[0] == acquisitions[1] == args.folders
+          and uploads[0] == uploads[1]
+          and not_done == 0)
+    logging.info("OK" if ok else "FAILED")
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -47,6 +47,12 @@ CREATE INDEX  ix_images_plate_acquisition_name_textsearch ON images USING GIN (t
 -- ALTER TABLE images ADD COLUMN plate_acquisition_name text;
 -- UPDATE images SET plate_acquisition_name=plate_barcode;
 
+-- Unique path, needed by ON CONFLICT (path) DO NOTHING in image_monitor inserts
+-- (on an existing database run db/migrations.sql, it removes duplicate paths first)
+CREATE UNIQUE INDEX CONCURRENTLY ix_images_path_unique ON images(path);
+-- Prefix (LIKE 'folder/%') lookups of all known paths in a folder
+CREATE INDEX CONCURRENTLY ix_images_path_pattern ON images(path text_pattern_ops);
+
 
 DROP TABLE IF EXISTS plate_acquisition CASCADE;
 CREATE TABLE plate_acquisition (
@@ -60,6 +66,7 @@ CREATE TABLE plate_acquisition (
   name              text,
   project           text,
   finished          timestamp,
+  finished_changed  timestamptz,
   comment           text
 );
 CREATE INDEX ix_plate_acquisition_plate_barcode ON plate_acquisition(plate_barcode);
@@ -71,6 +78,67 @@ CREATE INDEX ix_plate_acquisition_project ON plate_acquisition(project);
 CREATE INDEX ix_plate_acquisition_imaged ON plate_acquisition(imaged);
 CREATE INDEX ix_plate_acquisition_finished ON plate_acquisition(finished);
 CREATE INDEX ix_plate_acquisition_comment ON plate_acquisition(comment);
+CREATE INDEX ix_plate_acquisition_finished_changed ON plate_acquisition(finished_changed);
+
+-- finished_changed is when finished was last set or changed, by any writer (image_monitor,
+-- backfill, dbscripts, by hand). image_monitor fetches newly finished acquisitions by it,
+-- since finished itself may be backdated (e.g. to the folder's mtime by backfill)
+CREATE OR REPLACE FUNCTION plate_acquisition_finished_changed() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'INSERT' OR NEW.finished IS DISTINCT FROM OLD.finished THEN
+    NEW.finished_changed := clock_timestamp();
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tr_plate_acquisition_finished_changed ON plate_acquisition;
+CREATE TRIGGER tr_plate_acquisition_finished_changed
+  BEFORE INSERT OR UPDATE OF finished ON plate_acquisition
+  FOR EACH ROW EXECUTE FUNCTION plate_acquisition_finished_changed();
+
+-- On an existing database db/migrations.sql adds the column, index, function and trigger
+-- (and the tables below)
+
+-- Ingest lag, seconds from file mtime until the images row is committed, per acquisition
+-- (written by image_monitor when the acquisition is marked finished)
+DROP TABLE IF EXISTS plate_acquisition_ingest_lag;
+CREATE TABLE plate_acquisition_ingest_lag (
+  plate_acquisition_id  int PRIMARY KEY REFERENCES plate_acquisition(id) ON DELETE CASCADE,
+  images                int,
+  lag_p50               real,
+  lag_p95               real,
+  lag_max               real,
+  computed              timestamp
+);
+
+-- Work queue of acquisition folders, shared by image_monitor workers (WORK_QUEUE setting):
+-- discovery enqueues folders with their dir mtime, workers claim them with
+-- FOR UPDATE SKIP LOCKED and hold a lease that is renewed while they import
+DROP TABLE IF EXISTS ingest_queue;
+CREATE TABLE ingest_queue (
+  folder         text PRIMARY KEY,
+  dir_mtime      double precision,
+  enqueued       timestamptz DEFAULT now(),
+  lease_owner    text,
+  lease_until    timestamptz,
+  attempts       int DEFAULT 0,
+  done           timestamptz,
+  done_by        text,
+  last_imported  timestamptz,
+  last_error     text
+);
+CREATE INDEX ix_ingest_queue_pending ON ingest_queue(dir_mtime DESC) WHERE done IS NULL;
+
+-- Mounts read in the live io lane (see cli/io_scheduler.py): image_monitor marks a
+-- mount live while it reads unfinished acquisitions from it, backfill and other
+-- processes hold back their bulk reads of the mount until live_until has passed
+DROP TABLE IF EXISTS io_live_lane;
+CREATE TABLE io_live_lane (
+  mount       text PRIMARY KEY,
+  live_until  timestamptz NOT NULL,
+  owner       text
+);
 
 
 
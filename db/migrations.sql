@@ -0,0 +1,117 @@
+--
+-- Upgrade of an existing imagedb database for the current image_monitor, backfill
+-- and dbscripts. Every step can be run again (IF NOT EXISTS / OR REPLACE), new
+-- databases get the same from db_commands.sql.
+--
+-- Run the steps in this order, with the old image_monitor stopped (it may insert
+-- duplicate paths again until the unique index exists), then start the new one:
+--
+--   psql -X --set ON_ERROR_STOP=on -f db/migrations.sql imagedb
+--
+-- psql runs every statement in its own transaction (autocommit), which the
+-- CREATE INDEX CONCURRENTLY statements need.
+--
+
+
+--
+-- 1. Unique images.path, needed by the ON CONFLICT (path) DO NOTHING inserts
+--
+
+-- The unique index can not be built while a path is in images more than once,
+-- list them with:
+--   SELECT path, count(*) FROM images GROUP BY path HAVING count(*) > 1;
+-- The first row (lowest id) of every path is kept. If the kept row has no
+-- upload_to_s3 row, the one of its first removed duplicate is moved to it, the
+-- upload_to_s3 rows of the removed duplicates are dropped.
+CREATE TEMP TABLE images_duplicate_path AS
+  SELECT id, keep_id
+  FROM (
+    SELECT id, min(id) OVER (PARTITION BY path) AS keep_id
+    FROM images
+    WHERE path IN (SELECT path FROM images GROUP BY path HAVING count(*) > 1)
+  ) AS dup
+  WHERE id <> keep_id;
+
+UPDATE upload_to_s3 u SET image_id = m.keep_id
+  FROM (
+    SELECT DISTINCT ON (d.keep_id) dup_upload.ctid AS upload_ctid, d.keep_id
+    FROM upload_to_s3 dup_upload
+    JOIN images_duplicate_path d ON dup_upload.image_id = d.id
+    WHERE NOT EXISTS (SELECT 1 FROM upload_to_s3 k WHERE k.image_id = d.keep_id)
+    ORDER BY d.keep_id, d.id
+  ) AS m
+  WHERE u.ctid = m.upload_ctid;
+DELETE FROM upload_to_s3 u USING images_duplicate_path d WHERE u.image_id = d.id;
+DELETE FROM images i USING images_duplicate_path d WHERE i.id = d.id;
+DROP TABLE images_duplicate_path;
+
+-- If a CREATE INDEX CONCURRENTLY failed before (e.g. on a duplicate), it left an
+-- invalid index that IF NOT EXISTS would keep, drop it and run this file again:
+--   SELECT indexrelid::regclass FROM pg_index WHERE NOT indisvalid;
+--   DROP INDEX CONCURRENTLY ix_images_path_unique;
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_images_path_unique ON images(path);
+-- Prefix (LIKE 'folder/%') lookups of the known paths in a folder
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_images_path_pattern ON images(path text_pattern_ops);
+
+
+--
+-- 2. plate_acquisition.finished_changed, image_monitor fetches newly finished
+--    acquisitions by it (without it they are reloaded in full every poll)
+--
+ALTER TABLE plate_acquisition ADD COLUMN IF NOT EXISTS finished_changed timestamptz;
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_plate_acquisition_finished_changed ON plate_acquisition(finished_changed);
+
+CREATE OR REPLACE FUNCTION plate_acquisition_finished_changed() RETURNS trigger AS $$
+BEGIN
+  IF TG_OP = 'INSERT' OR NEW.finished IS DISTINCT FROM OLD.finished THEN
+    NEW.finished_changed := clock_timestamp();
+  END IF;
+  RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS tr_plate_acquisition_finished_changed ON plate_acquisition;
+CREATE TRIGGER tr_plate_acquisition_finished_changed
+  BEFORE INSERT OR UPDATE OF finished ON plate_acquisition
+  FOR EACH ROW EXECUTE FUNCTION plate_acquisition_finished_changed();
+
+
+--
+-- 3. Ingest lag per acquisition (without it the lag is not stored)
+--
+CREATE TABLE IF NOT EXISTS plate_acquisition_ingest_lag (
+  plate_acquisition_id  int PRIMARY KEY REFERENCES plate_acquisition(id) ON DELETE CASCADE,
+  images                int,
+  lag_p50               real,
+  lag_p95               real,
+  lag_max               real,
+  computed              timestamp
+);
+
+
+--
+-- 4. Work queue of acquisition folders (needed with WORK_QUEUE other than off)
+--
+CREATE TABLE IF NOT EXISTS ingest_queue (
+  folder         text PRIMARY KEY,
+  dir_mtime      double precision,
+  enqueued       timestamptz DEFAULT now(),
+  lease_owner    text,
+  lease_until    timestamptz,
+  attempts       int DEFAULT 0,
+  done           timestamptz,
+  done_by        text,
+  last_imported  timestamptz,
+  last_error     text
+);
+CREATE INDEX IF NOT EXISTS ix_ingest_queue_pending ON ingest_queue(dir_mtime DESC) WHERE done IS NULL;
+
+
+--
+-- 5. Shared live io lane (needed with IO_SHARED_LIVE_LANE, not shared without it)
+--
+CREATE TABLE IF NOT EXISTS io_live_lane (
+  mount       text PRIMARY KEY,
+  live_until  timestamptz NOT NULL,
+  owner       text
+);